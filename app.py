@@ -41,6 +41,11 @@ def create_app():
     # 创建必要的目录
     create_directories(app)
 
+    # 选课排队模式只能单进程运行，启动时即检查，避免多进程部署后凭证查询 404
+    if app.config.get('REGISTRATION_QUEUE_ENABLED'):
+        from services.registration_queue import get_registration_queue
+        get_registration_queue(app)
+
     # Favicon 路由
     @app.route('/favicon.ico')
     def favicon():
@@ -128,4 +133,5 @@ if __name__ == '__main__':
         print(f"访问地址: http://127.0.0.1:5000")
         print("=" * 50)
 
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # 自动重载会在子进程中再创建一次应用，排队模式下关闭
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=not app.config['REGISTRATION_QUEUE_ENABLED'])
\ No newline at end of file
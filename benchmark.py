@@ -0,0 +1,1298 @@
+# benchmark.py
+"""性能基准与回归检查（使用临时数据库，不会影响 student_management.db）
+
+用法：
+    python benchmark.py                # 运行全部项目
+    python benchmark.py serializers    # 只运行指定项目
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time as timer
+from contextlib import contextmanager
+from datetime import time
+
+# 必须在导入 app 之前切换到临时数据库
+_db_file = tempfile.NamedTemporaryFile(prefix='sms_bench_', suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = 'sqlite:///' + _db_file.name
+
+from flask import current_app
+from sqlalchemy import event
+from app import create_app
+from models import db, User, Class, Course, Schedule, SelectedCourse, Grade
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """注册一个基准项目"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+@contextmanager
+def count_queries():
+    """统计代码块内执行的 SQL 语句数"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def stopwatch(label):
+    """输出代码块耗时"""
+    start = timer.perf_counter()
+    yield
+    print(f"    {label}: {(timer.perf_counter() - start) * 1000:.1f} ms")
+
+
+def reset_database():
+    """清空临时数据库（直接删除文件，避免 users/classes 外键循环导致 drop_all 告警）"""
+    db.session.remove()
+    db.engine.dispose()
+    if os.path.exists(_db_file.name):
+        os.remove(_db_file.name)
+    db.create_all()
+
+
+def seed(students=100, courses=20, teachers=5, classes=2):
+    """批量生成测试数据：班级、教师、学生、课程、课表、选课和成绩"""
+    counselor = User(username='bench_coun', email='bench_coun@bench.edu', real_name='辅导员', role='counselor')
+    db.session.add(counselor)
+    db.session.flush()
+
+    class_rows = [Class(class_name=f'基准班级{i}', counselor_id=counselor.id) for i in range(classes)]
+    db.session.add_all(class_rows)
+    db.session.flush()
+
+    teacher_rows = [User(username=f'bench_tea{i}', email=f'bench_tea{i}@bench.edu',
+                         real_name=f'教师{i}', role='teacher') for i in range(teachers)]
+    student_rows = [User(username=f'bench_stu{i}', email=f'bench_stu{i}@bench.edu', real_name=f'学生{i}',
+                         role='student', class_id=class_rows[i % classes].id) for i in range(students)]
+    db.session.add_all(teacher_rows + student_rows)
+    db.session.flush()
+
+    course_rows = [Course(course_code=f'BENCH{i:04d}', course_name=f'课程{i}', credit=2 + i % 3,
+                          teacher_id=teacher_rows[i % teachers].id, class_id=class_rows[i % classes].id)
+                   for i in range(courses)]
+    db.session.add_all(course_rows)
+    db.session.flush()
+
+    for i, course in enumerate(course_rows):
+        db.session.add(Schedule(course_id=course.id, class_id=course.class_id, teacher_id=course.teacher_id,
+                                day_of_week=1 + i % 5, start_time=time(8 + 2 * (i // 5 % 5), 0),
+                                end_time=time(9 + 2 * (i // 5 % 5), 40), location=f'教学楼A-{100 + i}'))
+
+    for i, student in enumerate(student_rows):
+        for course in course_rows[i % courses:i % courses + 3]:
+            score = float((i * 7 + course.id * 13) % 60 + 40)
+            db.session.add(SelectedCourse(student_id=student.id, course_id=course.id))
+            db.session.add(Grade(student_id=student.id, course_id=course.id, teacher_id=course.teacher_id,
+                                 score=score, grade_point=0.0, grade_level='F',
+                                 academic_year='2024-2025', semester='秋季'))
+
+    db.session.commit()
+
+    from services.selection import rebuild_counters
+    rebuild_counters()
+    return {'counselor': counselor, 'classes': class_rows, 'teachers': teacher_rows,
+            'students': student_rows, 'courses': course_rows}
+
+
+@benchmark('serializers')
+def bench_serializers():
+    """批量序列化：查询次数不随行数增长"""
+    from services.serializers import serialize
+    from models import AcademicAlert, alert_failed_courses
+
+    counts = {}
+    for students in (10, 200):
+        reset_database()
+        data = seed(students=students, courses=40)
+        # 每个学生一条预警，关联两门挂科课程
+        db.session.add_all([AcademicAlert(student_id=student.id, counselor_id=data['counselor'].id,
+                                          alert_level='三级', failed_courses='["课程0", "课程1"]', total_failed=2,
+                                          semester='2024-2025-1')
+                            for student in data['students']])
+        db.session.flush()
+        db.session.execute(alert_failed_courses.insert(), [
+            {'alert_id': alert_id, 'course_id': course.id}
+            for (alert_id,) in db.session.query(AcademicAlert.id) for course in data['courses'][:2]])
+        db.session.commit()
+        for model in (Schedule, SelectedCourse, Grade, AcademicAlert):
+            db.session.expunge_all()
+            with count_queries() as statements:
+                rows = serialize(model.query)
+            counts.setdefault(model.__name__, []).append((len(rows), len(statements)))
+
+    ok = True
+    for name, results in counts.items():
+        constant = len({queries for _, queries in results}) == 1
+        ok = ok and constant
+        detail = ', '.join(f'{rows} 行 -> {queries} 条SQL' for rows, queries in results)
+        print(f"    {name}: {detail} {'[恒定]' if constant else '[随行数增长]'}")
+    return ok
+
+
+@benchmark('grade_upsert')
+def bench_grade_upsert():
+    """成绩批量写入：按学号导入时查询次数不随行数增长，改考试类型保存不产生第二条成绩"""
+    from services.grades import upsert_grades
+    from services.grade_stats import get_course_stats
+
+    reset_database()
+    data = seed(students=300, courses=10)
+    teacher = data['teachers'][0]
+    course = Course(course_code='BENCH_IMPORT', course_name='导入课程', credit=3, teacher_id=teacher.id,
+                    class_id=data['classes'][0].id)
+    db.session.add(course)
+    db.session.flush()
+    db.session.add_all([SelectedCourse(student_id=student.id, course_id=course.id) for student in data['students']])
+    course_id, teacher_id = course.id, teacher.id
+    usernames = [student.username for student in data['students']]
+    db.session.commit()
+
+    ok = True
+    counts = []
+    for label, size in (('新增 30 行', 30), ('新增 300 行', 300), ('更新 300 行', 300)):
+        rows = [{'username': username, 'score': (i * 37) % 101} for i, username in enumerate(usernames[:size])]
+        start = timer.perf_counter()
+        with count_queries() as statements:
+            result = upsert_grades(course_id, teacher_id, rows)
+        elapsed = (timer.perf_counter() - start) * 1000
+        counts.append(len(statements))
+        ok = ok and result.success_count == size and not result.errors
+        print(f"    {label}: 成功 {result.success_count} 条（新增 {result.inserted}，更新 {result.updated}），"
+              f"{len(statements)} 条SQL，{elapsed:.1f} ms")
+
+    # 同一学生同一课程只有一条成绩：改考试类型保存是更新，未给出考试类型时按默认值
+    upsert_grades(course_id, teacher_id, [{'username': usernames[0], 'score': 85}], exam_type='期中')
+    upsert_grades(course_id, teacher_id, [{'username': usernames[1], 'score': 85}], exam_type=None)
+    switched = db.session.query(Grade.exam_type, Grade.score).join(User, User.id == Grade.student_id).filter(
+        Grade.course_id == course_id, User.username.in_(usernames[:2])).order_by(User.username).all()
+    stats = get_course_stats(course_id)
+
+    total = Grade.query.filter_by(course_id=course_id).count()
+    # 统计摘要和成绩单的维护各为固定条数的 SQL，只要求语句数不随行数增长
+    ok = ok and total == 300 and counts[0] == counts[1] and counts[2] <= counts[1] and stats.count == 300 \
+        and sorted(switched) == [('期中', 85.0), ('期末', 85.0)]
+    print(f"    课程成绩 {total} 条（唯一约束下无重复），改考试类型后 {switched}，统计人数 {stats.count}，"
+          f"逐行实现约需 {3 * 300} 条SQL")
+    return ok
+
+
+@benchmark('grading')
+def bench_grading(size=200000):
+    """评分标准：一次映射大量成绩（NumPy searchsorted，未安装时逐个 bisect）"""
+    from services import grading
+
+    rng = random.Random(3)
+    scores = [round(rng.uniform(0, 100), 1) for _ in range(size)]
+    scale = grading.get_scale('gpa_4_3')
+
+    start = timer.perf_counter()
+    expected = [(scale.grade_point(score), scale.grade_level(score)) for score in scores]
+    scalar = timer.perf_counter() - start
+
+    start = timer.perf_counter()
+    points, levels = scale.grade(scores)
+    batch = timer.perf_counter() - start
+
+    engine = 'NumPy searchsorted' if grading.np is not None else 'bisect（未安装 NumPy）'
+    print(f"    {size} 个成绩：逐个查表 {scalar * 1000:.0f} ms，批量映射[{engine}] {batch * 1000:.0f} ms")
+    return list(zip(points, levels)) == expected
+
+
+@benchmark('grade_export')
+def bench_grade_export(students=5000):
+    """成绩导出：原实现（逐行懒加载 ORM 对象 + 全量列宽扫描）与流式导出的耗时和峰值内存"""
+    import tracemalloc
+    from services import grade_export
+
+    reset_database()
+    data = seed(students=students, courses=1)
+    course_id = data['courses'][0].id
+    db.session.expunge_all()
+
+    def measure(label, func):
+        db.session.expunge_all()
+        tracemalloc.start()
+        start = timer.perf_counter()
+        with count_queries() as statements:
+            rows = func()
+        elapsed = timer.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"    {label}: {rows} 行，{len(statements)} 条SQL，{elapsed * 1000:.0f} ms，峰值内存 {peak / 1024 / 1024:.1f} MB")
+        return rows
+
+    def legacy():
+        # 原 export_grades 的取数与列宽计算（未安装 pandas 时省略 DataFrame/ExcelWriter 部分）
+        grades = Grade.query.filter_by(course_id=course_id).all()
+        table = [{
+            '学号': grade.student.username,
+            '姓名': grade.student.real_name,
+            '班级': grade.student.class_info.class_name if grade.student.class_info else '',
+            '成绩': grade.score,
+            '绩点': grade.grade_point,
+            '等级': grade.grade_level,
+            '考试类型': grade.exam_type,
+            '考试日期': grade.exam_date.strftime('%Y-%m-%d') if grade.exam_date else '',
+            '评语': grade.comments or ''
+        } for grade in grades]
+        for name in grade_export.EXPORT_COLUMNS:
+            max(len(str(row[name])) for row in table)
+        return len(table)
+
+    def streaming_csv():
+        return sum(chunk.count('\n') for chunk in grade_export.stream_csv([course_id])) - 1
+
+    def streaming_xlsx():
+        with tempfile.TemporaryFile() as output:
+            grade_export.write_xlsx([course_id], '基准成绩', output)
+        return students
+
+    expected = measure('原实现（ORM 懒加载）', legacy)
+    ok = measure('流式 CSV', streaming_csv) == expected
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        print("    流式 XLSX: 未安装 openpyxl，跳过")
+    else:
+        measure('流式 XLSX', streaming_xlsx)
+    return ok
+
+
+@benchmark('grade_import')
+def bench_grade_import(students=5000):
+    """成绩后台导入：CSV 分块解析与批量写入的吞吐量"""
+    import io
+    from werkzeug.datastructures import FileStorage
+    from services.grade_import import GradeImporter
+
+    reset_database()
+    data = seed(students=students, courses=1)
+    course_id, teacher_id = data['courses'][0].id, data['courses'][0].teacher_id
+    lines = ['学号,成绩,考试类型'] + [f'{student.username},{(i * 37) % 101},期中'
+                                    for i, student in enumerate(data['students'])]
+    lines += ['nobody,80,期中', 'bench_stu0,abc,期中']
+    content = '\n'.join(lines).encode('utf-8-sig')
+    db.session.remove()
+
+    importer = GradeImporter(current_app._get_current_object(), workers=1)
+    with stopwatch(f'提交 {len(lines) - 1} 行'):
+        job = importer.submit(course_id, teacher_id, FileStorage(io.BytesIO(content), filename='bench.csv'))
+    while job.status in ('queued', 'running'):
+        timer.sleep(0.05)
+
+    result = job.to_dict()
+    print(f"    {result['message']}，耗时 {result['elapsed_seconds']} s，{result['rows_per_second']} 行/秒")
+    imported = Grade.query.filter_by(course_id=course_id, exam_type='期中').count()
+    return job.status == 'done' and imported == students and job.error_count == 2
+
+
+@benchmark('grade_stats')
+def bench_grade_stats(students=20000):
+    """课程成绩统计：读取增量维护的摘要与逐行加载成绩后多次扫描的对比，并校验增量结果与重算一致"""
+    from services.grade_stats import get_course_stats, rebuild_stats
+    from services.grades import upsert_grades
+    from services.grading import get_scale
+    from models import CourseGradeStats
+
+    reset_database()
+    data = seed(students=students, courses=1)
+    course_id, teacher_id = data['courses'][0].id, data['courses'][0].teacher_id
+    student_ids = [student.id for student in data['students']]
+    with stopwatch('全量重算摘要'):
+        rebuild_stats()
+
+    def legacy():
+        grades = Grade.query.filter_by(course_id=course_id).all()
+        scores = [grade.score for grade in grades if grade.score is not None]
+        return {
+            'average_score': round(sum(scores) / len(scores), 2),
+            'pass_count': len([s for s in scores if s >= 60]),
+            'score_distribution': [len([s for s in scores if s >= 90]), len([s for s in scores if 80 <= s < 90]),
+                                   len([s for s in scores if 70 <= s < 80]), len([s for s in scores if 60 <= s < 70]),
+                                   len([s for s in scores if s < 60])]
+        }
+
+    db.session.expunge_all()
+    with stopwatch(f'原实现（加载 {students} 条成绩后扫描）'):
+        expected = legacy()
+    db.session.expunge_all()
+    with stopwatch('读取统计摘要'):
+        stats = get_course_stats(course_id).to_dict(get_scale())
+    ok = (stats['average_score'] == expected['average_score'] and stats['pass_count'] == expected['pass_count']
+          and list(stats['score_distribution'].values()) == expected['score_distribution'])
+    print(f"    中位数 {stats['median_score']}，标准差 {stats['std_dev']}，百分位 {stats['percentiles']}")
+
+    # 增量维护：批量改分后与全量重算比较
+    rng = random.Random(5)
+    rows = [{'student_id': student_id, 'score': round(rng.uniform(0, 100), 1)}
+            for student_id in rng.sample(student_ids, 500)]
+    with stopwatch('批量改 500 条成绩（含摘要维护）'):
+        upsert_grades(course_id, teacher_id, rows)
+    grade = Grade.query.filter_by(course_id=course_id).first()
+    grade.score = 100.0
+    db.session.delete(Grade.query.filter_by(course_id=course_id).order_by(Grade.id.desc()).first())
+    db.session.commit()
+
+    def snapshot():
+        db.session.expire_all()
+        row = db.session.get(CourseGradeStats, course_id)
+        return row.count, round(row.total, 4), round(row.total_sq, 2), row.min_score, row.max_score, \
+            row.pass_count, row.histogram
+
+    incremental = snapshot()
+    rebuild_stats()
+    consistent = incremental == snapshot()
+    print(f"    增量维护与全量重算一致: {'是' if consistent else '否'}")
+    return ok and consistent
+
+
+@benchmark('transcripts')
+def bench_transcripts(students=5000):
+    """学生成绩单：读取维护好的成绩单与逐条加载成绩和课程的对比，并校验增量维护与全量重建一致"""
+    from services.grades import upsert_grades
+    from services.transcripts import rebuild_transcripts, get_transcript
+    from models import StudentTranscript
+
+    reset_database()
+    data = seed(students=students, courses=40)
+    with stopwatch(f'全量重建 {students} 名学生的成绩单'):
+        rebuild_transcripts()
+    student_id = data['students'][0].id
+    course_id, teacher_id = data['courses'][0].id, data['courses'][0].teacher_id
+    other_course_id = data['courses'][1].id
+
+    db.session.expunge_all()
+    with count_queries() as legacy_statements, stopwatch('原实现（加载成绩并逐条加载课程）'):
+        grades = Grade.query.filter_by(student_id=student_id).all()
+        sum(grade.course.credit for grade in grades if grade.course)
+    db.session.expunge_all()
+    with count_queries() as statements, stopwatch('读取成绩单'):
+        cumulative, _ = get_transcript(student_id)
+    print(f"    SQL 语句数: {len(legacy_statements)} -> {len(statements)}，累计绩点 {cumulative.gpa:.2f}")
+
+    # 增量维护：批量改分、ORM 改分和改学分后与全量重建比较
+    rng = random.Random(7)
+    enrolled = [enrolled_id for (enrolled_id,) in db.session.query(SelectedCourse.student_id).filter_by(
+        course_id=course_id).all()]
+    with stopwatch(f'批量改 {len(enrolled)} 条成绩（含成绩单维护）'):
+        upsert_grades(course_id, teacher_id,
+                      [{'student_id': enrolled_id, 'score': rng.uniform(0, 100)} for enrolled_id in enrolled])
+    grade = Grade.query.filter_by(student_id=student_id).first()
+    grade.score, grade.grade_point = 30.0, 0.0
+    db.session.get(Course, other_course_id).credit = 5
+    db.session.commit()
+
+    def snapshot():
+        db.session.expire_all()
+        return sorted((row.student_id, row.academic_year, row.semester, row.course_count, row.total_credits,
+                       row.earned_credits, row.failed_count, round(row.gpa or 0, 6))
+                      for row in StudentTranscript.query.all())
+
+    incremental = snapshot()
+    rebuild_transcripts()
+    consistent = incremental == snapshot()
+    print(f"    增量维护与全量重建一致: {'是' if consistent else '否'}")
+    return consistent and len(statements) == 1
+
+
+@benchmark('alerts')
+def bench_alerts(students=50000, courses=16, terms=4):
+    """学业预警：全校学生全量生成与只处理成绩变化学生的增量生成，各阶段耗时，成绩更正后解除预警"""
+    from services.alerts import run_alert_engine, format_timings
+    from services.grades import upsert_grades
+    from services.transcripts import rebuild_transcripts, refresh_transcripts
+    from models import AcademicAlert, alert_failed_courses
+
+    reset_database()
+    data = seed(students=0, courses=courses, classes=20)
+    class_ids = [row.id for row in data['classes']]
+    course_ids = [(course.id, course.teacher_id) for course in data['courses']]
+    years = ['2022-2023', '2023-2024']
+
+    # 大量学生和成绩直接批量插入（ORM 逐个 add 太慢）
+    with stopwatch(f'批量生成 {students} 名学生、每人 {terms} 学期成绩'):
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'bench_s{i}', 'email': f'bench_s{i}@bench.edu', 'real_name': f'学生{i}', 'role': 'student',
+             'class_id': class_ids[i % len(class_ids)], 'password_hash': '', 'selected_credits': 0}
+            for i in range(students)])
+        student_ids = [student_id for (student_id,) in db.session.query(User.id).filter(
+            User.username.like('bench_s%')).all()]
+        rng = random.Random(11)
+        per_term = len(course_ids) // terms
+        rows = []
+        for student_id in student_ids:
+            weak = rng.random() < 0.1
+            for index, (course_id, teacher_id) in enumerate(course_ids):
+                term = index // per_term
+                score = rng.uniform(20, 70) if weak else rng.uniform(50, 100)
+                rows.append({'student_id': student_id, 'course_id': course_id, 'teacher_id': teacher_id,
+                             'score': score, 'grade_point': 0.0 if score < 60 else round((score - 50) / 10, 1),
+                             'grade_level': 'F' if score < 60 else 'C', 'exam_type': '期末',
+                             'academic_year': years[term // 2], 'semester': ['秋季', '春季'][term % 2]})
+        db.session.execute(Grade.__table__.insert(), rows)
+        db.session.execute(SelectedCourse.__table__.insert(), [
+            {'student_id': row['student_id'], 'course_id': row['course_id']} for row in rows
+            if row['course_id'] == course_ids[0][0]])
+        db.session.commit()
+    with stopwatch('重建成绩单'):
+        rebuild_transcripts()
+
+    start = timer.perf_counter()
+    run = run_alert_engine(incremental=False)
+    full_seconds = timer.perf_counter() - start
+    print(f"    全量：扫描 {run.students_scanned} 名学生，新增 {run.alerts_created} 条预警，"
+          f"{full_seconds:.1f} s（{format_timings(run)}）")
+
+    # 修改一门课部分学生的成绩后增量生成
+    course_id, teacher_id = course_ids[0]
+    changed = student_ids[:200]
+    upsert_grades(course_id, teacher_id, [{'student_id': student_id, 'score': 10} for student_id in changed])
+    run = run_alert_engine()
+    print(f"    增量：扫描 {run.students_scanned} 名学生，新增 {run.alerts_created} 条、更新 {run.alerts_updated} 条"
+          f"（{format_timings(run)}）")
+    incremental_ok = run.incremental and run.students_scanned == len(changed)
+
+    # 成绩更正后不再触发的预警：增量运行解除，之后的全量运行不再改动
+    corrected = [student_id for (student_id,) in db.session.query(AcademicAlert.student_id).filter(
+        AcademicAlert.status == 'active').distinct().limit(20)]
+    active = AcademicAlert.query.filter(AcademicAlert.student_id.in_(corrected), AcademicAlert.status == 'active')
+    expected = active.count()
+    Grade.query.filter(Grade.student_id.in_(corrected)).update(
+        {'score': 90, 'grade_point': 4.0, 'grade_level': 'A'}, synchronize_session=False)
+    refresh_transcripts(corrected)
+    db.session.commit()
+    run = run_alert_engine()
+    resolved = AcademicAlert.query.filter(AcademicAlert.student_id.in_(corrected)).all()
+    cleared_ok = run.alerts_resolved == expected and not active.count() and \
+        all(alert.total_failed == 0 and not alert.courses and alert.failed_courses == '[]' for alert in resolved)
+    run = run_alert_engine(incremental=False)
+    cleared_ok = cleared_ok and run.alerts_resolved == 0 and not active.count()
+    print(f"    成绩更正：{len(corrected)} 名学生的 {expected} 条预警解除，全量复跑解除 {run.alerts_resolved} 条"
+          f"{'' if cleared_ok else '（不一致）'}")
+
+    total = AcademicAlert.query.count()
+    duplicates = total - db.session.query(AcademicAlert.student_id, AcademicAlert.semester).distinct().count()
+    links = db.session.query(db.func.count()).select_from(alert_failed_courses).scalar()
+    failed = db.session.query(db.func.sum(AcademicAlert.total_failed)).scalar()
+    print(f"    预警共 {total} 条，重复 {duplicates} 条；挂科课程关联 {links} 条（挂科数合计 {failed}）")
+    return full_seconds < 60 and incremental_ok and cleared_ok and duplicates == 0 and links == failed
+
+
+@benchmark('alert_list')
+def bench_alert_list(alerts=20000):
+    """预警列表：游标分页每页的 SQL 语句数和耗时不随页码增长（对比一次加载全部预警）"""
+    from datetime import datetime, timedelta
+    from services.alert_list import AlertFilters, get_alert_page, count_alerts
+    from models import AcademicAlert
+
+    reset_database()
+    data = seed(students=200, courses=5)
+    counselor_id = data['counselor'].id
+    student_ids = [student.id for student in data['students']]
+    start = datetime(2024, 9, 1)
+    db.session.bulk_insert_mappings(AcademicAlert, [
+        {'student_id': student_ids[i % len(student_ids)], 'counselor_id': counselor_id, 'alert_level': '三级',
+         'failed_courses': '[]', 'total_failed': 2, 'reason': '本学期挂科2门', 'semester': f'2024-{i}',
+         'status': 'active', 'created_at': start + timedelta(minutes=i // 3), 'updated_at': start}
+        for i in range(alerts)])
+    db.session.commit()
+    filters = AlertFilters(counselor_id, status='active')
+
+    db.session.expunge_all()
+    with stopwatch(f'原实现（一次加载 {alerts} 条预警及学生、班级）'):
+        for alert in AcademicAlert.query.filter_by(counselor_id=counselor_id, status='active').order_by(
+                AcademicAlert.created_at.desc()).all():
+            alert.student.class_info
+
+    counts, seen, cursor, pages = [], set(), None, 0
+    page_start = timer.perf_counter()
+    while True:
+        db.session.expunge_all()
+        with count_queries() as statements:
+            page = get_alert_page(filters, cursor)
+        counts.append(len(statements))
+        seen.update(alert.id for alert in page.alerts)
+        pages += 1
+        cursor = page.next_cursor
+        if not cursor:
+            break
+    elapsed = (timer.perf_counter() - page_start) * 1000
+    print(f"    游标分页 {pages} 页：平均每页 {elapsed / pages:.1f} ms，每页 SQL {min(counts)}-{max(counts)} 条")
+
+    with count_queries() as statements:
+        total = count_alerts(filters), count_alerts(filters)
+    print(f"    总数 {total[0]}（两次读取共 {len(statements)} 条SQL），分页取到 {len(seen)} 条不重复预警")
+    return len(set(counts)) == 1 and len(seen) == alerts == total[0] and len(statements) == 1
+
+
+@benchmark('alert_export')
+def bench_alert_export(alerts=5000):
+    """预警导出：原实现（字符串拼接 + 逐行懒加载学生、班级、课程）与流式导出的耗时和峰值内存，并检查字段转义"""
+    import csv
+    import io
+    import tracemalloc
+    from services import alert_export
+    from services.alert_list import AlertFilters, alert_query
+    from models import AcademicAlert, alert_failed_courses
+
+    reset_database()
+    data = seed(students=alerts, courses=4)
+    counselor_id = data['counselor'].id
+    course_ids = [course.id for course in data['courses']]
+    student_ids = [student.id for student in data['students']]
+    # 原因中带逗号、引号和换行，原实现写出的 CSV 列会错位
+    reason = '本学期挂科2门，含"高数"与英语,需重点关注\n建议约谈'
+    db.session.bulk_insert_mappings(AcademicAlert, [
+        {'student_id': student_id, 'counselor_id': counselor_id, 'alert_level': '三级',
+         'failed_courses': '["课程0", "课程1"]', 'total_failed': 2, 'reason': reason, 'semester': '2024-2025-1',
+         'status': 'active'} for student_id in student_ids])
+    alert_ids = db.session.query(AcademicAlert.id).all()
+    db.session.execute(alert_failed_courses.insert(), [
+        {'alert_id': alert_id, 'course_id': course_id} for (alert_id,) in alert_ids for course_id in course_ids[:2]])
+    db.session.commit()
+    filters = AlertFilters(counselor_id)
+
+    def measure(label, func):
+        db.session.expunge_all()
+        tracemalloc.start()
+        start = timer.perf_counter()
+        with count_queries() as statements:
+            result = func()
+        elapsed = timer.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"    {label}: {len(statements)} 条SQL，{elapsed * 1000:.0f} ms，峰值内存 {peak / 1024 / 1024:.1f} MB")
+        return result
+
+    def legacy():
+        # 原 export_alerts 的写法：逐行访问关系并拼接字符串
+        content = "学号,姓名,班级,预警等级,挂科数量,挂科科目,预警原因,学期\n"
+        for alert in AcademicAlert.query.filter_by(counselor_id=counselor_id).order_by(
+                AcademicAlert.alert_level, AcademicAlert.created_at).all():
+            student = alert.student
+            class_name = student.class_info.class_name if student and student.class_info else ''
+            course_names = '、'.join(course.course_name for course in alert.courses)
+            content += f'{student.username},{student.real_name},{class_name},'
+            content += f'{alert.alert_level},{alert.total_failed},'
+            content += f'"{course_names}","{alert.reason}",{alert.semester}\n'
+        return content
+
+    def streaming_csv():
+        return sum(len(chunk) for chunk in alert_export.stream_csv(filters))
+
+    def streaming_xlsx():
+        with tempfile.TemporaryFile() as output:
+            alert_export.write_xlsx(filters, '学业预警名单', output)
+
+    measure('原实现（字符串拼接）', legacy)
+    measure('流式 CSV', streaming_csv)
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        print("    流式 XLSX: 未安装 openpyxl，跳过")
+    else:
+        measure('流式 XLSX', streaming_xlsx)
+
+    content = ''.join(alert_export.stream_csv(filters))
+    rows = list(csv.reader(io.StringIO(content.lstrip('\ufeff'))))
+    expected = alert_export.ALERT_EXPORT_COLUMNS
+    width_ok = all(len(row) == len(expected) for row in rows)
+    reason_ok = all(row[6] == reason and row[5] == '课程0、课程1' for row in rows[1:])
+    bom_ok = content.startswith('\ufeff') and not next(alert_export.stream_csv(filters, bom=False)).startswith('\ufeff')
+    order_ok = [row[0] for row in rows[1:]] == [alert.student.username for alert in alert_query(filters).order_by(
+        AcademicAlert.alert_level, AcademicAlert.created_at, AcademicAlert.id).all()]
+    print(f"    CSV {len(rows) - 1} 行：列数一致 {width_ok}，原因和课程完整 {reason_ok}，BOM 开关 {bom_ok}，顺序 {order_ok}")
+    return len(rows) - 1 == alerts and width_ok and reason_ok and bom_ok and order_ok
+
+
+@benchmark('availability')
+def bench_availability(rooms=500, days=30, bookings_per_day=6, queries=300):
+    """教室空闲查询：原 SQL 重叠判断与位图索引的耗时对比，结果逐一核对，检查申请/取消后的增量更新和课表、考试的统一冲突检测"""
+    from datetime import date, datetime, timedelta
+    from models import Classroom, ClassroomBooking, Exam
+    from services.availability import availability_index, SCHEDULE_CHECK_WEEKS
+
+    reset_database()
+    data = seed(students=1, courses=1)
+    student_id = data['students'][0].id
+    course = data['courses'][0]
+    course_id, class_id, teacher_id = course.id, course.class_id, course.teacher_id
+    rng = random.Random(19)
+    db.session.bulk_insert_mappings(Classroom, [
+        {'room_number': f'R{i:04d}', 'building': f'教学楼{i % 8}', 'capacity': rng.choice([30, 40, 60, 80, 120, 200]),
+         'equipment': '投影仪', 'status': 'available' if i % 25 else 'maintenance'} for i in range(rooms)])
+    room_ids = [room_id for (room_id,) in db.session.query(Classroom.id).all()]
+    first_day = date.today() + timedelta(days=1)
+
+    def random_period():
+        # 一半对齐到 15 分钟，一半为任意分钟，覆盖首尾不完整时段的精确判断
+        start = rng.randrange(8 * 60, 20 * 60, 15 if rng.random() < 0.5 else 1)
+        end = min(start + rng.choice([30, 45, 60, 90, 120, 150]) + rng.randrange(0, 10), 22 * 60)
+        return time(start // 60, start % 60), time(end // 60, end % 60)
+
+    rows = []
+    for offset in range(days):
+        for room_id in room_ids:
+            for _ in range(bookings_per_day):
+                start_time, end_time = random_period()
+                rows.append({'student_id': student_id, 'classroom_id': room_id,
+                             'booking_date': first_day + timedelta(days=offset), 'start_time': start_time,
+                             'end_time': end_time, 'purpose': '基准', 'participants': 10,
+                             'status': rng.choice(['approved', 'approved', 'pending', 'rejected'])})
+    db.session.bulk_insert_mappings(ClassroomBooking, rows)
+    db.session.commit()
+    availability_index.invalidate()
+    availability_index.invalidate_rooms()
+    print(f"    {rooms} 间教室，{days} 天，{len(rows)} 条借用记录")
+
+    def sql_free(booking_date, start_time, end_time, min_capacity):
+        # 原 available_classrooms 的实现（另加容量筛选，待审批和已批准都占用）
+        booked = [row[0] for row in ClassroomBooking.query.filter(
+            ClassroomBooking.booking_date == booking_date,
+            ClassroomBooking.status.in_(['pending', 'approved']),
+            db.or_(
+                db.and_(ClassroomBooking.start_time <= start_time, ClassroomBooking.end_time > start_time),
+                db.and_(ClassroomBooking.start_time < end_time, ClassroomBooking.end_time >= end_time),
+                db.and_(ClassroomBooking.start_time >= start_time, ClassroomBooking.end_time <= end_time)
+            )
+        ).with_entities(ClassroomBooking.classroom_id).all()]
+        return {room.id for room in Classroom.query.filter(
+            Classroom.status == 'available', Classroom.capacity >= min_capacity,
+            ~Classroom.id.in_(booked) if booked else True
+        ).all()}
+
+    cases = [(first_day + timedelta(days=rng.randrange(days)), *random_period(), rng.choice([0, 40, 100]))
+             for _ in range(queries)]
+
+    db.session.expunge_all()
+    start = timer.perf_counter()
+    expected = [sql_free(*case) for case in cases]
+    sql_elapsed = (timer.perf_counter() - start) / queries
+
+    availability_index.rooms()
+    for booking_date, *_ in cases:
+        availability_index.day(booking_date)  # 预热：教室列表和每天各一次加载
+    start = timer.perf_counter()
+    with count_queries() as statements:
+        actual = [availability_index.free_classrooms(*case) for case in cases]
+    index_elapsed = (timer.perf_counter() - start) / queries
+    matches = sum({room.id for room in rooms_free} == ids for rooms_free, ids in zip(actual, expected))
+    print(f"    原实现（SQL 重叠判断 + 查询教室）: 平均每次 {sql_elapsed * 1e6:.0f} µs")
+    print(f"    位图索引: 平均每次 {index_elapsed * 1e6:.0f} µs（{len(statements)} 条SQL），"
+          f"{matches}/{queries} 次结果与原实现一致")
+
+    # 申请、批准、改期、取消后索引随提交增量更新
+    booking_date, start_time, end_time = first_day, time(6, 0), time(7, 0)
+    room_id = next(room.id for room in availability_index.free_classrooms(booking_date, start_time, end_time))
+    booking = ClassroomBooking(student_id=student_id, classroom_id=room_id, booking_date=booking_date,
+                               start_time=start_time, end_time=end_time, purpose='基准', participants=10)
+    db.session.add(booking)
+    db.session.commit()
+    pending_busy = not availability_index.is_free(room_id, booking_date, start_time, end_time)
+    booking.status = 'approved'
+    db.session.commit()
+    approved_busy = not availability_index.is_free(room_id, booking_date, time(6, 50), time(7, 30))
+    booking.booking_date = first_day + timedelta(days=1)
+    db.session.commit()
+    moved = availability_index.is_free(room_id, first_day, start_time, end_time) and \
+        not availability_index.is_free(room_id, booking.booking_date, start_time, end_time)
+    booking.status = 'cancelled'
+    db.session.commit()
+    cancelled_free = availability_index.is_free(room_id, booking.booking_date, start_time, end_time)
+    print(f"    增量更新：待审批占用 {pending_busy}，批准后占用 {approved_busy}，改期 {moved}，取消后释放 {cancelled_free}")
+
+    # 课表和考试按地点关联教室后，与借用在同一索引中检测冲突
+    room = db.session.get(Classroom, room_id)
+    schedule = Schedule(course_id=course_id, class_id=class_id, day_of_week=first_day.isoweekday(),
+                        start_time=time(8, 0), end_time=time(10, 0), location=f'教学楼{room.room_number}',
+                        teacher_id=teacher_id)
+    exam = Exam(course_id=course_id, class_id=class_id, exam_name='基准考试',
+                exam_time=datetime.combine(first_day, time(10, 30)), location=f'教学楼{room.room_number}', duration=90)
+    db.session.add_all([schedule, exam])
+    db.session.commit()
+    availability_index.day(first_day)
+    with count_queries() as statements:
+        occupants = availability_index.conflicts(room_id, first_day, time(9, 30), time(11, 0))
+    unified = schedule.classroom_id == room_id and {('exam', exam.id), ('schedule', schedule.id)} <= set(occupants)
+    print(f"    课表、考试与借用统一检测：{occupants}（{len(statements)} 条SQL）")
+
+    # 排考、排课冲突：修改已有安排时排除自身，排课按星期展开到之后 SCHEDULE_CHECK_WEEKS 周
+    exam_key, schedule_key = ('exam', exam.id), ('schedule', schedule.id)
+    exam_ok = exam_key in availability_index.exam_conflicts(exam.exam_time, exam.duration, [room_id])[room_id] \
+        and exam_key not in availability_index.exam_conflicts(
+            exam.exam_time, exam.duration, [room_id], exam_id=exam.id).get(room_id, []) \
+        and schedule_key in availability_index.exam_conflicts(
+            datetime.combine(first_day, time(9, 0)), 60, [room_id], exam_id=exam.id)[room_id]
+    weekday = first_day.isoweekday()
+    every_week = availability_index.schedule_conflicts(room_id, weekday, time(9, 0), time(11, 0), today=first_day)
+    excluded = availability_index.schedule_conflicts(room_id, weekday, time(9, 0), time(11, 0),
+                                                     schedule_id=schedule.id, today=first_day)
+    schedule_ok = len(every_week) == SCHEDULE_CHECK_WEEKS \
+        and all(schedule_key in found for found in every_week.values()) \
+        and max(every_week) == first_day + timedelta(weeks=SCHEDULE_CHECK_WEEKS - 1) \
+        and not any(schedule_key in found for found in excluded.values()) and exam_key in excluded[first_day]
+    print(f"    排考冲突（排除自身） {exam_ok}，排课冲突（{len(every_week)} 周，排除自身） {schedule_ok}")
+    return matches == queries and index_elapsed < sql_elapsed and pending_busy and approved_busy and moved \
+        and cancelled_free and unified and not statements and exam_ok and schedule_ok
+
+
+@benchmark('free_slots')
+def bench_free_slots(rooms=300, days=7, bookings_per_day=5):
+    """空闲时段一览：一周网格与逐时段试探查询的对比，空闲区间与逐分钟推算的结果核对，缓存与失效"""
+    from datetime import date, timedelta
+    from models import Classroom, ClassroomBooking
+    from services.availability import availability_index
+
+    reset_database()
+    data = seed(students=1, courses=1)
+    student_id = data['students'][0].id
+    rng = random.Random(20)
+    db.session.bulk_insert_mappings(Classroom, [
+        {'room_number': f'R{i:04d}', 'building': f'教学楼{i % 6}', 'capacity': rng.choice([30, 60, 120]),
+         'equipment': '', 'status': 'available'} for i in range(rooms)])
+    room_ids = [room_id for (room_id,) in db.session.query(Classroom.id).all()]
+    first_day = date.today() + timedelta(days=1)
+    dates = [first_day + timedelta(days=offset) for offset in range(days)]
+    rows = []
+    for booking_date in dates:
+        for room_id in room_ids:
+            for _ in range(bookings_per_day):
+                start = rng.randrange(7 * 60, 22 * 60, rng.choice([1, 15]))
+                end = min(start + rng.randrange(20, 180), 23 * 60)
+                rows.append({'student_id': student_id, 'classroom_id': room_id, 'booking_date': booking_date,
+                             'start_time': time(start // 60, start % 60), 'end_time': time(end // 60, end % 60),
+                             'purpose': '基准', 'participants': 10, 'status': rng.choice(['approved', 'pending'])})
+    db.session.bulk_insert_mappings(ClassroomBooking, rows)
+    db.session.commit()
+    availability_index.invalidate()
+    availability_index.invalidate_rooms()
+    opening_hours = (time(8, 0), time(22, 0))
+
+    # 原方式：学生在 8:00-22:00 间逐个 1 小时时段试探，每次一条重叠查询
+    db.session.expunge_all()
+    with count_queries() as statements, stopwatch(f'原方式（逐时段试探 {days} 天 × 14 个时段）'):
+        for booking_date in dates:
+            for hour in range(8, 22):
+                ClassroomBooking.query.filter(
+                    ClassroomBooking.booking_date == booking_date,
+                    ClassroomBooking.status.in_(['pending', 'approved']),
+                    ClassroomBooking.start_time < time(hour + 1, 0), ClassroomBooking.end_time > time(hour, 0)
+                ).with_entities(ClassroomBooking.classroom_id).all()
+                Classroom.query.filter(Classroom.status == 'available').all()
+    print(f"    共 {len(statements)} 条SQL")
+
+    with count_queries() as statements, stopwatch(f'空闲网格（首次，{rooms} 间教室 × {days} 天）'):
+        grid = availability_index.free_grid(dates, opening_hours, min_duration=30)
+    cold = len(statements)
+    with count_queries() as statements, stopwatch('空闲网格（缓存命中）'):
+        availability_index.free_grid(dates, opening_hours, min_duration=30)
+    warm = len(statements)
+    print(f"    首次 {cold} 条SQL，缓存命中 {warm} 条SQL")
+
+    # 逐分钟推算空闲区间核对扫描合并的结果
+    busy = {}
+    for row in rows:
+        if row['status'] in ('pending', 'approved'):
+            minutes = busy.setdefault((row['classroom_id'], row['booking_date']), set())
+            minutes.update(range(row['start_time'].hour * 60 + row['start_time'].minute,
+                                 row['end_time'].hour * 60 + row['end_time'].minute))
+
+    def brute_force(room_id, booking_date):
+        windows, start = [], None
+        taken = busy.get((room_id, booking_date), set())
+        for minute in range(8 * 60, 22 * 60 + 1):
+            free = minute < 22 * 60 and minute not in taken
+            if free and start is None:
+                start = minute
+            elif not free and start is not None:
+                if minute - start >= 30:
+                    windows.append((start * 60, minute * 60))
+                start = None
+        return windows
+
+    correct = all(windows[room.id] == brute_force(room.id, booking_date)
+                  for booking_date, windows in grid.days for room in grid.rooms)
+
+    # 批准一条借用后，该日期的网格重新计算
+    room = grid.rooms[0]
+    booking = ClassroomBooking(student_id=student_id, classroom_id=room.id, booking_date=first_day,
+                               start_time=time(6, 0), end_time=time(23, 0), purpose='基准', participants=10,
+                               status='approved')
+    db.session.add(booking)
+    db.session.commit()
+    with count_queries() as statements:
+        grid = availability_index.free_grid(dates, opening_hours, building=room.building)
+    updated = grid.days[0][1][room.id] == []
+    print(f"    与逐分钟推算一致 {correct}，批准后当天网格更新 {updated}（{len(statements)} 条SQL）")
+    return correct and updated and cold == 4 and warm == 0 and not statements
+
+
+@benchmark('booking_series')
+def bench_booking_series(rooms=20, weeks=20):
+    """重复借用：整学期每周一次逐次提交与一次展开批量提交的对比，逐次结果与已有占用核对"""
+    from datetime import date, timedelta
+    from models import Classroom, ClassroomBooking
+    from services.availability import availability_index
+    from services.bookings import submit_booking, submit_series, expand_recurrence
+
+    reset_database()
+    data = seed(students=2, courses=1)
+    student_ids = [student.id for student in data['students']]
+    rng = random.Random(24)
+    db.session.bulk_insert_mappings(Classroom, [
+        {'room_number': f'R{i:03d}', 'building': '教学楼A', 'capacity': 60, 'equipment': '', 'status': 'available'}
+        for i in range(rooms * 2)])
+    room_ids = [room_id for (room_id,) in db.session.query(Classroom.id).all()]
+    first_day = date.today() + timedelta(days=1)
+    until = first_day + timedelta(weeks=weeks - 1)
+    dates = expand_recurrence(first_day, until, 'weekly')
+
+    # 后一半教室的部分日期已有借用，重复借用在这些日期应报告冲突
+    existing = {(room_id, booking_date) for room_id in room_ids[rooms:] for booking_date in dates
+                if rng.random() < 0.3}
+    db.session.bulk_insert_mappings(ClassroomBooking, [
+        {'student_id': student_ids[1], 'classroom_id': room_id, 'booking_date': booking_date,
+         'start_time': time(18, 30), 'end_time': time(19, 30), 'purpose': '已有', 'participants': 10,
+         'status': 'approved'} for room_id, booking_date in existing])
+    db.session.commit()
+    availability_index.invalidate()
+    start_time, end_time = time(19, 0), time(21, 0)
+
+    # 原方式：每个日期提交一次
+    with count_queries() as statements, stopwatch(f'逐次提交（{rooms} 间教室 × {weeks} 周）'):
+        for room_id in room_ids[:rooms]:
+            for booking_date in dates:
+                submit_booking(student_ids[0], room_id, booking_date, start_time, end_time, '社团活动', 20)
+    print(f"    共 {len(statements)} 条SQL")
+
+    reports = {}
+    with count_queries() as statements, stopwatch(f'重复借用批量提交（{rooms} 间教室 × {weeks} 周）'):
+        for room_id in room_ids[rooms:]:
+            reports[room_id] = submit_series(student_ids[0], room_id, first_day, until, 'weekly', start_time,
+                                             end_time, '社团活动', 20, weeks)
+    per_series = len(statements) / rooms
+    print(f"    共 {len(statements)} 条SQL（每个系列 {per_series:.1f} 条）")
+
+    correct = all(len(occurrences) == weeks and all(
+        (occurrence.booking_id is None) == ((room_id, occurrence.booking_date) in existing)
+        for occurrence in occurrences) for room_id, (_, _, occurrences) in reports.items())
+    inserted = ClassroomBooking.query.filter(ClassroomBooking.classroom_id.in_(room_ids[rooms:]),
+                                             ClassroomBooking.purpose == '社团活动').count()
+    expected = rooms * weeks - len(existing)
+    indexed = all(not availability_index.is_free(room_id, booking_date, start_time, end_time)
+                  for room_id in room_ids[rooms:] for booking_date in dates)
+    print(f"    逐次结果与已有占用一致 {correct}，插入 {inserted}/{expected} 条，索引同步 {indexed}")
+    return correct and inserted == expected and indexed and per_series <= 8
+
+
+@benchmark('booking_approval')
+def bench_booking_approval(rooms=100, days=7, requests_per_day=8):
+    """批量审批：数千条待审批申请一个事务内处理，批准的借用互不重叠，因冲突拒绝的申请确实与已批准的借用重叠"""
+    from datetime import date, datetime, timedelta
+    from models import Classroom, ClassroomBooking
+    from services.availability import availability_index
+    from services.bookings import resolve_pending
+
+    reset_database()
+    data = seed(students=1, courses=1)
+    student_id = data['students'][0].id
+    approver_id = data['teachers'][0].id
+    rng = random.Random(23)
+    db.session.bulk_insert_mappings(Classroom, [
+        {'room_number': f'R{i:03d}', 'building': '教学楼A', 'capacity': rng.choice([30, 60, 120]), 'equipment': '',
+         'status': 'available' if i % 20 else 'maintenance'} for i in range(rooms)])
+    room_ids = [room_id for (room_id,) in db.session.query(Classroom.id).all()]
+    first_day = date.today() + timedelta(days=1)
+    dates = [first_day + timedelta(days=offset) for offset in range(days)]
+    rows = []
+    for booking_date in dates:
+        for room_id in room_ids:
+            for _ in range(requests_per_day):
+                start = rng.randrange(8 * 60, 20 * 60, 15)
+                end = start + rng.choice([60, 90, 120])
+                rows.append({'student_id': student_id, 'classroom_id': room_id, 'booking_date': booking_date,
+                             'start_time': time(start // 60, start % 60), 'end_time': time(end // 60, end % 60),
+                             'purpose': '基准', 'participants': rng.randrange(5, 130), 'status': 'pending',
+                             'created_at': datetime(2026, 1, 1) + timedelta(seconds=rng.randrange(86400))})
+    db.session.bulk_insert_mappings(ClassroomBooking, rows)
+    db.session.commit()
+    availability_index.invalidate()
+    availability_index.invalidate_rooms()
+    db.session.expunge_all()
+
+    with count_queries() as statements, stopwatch(f'批量审批 {len(rows)} 条申请（{rooms} 间教室 × {days} 天）'):
+        result = resolve_pending(dates[0], dates[-1], approver_id, 'utilization')
+    print(f"    批准 {len(result.approved)} 条，拒绝 {len(result.rejected)} 条，共 {len(statements)} 条SQL")
+
+    bookings = ClassroomBooking.query.all()
+    approved = {}
+    for booking in bookings:
+        if booking.status == 'approved':
+            approved.setdefault((booking.classroom_id, booking.booking_date), []).append(booking)
+    disjoint = all(a.end_time <= b.start_time
+                   for group in approved.values()
+                   for a, b in zip(sorted(group, key=lambda x: x.start_time),
+                                   sorted(group, key=lambda x: x.start_time)[1:]))
+    justified = all(any(other.start_time < booking.end_time and other.end_time > booking.start_time
+                        for other in approved.get((booking.classroom_id, booking.booking_date), ()))
+                    for booking in bookings
+                    if booking.status == 'rejected' and booking.reject_reason.startswith('该时间段'))
+    decided = all(booking.status in ('approved', 'rejected') and booking.admin_id == approver_id
+                  for booking in bookings)
+    # 占用索引：批准的仍占用，拒绝的已释放
+    indexed = all((('booking', booking.id) in availability_index.conflicts(
+        booking.classroom_id, booking.booking_date, booking.start_time, booking.end_time)) ==
+        (booking.status == 'approved') for booking in bookings)
+    print(f"    批准的借用互不重叠 {disjoint}，冲突拒绝均有依据 {justified}，全部已处理 {decided}，索引同步 {indexed}")
+    return disjoint and justified and decided and indexed and len(statements) <= 10
+
+
+@benchmark('vouchers')
+def bench_vouchers(bookings=500, downloads=200, checkins=2000):
+    """借用凭证：批准时批量签发，重复下载直接读磁盘（支持 304），扫码核验不访问数据库且能识别篡改"""
+    import shutil
+    from datetime import date, timedelta
+    from models import Classroom, ClassroomBooking
+    from services.vouchers import load_voucher_details, issue_vouchers, sign_voucher
+
+    reset_database()
+    data = seed(students=1, courses=1)
+    student = data['students'][0]
+    student.set_password('bench')
+    db.session.add(Classroom(room_number='R001', building='教学楼A', capacity=60, equipment='', status='available'))
+    db.session.commit()
+    student_id, username = student.id, student.username
+    room_id = db.session.query(Classroom.id).scalar()
+    first_day = date.today() + timedelta(days=1)
+    db.session.bulk_insert_mappings(ClassroomBooking, [
+        {'student_id': student_id, 'classroom_id': room_id, 'booking_date': first_day + timedelta(days=i // 10),
+         'start_time': time(8 + i % 10, 0), 'end_time': time(9 + i % 10, 0), 'purpose': '基准', 'participants': 10,
+         'status': 'approved'} for i in range(bookings)])
+    db.session.commit()
+    booking_ids = [booking_id for (booking_id,) in db.session.query(ClassroomBooking.id)]
+
+    config = current_app.config
+    upload_folder = tempfile.mkdtemp(prefix='sms_vouchers_')
+    saved_folder, config['UPLOAD_FOLDER'] = config['UPLOAD_FOLDER'], upload_folder
+    try:
+        with current_app.test_request_context(), count_queries() as statements, \
+                stopwatch(f'批准时签发 {bookings} 张凭证'):
+            issue_vouchers(load_voucher_details(booking_ids).values(), config['SECRET_KEY'], upload_folder,
+                           lambda token: f'/classroom/check-in?token={token}')
+        print(f"    共 {len(statements)} 条SQL")
+
+        # 登录用户缓存在应用上下文的 g 中，下载在单独的上下文中进行，不影响后续项目
+        with current_app.app_context():
+            client = current_app.test_client()
+            client.post('/login', data={'username': username, 'password': 'bench'})
+            with count_queries() as statements, stopwatch(f'重复下载 {downloads} 次'):
+                responses = [client.get(f'/classroom/download-voucher/{booking_ids[i % bookings]}')
+                             for i in range(downloads)]
+            served = all(response.status_code == 200 and response.headers.get('ETag') for response in responses)
+            per_download = len(statements) / downloads
+            not_modified = client.get(f'/classroom/download-voucher/{booking_ids[0]}',
+                                      headers={'If-None-Match': responses[0].headers['ETag']}).status_code
+            print(f"    每次下载 {per_download:.1f} 条SQL，If-None-Match -> {not_modified}")
+
+        details = load_voucher_details(booking_ids[:1])[booking_ids[0]]
+        token = sign_voucher(details.claims, config['SECRET_KEY'])
+        forged = sign_voucher(details.claims._replace(end_time=time(23, 0)), 'wrong-key')
+        anonymous = current_app.test_client()
+        with count_queries() as statements, stopwatch(f'扫码核验 {checkins} 次'):
+            results = [anonymous.get(f'/classroom/check-in?token={token}') for _ in range(checkins)]
+        verified = all(response.get_json().get('voucher', {}).get('booking_id') == booking_ids[0]
+                       for response in results)
+        rejected = anonymous.get(f'/classroom/check-in?token={forged}').get_json().get('error') == '凭证签名无效'
+        print(f"    核验 {len(statements)} 条SQL，签名识别 {verified}，伪造凭证被拒 {rejected}")
+    finally:
+        config['UPLOAD_FOLDER'] = saved_folder
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    return served and per_download <= 2 and not_modified == 304 and verified and rejected and not statements
+
+
+@benchmark('grade_manage')
+def bench_grade_manage():
+    """教师成绩管理页：SQL 语句数不随课程数增长"""
+    counts = []
+    for courses in (2, 30):
+        reset_database()
+        data = seed(students=200, courses=courses, teachers=1)
+        teacher = data['teachers'][0]
+        teacher.set_password('bench')
+        db.session.commit()
+
+        client = current_app.test_client()
+        client.post('/login', data={'username': teacher.username, 'password': 'bench'})
+        db.session.remove()
+        with count_queries() as statements:
+            response = client.get('/teacher/grades')
+        counts.append((courses, response.status_code, len(statements)))
+
+    constant = len({queries for _, _, queries in counts}) == 1
+    detail = ', '.join(f'{courses} 门课程 -> {queries} 条SQL' for courses, _, queries in counts)
+    print(f"    {detail} {'[恒定]' if constant else '[随课程数增长]'}")
+    return constant and all(status == 200 for _, status, _ in counts)
+
+
+def percentile(values, pct):
+    """计算百分位数（最近秩法）"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def run_concurrently(worker, jobs, threads):
+    """用 threads 个线程并发执行 worker(job)，每个线程使用独立的应用上下文和会话，
+    返回每次调用的耗时（秒）和结果；worker 抛出的异常作为结果记录，线程继续处理剩余任务"""
+    app = current_app._get_current_object()
+    queue = list(jobs)
+    lock = threading.Lock()
+    results = []
+
+    def run():
+        with app.app_context():
+            while True:
+                with lock:
+                    if not queue:
+                        break
+                    job = queue.pop()
+                start = timer.perf_counter()
+                try:
+                    outcome = worker(job)
+                except Exception as e:
+                    db.session.rollback()
+                    outcome = e
+                elapsed = timer.perf_counter() - start
+                with lock:
+                    results.append((elapsed, outcome))
+            db.session.remove()
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results
+
+
+def completed(results, jobs):
+    """并发执行的每个任务都有结果且没有抛出异常"""
+    errors = [outcome for _, outcome in results if isinstance(outcome, Exception)]
+    for error in errors[:3]:
+        print(f"    任务异常: {error!r}")
+    if errors or len(results) != len(jobs):
+        print(f"    并发执行不完整：{len(jobs)} 个任务，{len(results)} 个结果，{len(errors)} 个异常")
+    return len(results) == len(jobs) and not errors
+
+
+@benchmark('selection')
+def bench_selection(threads=16, requests=2000):
+    """并发选课/退课压测：学分上限、课程容量和冗余计数在并发下保持一致"""
+    from services import selection
+
+    reset_database()
+    data = seed(students=100, courses=30)
+    Course.query.update({Course.capacity: 15})
+    db.session.commit()
+
+    student_ids = [student.id for student in data['students']]
+    course_ids = [course.id for course in data['courses']]
+    rng = random.Random(42)
+    jobs = [(rng.random() < 0.2, rng.choice(student_ids), rng.choice(course_ids)) for _ in range(requests)]
+
+    def worker(job):
+        drop, student_id, course_id = job
+        if drop:
+            return selection.drop_course(student_id, course_id)[0]
+        return selection.select_course(student_id, course_id)[0]
+
+    start = timer.perf_counter()
+    results = run_concurrently(worker, jobs, threads)
+    elapsed = timer.perf_counter() - start
+
+    complete = completed(results, jobs)
+    latencies = [latency * 1000 for latency, _ in results]
+    succeeded = sum(1 for _, ok in results if ok is True)
+    print(f"    {len(results)} 次请求 / {threads} 线程，成功 {succeeded} 次，"
+          f"吞吐 {len(results) / elapsed:.0f} 次/秒，p50 {percentile(latencies, 50):.1f} ms，"
+          f"p99 {percentile(latencies, 99):.1f} ms")
+
+    db.session.remove()
+    problems = selection.check_invariants()
+    for problem in problems[:10]:
+        print(f"    不一致: {problem}")
+    print(f"    不变量检查: {'通过' if not problems else f'{len(problems)} 处不一致'}")
+    return complete and not problems
+
+
+@benchmark('registration')
+def bench_registration(requests=2000, threads=16):
+    """选课排队模式：令牌桶准入 + 单写线程批量事务的吞吐与延迟（对比直接并发写入）"""
+    from services import selection
+    from services.registration_queue import RegistrationQueue, TokenBucket
+
+    def prepare():
+        reset_database()
+        data = seed(students=100, courses=30)
+        Course.query.update({Course.capacity: 15})
+        db.session.commit()
+        rng = random.Random(7)
+        student_ids = [student.id for student in data['students']]
+        course_ids = [course.id for course in data['courses']]
+        return [('drop' if rng.random() < 0.2 else 'select', rng.choice(student_ids), rng.choice(course_ids))
+                for _ in range(requests)]
+
+    def report(label, elapsed, latencies):
+        print(f"    {label}: {len(latencies)} 次，吞吐 {len(latencies) / elapsed:.0f} 次/秒，"
+              f"p50 {percentile(latencies, 50):.1f} ms，p99 {percentile(latencies, 99):.1f} ms")
+
+    # 直接写入：每个请求线程各自开事务
+    jobs = prepare()
+    start = timer.perf_counter()
+    results = run_concurrently(lambda job: selection.run_operation(*job), jobs, threads)
+    report('直接并发写入', timer.perf_counter() - start, [latency * 1000 for latency, _ in results])
+    db.session.remove()
+    ok = completed(results, jobs) and not selection.check_invariants()
+
+    # 排队模式：请求线程只入队，写线程批量处理
+    jobs = prepare()
+    registration_queue = RegistrationQueue(current_app._get_current_object(), maxsize=requests,
+                                           rate=1000, burst=1000)
+    start = timer.perf_counter()
+    results = run_concurrently(lambda job: registration_queue.submit(job[1], job[0], job[2]), jobs, threads)
+    ok = completed(results, jobs) and ok
+    tickets = [ticket for _, ticket in results if not isinstance(ticket, Exception)]
+    while any(ticket.status == 'queued' for ticket in tickets):
+        timer.sleep(0.01)
+    elapsed = timer.perf_counter() - start
+    report('排队批量写入', elapsed, [(t.finished_at - t.created_at) * 1000 for t in tickets])
+    print(f"    入队耗时 p99 {percentile([latency * 1000 for latency, _ in results], 99):.2f} ms")
+
+    # 令牌桶：同一用户瞬间连发 10 次，只放行 burst 个
+    limited = RegistrationQueue(current_app._get_current_object(), rate=1.0, burst=3)
+    admitted = sum(1 for _ in range(10) if limited.limiter.allow('same-user'))
+    print(f"    令牌桶(burst=3)：连续 10 次请求放行 {admitted} 次")
+
+    # 令牌桶补满后清理：大量一次性用户过后，桶的数量回落到只剩近期活跃的用户
+    sweeping = TokenBucket(rate=10.0, burst=2)
+    for user_id in range(5000):
+        sweeping.allow(user_id)
+    peak = len(sweeping)
+    timer.sleep(0.25)
+    sweeping.allow('after')
+    swept = len(sweeping)
+    print(f"    令牌桶清理：5000 个用户后 {peak} 个桶，补满周期过后剩 {swept} 个")
+
+    db.session.remove()
+    problems = selection.check_invariants()
+    print(f"    不变量检查: {'通过' if ok and not problems else '存在不一致'}")
+    return ok and not problems and admitted == 3 and peak == 5000 and swept == 1
+
+
+@benchmark('booking_race')
+def bench_booking_race(rooms=4, contenders=50, threads=16):
+    """并发借用教室：同一时段的重叠申请最多一个成功，互不重叠的申请全部成功，数据库中不存在重叠占用"""
+    from datetime import date, timedelta
+    from sqlalchemy.orm import aliased
+    from models import Classroom, ClassroomBooking
+    from services.availability import availability_index
+    from services.bookings import submit_booking
+
+    reset_database()
+    data = seed(students=contenders, courses=1)
+    student_ids = [student.id for student in data['students']]
+    db.session.bulk_insert_mappings(Classroom, [
+        {'room_number': f'R{i:03d}', 'building': '教学楼A', 'capacity': 60, 'equipment': '', 'status': 'available'}
+        for i in range(rooms)])
+    db.session.commit()
+    room_ids = [room_id for (room_id,) in db.session.query(Classroom.id).all()]
+    availability_index.invalidate()
+    availability_index.invalidate_rooms()
+    race_day = date.today() + timedelta(days=1)
+    calm_day = race_day + timedelta(days=1)
+
+    # 每间教室 contenders 个申请都覆盖 10:00，两两重叠
+    rng = random.Random(22)
+    jobs = []
+    for room_id in room_ids:
+        for student_id in student_ids:
+            start = rng.randrange(9 * 60, 10 * 60)
+            end = rng.randrange(10 * 60 + 1, 12 * 60)
+            jobs.append((student_id, room_id, race_day, time(start // 60, start % 60), time(end // 60, end % 60)))
+
+    def worker(job):
+        student_id, room_id, booking_date, start_time, end_time = job
+        ok, _ = submit_booking(student_id, room_id, booking_date, start_time, end_time, '基准', 10)
+        return room_id if ok else None
+
+    start = timer.perf_counter()
+    results = run_concurrently(worker, jobs, threads)
+    elapsed = timer.perf_counter() - start
+    complete = completed(results, jobs)
+    winners = [room_id for _, room_id in results if isinstance(room_id, int)]
+    latencies = [latency * 1000 for latency, _ in results]
+    print(f"    重叠申请 {len(results)} 次 / {threads} 线程，成功 {len(winners)} 次（{rooms} 间教室），"
+          f"吞吐 {len(results) / elapsed:.0f} 次/秒，p99 {percentile(latencies, 99):.1f} ms")
+
+    # 互不重叠：每间教室 8:00-22:00 按小时各申请一次
+    jobs = [(rng.choice(student_ids), room_id, calm_day, time(hour, 0), time(hour + 1, 0))
+            for room_id in room_ids for hour in range(8, 22)]
+    calm = run_concurrently(worker, jobs, threads)
+    complete = completed(calm, jobs) and complete
+    calm_ok = sum(1 for _, room_id in calm if isinstance(room_id, int))
+    print(f"    互不重叠申请 {len(jobs)} 次，成功 {calm_ok} 次")
+
+    db.session.remove()
+    other = aliased(ClassroomBooking)
+    overlaps = db.session.query(ClassroomBooking.id).join(other, db.and_(
+        other.classroom_id == ClassroomBooking.classroom_id, other.booking_date == ClassroomBooking.booking_date,
+        other.id > ClassroomBooking.id, other.start_time < ClassroomBooking.end_time,
+        other.end_time > ClassroomBooking.start_time)).count()
+    print(f"    数据库中重叠的借用 {overlaps} 对")
+    return complete and sorted(winners) == sorted(room_ids) and calm_ok == len(jobs) and overlaps == 0
+
+
+def main(names):
+    app = create_app()
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"未知的基准项目: {', '.join(unknown)}；可选: {', '.join(BENCHMARKS)}")
+        return 1
+
+    failed = []
+    with app.app_context():
+        for name in names or BENCHMARKS:
+            print(f"[{name}] {BENCHMARKS[name].__doc__}")
+            if BENCHMARKS[name]() is False:
+                failed.append(name)
+        db.session.remove()
+        db.engine.dispose()
+
+    if os.path.exists(_db_file.name):
+        os.remove(_db_file.name)
+    print("全部通过" if not failed else f"未通过: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -11,6 +11,32 @@ class Config:
                               'sqlite:///' + os.path.join(BASEDIR, 'student_management.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 选课高峰排队模式（开启后选课/退课请求进入队列，由单个写线程批量处理；只能单进程部署）
+    REGISTRATION_QUEUE_ENABLED = os.environ.get('REGISTRATION_QUEUE_ENABLED') == '1'
+    REGISTRATION_QUEUE_SIZE = 5000  # 队列容量
+    REGISTRATION_BATCH_SIZE = 50  # 每个事务最多处理的请求数
+    REGISTRATION_RATE = 1.0  # 每个用户每秒补充的令牌数
+    REGISTRATION_BURST = 3  # 每个用户最多积累的令牌数
+
+    # 成绩后台导入
+    GRADE_IMPORT_WORKERS = 2  # 同时运行的导入任务数
+    GRADE_IMPORT_CHUNK_SIZE = 500  # 每块解析/写入的行数
+
+    # 学业预警规则
+    ALERT_FAILED_LEVELS = [(4, '一级'), (3, '二级'), (2, '三级')]  # 单学期不及格门数 -> 预警等级
+    ALERT_CONSECUTIVE_TERMS = 2  # 连续多少个学期挂科达到下限即为一级预警
+    ALERT_CONSECUTIVE_MIN_FAILED = 2  # 连续挂科的每学期不及格门数下限
+    ALERT_GPA_FLOOR = 1.0  # 学期绩点低于此值为三级预警
+
+    # 教室借用
+    CLASSROOM_OPEN_TIME = '08:00'  # 每天可借用的开始时间
+    CLASSROOM_CLOSE_TIME = '22:00'  # 每天可借用的结束时间
+    CLASSROOM_GRID_MAX_DAYS = 14  # 空闲时段一览一次最多查询的天数
+    BOOKING_APPROVAL_POLICY = 'submitted'  # 批量审批的优先级：submitted 先提交先批准，utilization 容量利用率高优先
+    BOOKING_APPROVAL_MAX_DAYS = 31  # 批量审批一次最多处理的天数
+    BOOKING_SERIES_MAX_OCCURRENCES = 30  # 重复借用最多展开的次数（约一个学期的每周一次）
+    VOUCHER_CHECKIN_GRACE_MINUTES = 15  # 凭证核验时借用时段前后放宽的分钟数
+
     # 文件上传配置
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = os.path.join(BASEDIR, 'uploads')
@@ -0,0 +1,36 @@
+# generate_alerts.py
+"""生成全校（或指定辅导员负责班级）的学业预警，供定时任务调用。
+
+用法：
+    python generate_alerts.py                    # 增量生成全校预警（只处理上次运行后成绩有变化的学生）
+    python generate_alerts.py --full             # 全量重新判定全校学生
+    python generate_alerts.py --counselor coun001  # 只处理指定辅导员（用户名）负责的班级
+"""
+import sys
+from app import create_app
+from models import User
+from services.alerts import run_alert_engine, format_timings
+
+
+def parse_counselor(argv):
+    """--counselor 参数对应的 (辅导员ID, 范围说明)，未指定时辅导员ID为 None（全校）"""
+    if '--counselor' not in argv:
+        return None, '全校'
+    index = argv.index('--counselor') + 1
+    if index >= len(argv):
+        raise SystemExit('--counselor 需要辅导员用户名')
+    counselor = User.query.filter_by(username=argv[index], role='counselor').first()
+    if counselor is None:
+        raise SystemExit(f'辅导员不存在: {argv[index]}')
+    return counselor.id, f'辅导员 {counselor.real_name}（{counselor.username}）负责班级'
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        counselor_id, target = parse_counselor(sys.argv)
+        run = run_alert_engine(counselor_id, incremental='--full' not in sys.argv)
+        scope = '增量' if run.incremental else '全量'
+        print(f"{target}：{scope}扫描 {run.students_scanned} 名学生，新增 {run.alerts_created} 条、"
+              f"更新 {run.alerts_updated} 条、解除 {run.alerts_resolved} 条学业预警")
+        print(f"各阶段耗时: {format_timings(run)}")
@@ -6,6 +6,11 @@ from werkzeug.security import generate_password_hash
 from datetime import datetime, date, time, timedelta
 import os
 import json
+from services.selection import rebuild_counters
+from services.grade_stats import rebuild_stats
+from services.transcripts import rebuild_transcripts
+from services.alerts import link_failed_courses
+from services.rooms import link_locations
 
 
 def init_database():
@@ -561,6 +566,15 @@ def init_database():
         db.session.commit()
         print("辅导记录数据创建完成")
 
+        # 重建冗余统计数据
+        print("重建冗余统计数据...")
+        rebuild_counters()
+        rebuild_stats()
+        rebuild_transcripts()
+        link_failed_courses()
+        link_locations()
+        print("冗余统计数据重建完成")
+
         print("=" * 50)
         print("数据库初始化完成！")
         print("=" * 50)
@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date, time
+from services.grading import DEFAULT_SCALE, scale_for
 
 # 创建独立的 db 实例
 db = SQLAlchemy()
@@ -17,7 +18,8 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128))
     role = db.Column(db.String(20), nullable=False)  # student, teacher, counselor
     real_name = db.Column(db.String(64), nullable=False)
-    class_id = db.Column(db.Integer, db.ForeignKey('classes.id'))
+    class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), index=True)
+    selected_credits = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 已选学分合计（冗余字段）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password):
@@ -44,7 +46,7 @@ class Class(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     class_name = db.Column(db.String(64), nullable=False, unique=True)
-    counselor_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    counselor_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # 关系
@@ -62,6 +64,10 @@ class Course(db.Model):
     teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     class_id = db.Column(db.Integer, db.ForeignKey('classes.id'), nullable=False)
     credit = db.Column(db.Integer, default=2)
+    grading_scale = db.Column(db.String(20), nullable=False, default=DEFAULT_SCALE,
+                              server_default=DEFAULT_SCALE)  # 评分标准，见 services/grading.py
+    capacity = db.Column(db.Integer)  # 选课人数上限，为空表示不限
+    enrolled_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 已选人数（冗余字段）
     grades_saved = db.Column(db.Boolean, default=False)  # 成绩是否已保存
     grades_submitted = db.Column(db.Boolean, default=False)  # 新增：成绩是否已提交
     grades_submitted_at = db.Column(db.DateTime)  # 新增：成绩提交时间
@@ -70,6 +76,11 @@ class Course(db.Model):
     # 关系
     teacher = db.relationship('User', backref='courses_teaching', foreign_keys=[teacher_id])
 
+    __table_args__ = (
+        db.Index('ix_courses_teacher_id', 'teacher_id'),
+        db.Index('ix_courses_course_name', 'course_name'),
+    )
+
     def __repr__(self):
         return f'<Course {self.course_code} - {self.course_name}>'
 
@@ -84,12 +95,21 @@ class Schedule(db.Model):
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
     location = db.Column(db.String(128))
+    classroom_id = db.Column(db.Integer, db.ForeignKey('classrooms.id'))  # 上课教室（由 location 解析）
     teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # 关系定义
     course = db.relationship('Course', backref='schedules')
     teacher = db.relationship('User', backref='teaching_schedules', foreign_keys=[teacher_id])
+    classroom = db.relationship('Classroom', backref='schedules')
+
+    # 索引：按班级查课表、按课程查上课时间、按星期查教室占用
+    __table_args__ = (
+        db.Index('ix_schedules_class_day', 'class_id', 'day_of_week'),
+        db.Index('ix_schedules_course_id', 'course_id'),
+        db.Index('ix_schedules_day_classroom', 'day_of_week', 'classroom_id'),
+    )
 
     def to_dict(self):
         return {
@@ -104,6 +124,15 @@ class Schedule(db.Model):
         }
 
 
+# 考试使用的教室（一场考试可以占用多间教室，如“教学楼A101-A105”）
+exam_classrooms = db.Table(
+    'exam_classrooms',
+    db.Column('exam_id', db.Integer, db.ForeignKey('exams.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('classroom_id', db.Integer, db.ForeignKey('classrooms.id'), primary_key=True),
+    db.Index('ix_exam_classrooms_classroom', 'classroom_id', 'exam_id'),
+)
+
+
 class Exam(db.Model):
     """考试安排模型"""
     __tablename__ = 'exams'
@@ -120,6 +149,13 @@ class Exam(db.Model):
 
     # 关系定义
     course = db.relationship('Course', backref='exams')
+    classrooms = db.relationship('Classroom', secondary=exam_classrooms, backref='exams')  # 考场（由 location 解析）
+
+    # 索引：按班级查考试、按时间查考场占用
+    __table_args__ = (
+        db.Index('ix_exams_class_time', 'class_id', 'exam_time'),
+        db.Index('ix_exams_exam_time', 'exam_time'),
+    )
 
     def to_dict(self):
         return {
@@ -154,6 +190,10 @@ class LeaveApplication(db.Model):
     student = db.relationship('User', backref='leave_applications', foreign_keys=[student_id])
     approver = db.relationship('User', backref='approved_leaves', foreign_keys=[approver_id])
 
+    __table_args__ = (
+        db.Index('ix_leave_applications_student_status', 'student_id', 'status'),
+    )
+
     def get_duration_days(self):
         """计算请假天数"""
         delta = self.end_time - self.start_time
@@ -213,6 +253,13 @@ class ClassroomBooking(db.Model):
     classroom = db.relationship('Classroom', backref='bookings')
     admin = db.relationship('User', backref='approved_bookings', foreign_keys=[admin_id])
 
+    # 索引：冲突检测（教室+日期+状态）、可用教室查询（日期+状态）、学生借用记录
+    __table_args__ = (
+        db.Index('ix_classroom_bookings_room_date_status', 'classroom_id', 'booking_date', 'status'),
+        db.Index('ix_classroom_bookings_date_status', 'booking_date', 'status'),
+        db.Index('ix_classroom_bookings_student_created', 'student_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -247,6 +294,11 @@ class Announcement(db.Model):
     course = db.relationship('Course', backref='announcements')
     teacher = db.relationship('User', backref='announcements', foreign_keys=[teacher_id])
 
+    __table_args__ = (
+        db.Index('ix_announcements_course_created', 'course_id', 'created_at'),
+        db.Index('ix_announcements_teacher_created', 'teacher_id', 'created_at'),
+    )
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # 确保内容不被意外修改
@@ -291,6 +343,11 @@ class CourseMaterial(db.Model):
     course = db.relationship('Course', backref='materials')
     teacher = db.relationship('User', backref='materials', foreign_keys=[teacher_id])
 
+    __table_args__ = (
+        db.Index('ix_course_materials_course_id', 'course_id'),
+        db.Index('ix_course_materials_teacher_created', 'teacher_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -321,9 +378,10 @@ class SelectedCourse(db.Model):
     student = db.relationship('User', backref='selected_courses', foreign_keys=[student_id])
     course = db.relationship('Course', backref='selected_courses', foreign_keys=[course_id])
 
-    # 唯一约束：一个学生不能重复选同一门课程
+    # 唯一约束：一个学生不能重复选同一门课程（同时充当 student_id 前缀索引）
     __table_args__ = (
         db.UniqueConstraint('student_id', 'course_id', name='unique_student_course'),
+        db.Index('ix_selected_courses_course_id', 'course_id'),
     )
 
     def to_dict(self):
@@ -350,7 +408,7 @@ class Grade(db.Model):
     score = db.Column(db.Float)  # 百分制成绩
     grade_point = db.Column(db.Float)  # 绩点
     grade_level = db.Column(db.String(2))  # 等级：A, B, C, D, F
-    exam_type = db.Column(db.String(20), default='期末')  # 考试类型
+    exam_type = db.Column(db.String(20), nullable=False, default='期末')  # 考试类型
     exam_date = db.Column(db.Date)
     academic_year = db.Column(db.String(20))
     semester = db.Column(db.String(10))
@@ -363,31 +421,20 @@ class Grade(db.Model):
     course = db.relationship('Course', backref='grades')
     teacher = db.relationship('User', backref='given_grades', foreign_keys=[teacher_id])
 
+    # 索引：课程成绩列表/单个学生成绩查找、学生成绩查询；同一学生同一课程只有一条成绩
+    __table_args__ = (
+        db.Index('ix_grades_course_student', 'course_id', 'student_id'),
+        db.Index('ix_grades_student_id', 'student_id'),
+        db.Index('uq_grades_student_course', 'student_id', 'course_id', unique=True),
+    )
+
     def calculate_grade_point(self):
-        """根据百分制成绩计算绩点"""
-        if self.score >= 90:
-            return 4.0
-        elif self.score >= 80:
-            return 3.0
-        elif self.score >= 70:
-            return 2.0
-        elif self.score >= 60:
-            return 1.0
-        else:
-            return 0.0
+        """根据百分制成绩和课程评分标准计算绩点"""
+        return scale_for(self.course).grade_point(self.score)
 
     def calculate_grade_level(self):
-        """根据百分制成绩计算等级"""
-        if self.score >= 90:
-            return 'A'
-        elif self.score >= 80:
-            return 'B'
-        elif self.score >= 70:
-            return 'C'
-        elif self.score >= 60:
-            return 'D'
-        else:
-            return 'F'
+        """根据百分制成绩和课程评分标准计算等级"""
+        return scale_for(self.course).grade_level(self.score)
 
     def to_dict(self):
         return {
@@ -405,8 +452,79 @@ class Grade(db.Model):
         }
 
 
+class CourseGradeStats(db.Model):
+    """课程成绩统计摘要（随成绩写入增量维护，见 services/grade_stats.py）"""
+    __tablename__ = 'course_grade_stats'
+
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)  # 有成绩的人次
+    total = db.Column(db.Float, nullable=False, default=0)  # 成绩之和
+    total_sq = db.Column(db.Float, nullable=False, default=0)  # 成绩平方和
+    min_score = db.Column(db.Float)
+    max_score = db.Column(db.Float)
+    pass_count = db.Column(db.Integer, nullable=False, default=0)
+    histogram = db.Column(db.Text, nullable=False, default='{}')  # JSON：{成绩×10: 人数}，精确到 0.1 分
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    course = db.relationship('Course', backref=db.backref('grade_stats', uselist=False))
+
+
+class StudentTranscript(db.Model):
+    """学生成绩单：每学期一行，另有一行累计（academic_year、semester 均为空串），见 services/transcripts.py"""
+    __tablename__ = 'student_transcripts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    academic_year = db.Column(db.String(20), nullable=False, default='')
+    semester = db.Column(db.String(10), nullable=False, default='')
+    course_count = db.Column(db.Integer, nullable=False, default=0)  # 有成绩的课程数
+    total_credits = db.Column(db.Float, nullable=False, default=0)  # 已修学分
+    gpa_credits = db.Column(db.Float, nullable=False, default=0)  # 计入绩点的学分（不含合格制课程）
+    quality_points = db.Column(db.Float, nullable=False, default=0)  # 学分 × 绩点之和
+    gpa = db.Column(db.Float)  # 学分加权平均绩点
+    earned_credits = db.Column(db.Float, nullable=False, default=0)  # 已获得学分（及格课程）
+    failed_count = db.Column(db.Integer, nullable=False, default=0)  # 不及格门数
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    student = db.relationship('User', backref='transcripts')
+
+    __table_args__ = (
+        db.Index('uq_student_transcripts_term', 'student_id', 'academic_year', 'semester', unique=True),
+        db.Index('ix_student_transcripts_updated', 'updated_at'),
+    )
+
+    @property
+    def is_cumulative(self):
+        return self.academic_year == '' and self.semester == ''
+
+    @property
+    def term_label(self):
+        return '累计' if self.is_cumulative else f'{self.academic_year} {self.semester}'.strip()
+
+    def to_dict(self):
+        return {
+            'academic_year': self.academic_year,
+            'semester': self.semester,
+            'term': self.term_label,
+            'course_count': self.course_count,
+            'total_credits': self.total_credits,
+            'earned_credits': self.earned_credits,
+            'gpa': round(self.gpa, 2) if self.gpa is not None else None,
+            'failed_count': self.failed_count
+        }
+
+
 # 在 models.py 末尾添加以下新模型
 
+# 学业预警与挂科课程的关联（按课程筛选预警时从课程一侧走索引）
+alert_failed_courses = db.Table(
+    'alert_failed_courses',
+    db.Column('alert_id', db.Integer, db.ForeignKey('academic_alerts.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('course_id', db.Integer, db.ForeignKey('courses.id'), primary_key=True),
+    db.Index('ix_alert_failed_courses_course', 'course_id', 'alert_id'),
+)
+
+
 class AcademicAlert(db.Model):
     """学业预警模型"""
     __tablename__ = 'academic_alerts'
@@ -415,7 +533,7 @@ class AcademicAlert(db.Model):
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     counselor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     alert_level = db.Column(db.String(20), nullable=False)  # 一级/二级/三级
-    failed_courses = db.Column(db.Text, nullable=False)  # 挂科科目（JSON格式存储）
+    failed_courses = db.Column(db.Text, nullable=False)  # 挂科科目名称（JSON，兼容旧数据；以 courses 关联为准）
     total_failed = db.Column(db.Integer, nullable=False)  # 总挂科数
     reason = db.Column(db.Text)  # 预警原因分析
     semester = db.Column(db.String(20), nullable=False)  # 学期
@@ -426,6 +544,14 @@ class AcademicAlert(db.Model):
     # 关系
     student = db.relationship('User', backref='academic_alerts', foreign_keys=[student_id])
     counselor = db.relationship('User', backref='managed_alerts', foreign_keys=[counselor_id])
+    courses = db.relationship('Course', secondary=alert_failed_courses, order_by='Course.course_code',
+                              backref='academic_alerts')  # 挂科课程
+
+    # 索引：辅导员预警列表（按状态筛选、按时间排序）、学生学期预警查重
+    __table_args__ = (
+        db.Index('ix_academic_alerts_counselor_status', 'counselor_id', 'status', 'created_at'),
+        db.Index('ix_academic_alerts_student_semester', 'student_id', 'semester'),
+    )
 
     def to_dict(self):
         return {
@@ -435,7 +561,7 @@ class AcademicAlert(db.Model):
             'class_name': self.student.class_info.class_name if self.student and self.student.class_info else '',
             'alert_level': self.alert_level,
             'total_failed': self.total_failed,
-            'failed_courses': self.failed_courses,
+            'failed_courses': self.get_failed_courses_list(),
             'reason': self.reason,
             'semester': self.semester,
             'status': self.status,
@@ -443,21 +569,8 @@ class AcademicAlert(db.Model):
         }
 
     def get_failed_courses_list(self):
-        """获取挂科科目列表（解析JSON并处理Unicode）"""
-        try:
-            import json
-            if self.failed_courses and self.failed_courses.startswith('['):
-                courses = json.loads(self.failed_courses)
-                # 确保返回的是列表
-                if isinstance(courses, list):
-                    return courses
-                else:
-                    return [courses]
-            else:
-                return [self.failed_courses] if self.failed_courses else []
-        except Exception as e:
-            print(f"解析挂科科目失败: {e}")
-            return [self.failed_courses] if self.failed_courses else []
+        """挂科课程名称列表"""
+        return [course.course_name for course in self.courses]
 
 
 class CounselingRecord(db.Model):
@@ -477,6 +590,10 @@ class CounselingRecord(db.Model):
     alert = db.relationship('AcademicAlert', backref='counseling_records')
     counselor = db.relationship('User', backref='counseling_records', foreign_keys=[counselor_id])
 
+    __table_args__ = (
+        db.Index('ix_counseling_records_alert_time', 'alert_id', 'counseling_time'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -485,4 +602,24 @@ class CounselingRecord(db.Model):
             'content': self.content,
             'plan': self.plan,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M')
-        }
\ No newline at end of file
+        }
+
+
+class AlertRun(db.Model):
+    """学业预警生成记录（增量生成以上次运行的开始时间为界，见 services/alerts.py）"""
+    __tablename__ = 'alert_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    counselor_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # 为空表示全校
+    incremental = db.Column(db.Boolean, nullable=False, default=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    students_scanned = db.Column(db.Integer, nullable=False, default=0)
+    alerts_created = db.Column(db.Integer, nullable=False, default=0)
+    alerts_updated = db.Column(db.Integer, nullable=False, default=0)
+    alerts_resolved = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 不再触发而解除的预警数
+    timings = db.Column(db.Text, nullable=False, default='{}')  # JSON：{阶段: 毫秒}
+
+    __table_args__ = (
+        db.Index('ix_alert_runs_counselor_started', 'counselor_id', 'started_at'),
+    )
@@ -1,9 +1,15 @@
 # routes/classroom.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file, current_app, \
+    abort
 from flask_login import login_required, current_user
 from datetime import datetime, date, time, timedelta
 import os
-from models import db, Classroom, ClassroomBooking, User
+from models import ClassroomBooking
+from services.availability import availability_index, format_seconds
+from services.bookings import submit_booking as submit_booking_request, submit_series, resolve_pending, \
+    APPROVAL_POLICIES, RECURRENCE_WEEKS, BookingRejected
+from services.transactions import BUSY_MESSAGE
+from services.vouchers import load_voucher_details, issue_vouchers, verify_voucher, check_window, InvalidVoucher
 from werkzeug.utils import secure_filename
 
 classroom_bp = Blueprint('classroom', __name__, url_prefix='/classroom')
@@ -17,7 +23,9 @@ def booking():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
 
-    return render_template('student/classroom_booking.html')
+    _, rooms = availability_index.rooms()
+    buildings = sorted({room.building for room in rooms})
+    return render_template('student/classroom_booking.html', buildings=buildings)
 
 
 @classroom_bp.route('/available-classrooms', methods=['POST'])
@@ -46,47 +54,64 @@ def available_classrooms():
     if booking_date < date.today():
         return jsonify({'error': '不能借用过去的日期'}), 400
 
-    # 查询已被占用的教室
-    booked_classrooms = ClassroomBooking.query.filter(
-        ClassroomBooking.booking_date == booking_date,
-        ClassroomBooking.status == 'approved',
-        db.or_(
-            db.and_(
-                ClassroomBooking.start_time <= start_time,
-                ClassroomBooking.end_time > start_time
-            ),
-            db.and_(
-                ClassroomBooking.start_time < end_time,
-                ClassroomBooking.end_time >= end_time
-            ),
-            db.and_(
-                ClassroomBooking.start_time >= start_time,
-                ClassroomBooking.end_time <= end_time
-            )
-        )
-    ).with_entities(ClassroomBooking.classroom_id).all()
-
-    booked_classroom_ids = [bc[0] for bc in booked_classrooms]
-
-    # 查询可用教室（排除已被占用和维修中的教室）
-    available_classrooms = Classroom.query.filter(
-        Classroom.status == 'available',
-        ~Classroom.id.in_(booked_classroom_ids) if booked_classroom_ids else True
-    ).all()
-
-    classrooms_data = []
-    for classroom in available_classrooms:
-        classrooms_data.append({
-            'id': classroom.id,
-            'room_number': classroom.room_number,
-            'building': classroom.building,
-            'capacity': classroom.capacity,
-            'equipment': classroom.equipment
-        })
+    # 参与人数（可选）作为容量下限
+    try:
+        participants = int(data.get('participants') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': '参与人数格式错误'}), 400
+
+    # 空闲索引按位与筛选，不逐次查询借用记录
+    classrooms_data = [room.to_dict() for room in availability_index.free_classrooms(
+        booking_date, start_time, end_time, min_capacity=participants)]
 
     return jsonify({'classrooms': classrooms_data})
 
 
+@classroom_bp.route('/free-slots')
+@login_required
+def free_slots():
+    """空闲时段一览：日期范围内各教室可借用的时间段（?start_date=&days=&building=&capacity=&duration=）"""
+    if not current_user.is_student():
+        return jsonify({'error': '无权访问'}), 403
+
+    config = current_app.config
+    try:
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() \
+            if request.args.get('start_date') else date.today()
+        days = request.args.get('days', 7, type=int)
+        capacity = request.args.get('capacity', 0, type=int)
+        duration = request.args.get('duration', 60, type=int)
+        opening_hours = (datetime.strptime(config['CLASSROOM_OPEN_TIME'], '%H:%M').time(),
+                         datetime.strptime(config['CLASSROOM_CLOSE_TIME'], '%H:%M').time())
+    except ValueError:
+        return jsonify({'error': '日期格式错误'}), 400
+
+    if start_date < date.today():
+        return jsonify({'error': '不能借用过去的日期'}), 400
+    if not 1 <= days <= config['CLASSROOM_GRID_MAX_DAYS']:
+        return jsonify({'error': f"查询天数应为 1-{config['CLASSROOM_GRID_MAX_DAYS']} 天"}), 400
+
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    grid = availability_index.free_grid(dates, opening_hours, building=request.args.get('building') or None,
+                                        min_capacity=capacity, min_duration=duration)
+
+    rooms_data = []
+    for room in grid.rooms:
+        room_data = room.to_dict()
+        room_data['days'] = [{
+            'free_minutes': sum(end - start for start, end in windows[room.id]) // 60,
+            'windows': [[format_seconds(start), format_seconds(end)] for start, end in windows[room.id]]
+        } for _, windows in grid.days]
+        rooms_data.append(room_data)
+
+    return jsonify({
+        'dates': [day.isoformat() for day in dates],
+        'open_time': config['CLASSROOM_OPEN_TIME'],
+        'close_time': config['CLASSROOM_CLOSE_TIME'],
+        'rooms': rooms_data
+    })
+
+
 @classroom_bp.route('/submit-booking', methods=['POST'])
 @login_required
 def submit_booking():
@@ -111,72 +136,98 @@ def submit_booking():
         booking_date = datetime.strptime(booking_date, '%Y-%m-%d').date()
         start_time = datetime.strptime(start_time_str, '%H:%M').time()
         end_time = datetime.strptime(end_time_str, '%H:%M').time()
+        classroom_id = int(classroom_id)
         participants = int(participants)
     except ValueError:
         flash('数据格式错误', 'danger')
         return redirect(url_for('classroom.booking'))
 
-    # 验证时间合法性
-    if start_time >= end_time:
-        flash('结束时间必须晚于开始时间', 'danger')
+    # 冲突检查与写入由借用引擎在同一把锁和事务内完成
+    ok, message = submit_booking_request(current_user.id, classroom_id, booking_date, start_time, end_time,
+                                         purpose, participants)
+    if not ok:
+        flash(message, 'danger')
         return redirect(url_for('classroom.booking'))
 
-    if booking_date < date.today():
-        flash('不能借用过去的日期', 'danger')
-        return redirect(url_for('classroom.booking'))
+    flash(message, 'success')
+    return redirect(url_for('classroom.booking_records'))
 
-    # 检查教室是否存在且可用
-    classroom = Classroom.query.get(classroom_id)
-    if not classroom or classroom.status != 'available':
-        flash('所选教室不可用', 'danger')
-        return redirect(url_for('classroom.booking'))
 
-    # 检查参与人数是否超过教室容量
-    if participants > classroom.capacity:
-        flash(f'参与人数不能超过教室容量（{classroom.capacity}人）', 'danger')
-        return redirect(url_for('classroom.booking'))
+@classroom_bp.route('/submit-recurring-booking', methods=['POST'])
+@login_required
+def submit_recurring_booking():
+    """提交重复借用申请（每周或每两周），返回每次借用的提交结果"""
+    if not current_user.is_student():
+        return jsonify({'error': '无权访问'}), 403
 
-    # 检查时间冲突
-    existing_booking = ClassroomBooking.query.filter(
-        ClassroomBooking.classroom_id == classroom_id,
-        ClassroomBooking.booking_date == booking_date,
-        ClassroomBooking.status == 'approved',
-        db.or_(
-            db.and_(
-                ClassroomBooking.start_time <= start_time,
-                ClassroomBooking.end_time > start_time
-            ),
-            db.and_(
-                ClassroomBooking.start_time < end_time,
-                ClassroomBooking.end_time >= end_time
-            ),
-            db.and_(
-                ClassroomBooking.start_time >= start_time,
-                ClassroomBooking.end_time <= end_time
-            )
-        )
-    ).first()
-
-    if existing_booking:
-        flash('该时间段教室已被占用，请选择其他时间', 'danger')
-        return redirect(url_for('classroom.booking'))
+    form = request.form
+    frequency = form.get('frequency')
+    if not all([form.get('classroom_id'), form.get('booking_date'), form.get('repeat_until'), form.get('start_time'),
+                form.get('end_time'), form.get('purpose'), form.get('participants')]):
+        return jsonify({'error': '请填写所有必填字段'}), 400
+    if frequency not in RECURRENCE_WEEKS:
+        return jsonify({'error': '重复方式错误'}), 400
 
-    # 创建借用申请
-    booking = ClassroomBooking(
-        student_id=current_user.id,
-        classroom_id=classroom_id,
-        booking_date=booking_date,
-        start_time=start_time,
-        end_time=end_time,
-        purpose=purpose,
-        participants=participants
-    )
+    try:
+        first_date = datetime.strptime(form['booking_date'], '%Y-%m-%d').date()
+        until = datetime.strptime(form['repeat_until'], '%Y-%m-%d').date()
+        start_time = datetime.strptime(form['start_time'], '%H:%M').time()
+        end_time = datetime.strptime(form['end_time'], '%H:%M').time()
+        classroom_id = int(form['classroom_id'])
+        participants = int(form['participants'])
+    except ValueError:
+        return jsonify({'error': '数据格式错误'}), 400
+
+    ok, message, occurrences = submit_series(
+        current_user.id, classroom_id, first_date, until, frequency, start_time, end_time, form['purpose'],
+        participants, current_app.config['BOOKING_SERIES_MAX_OCCURRENCES'])
+    if not occurrences:
+        return jsonify({'error': message}), 503 if message == BUSY_MESSAGE else 400
+
+    return jsonify({
+        'success': ok,
+        'message': message,
+        'occurrences': [{
+            'date': occurrence.booking_date.isoformat(),
+            'booking_id': occurrence.booking_id,
+            'accepted': occurrence.booking_id is not None,
+            'message': occurrence.message
+        } for occurrence in occurrences]
+    })
+
+
+@classroom_bp.route('/approve-bookings', methods=['POST'])
+@login_required
+def approve_bookings():
+    """批量审批日期范围内的待审批借用申请（冲突的申请自动拒绝）"""
+    if not current_user.is_counselor():
+        return jsonify({'error': '无权访问'}), 403
 
-    db.session.add(booking)
-    db.session.commit()
+    data = request.get_json(silent=True) or request.form
+    config = current_app.config
+    policy = data.get('policy') or config['BOOKING_APPROVAL_POLICY']
+    try:
+        start_date = datetime.strptime(data.get('start_date') or '', '%Y-%m-%d').date()
+        end_date = datetime.strptime(data.get('end_date'), '%Y-%m-%d').date() if data.get('end_date') else start_date
+    except ValueError:
+        return jsonify({'error': '日期格式错误'}), 400
 
-    flash('教室借用申请提交成功，等待管理员审核', 'success')
-    return redirect(url_for('classroom.booking_records'))
+    if policy not in APPROVAL_POLICIES:
+        return jsonify({'error': f"审批策略应为 {'、'.join(APPROVAL_POLICIES)}"}), 400
+    if not 0 <= (end_date - start_date).days < config['BOOKING_APPROVAL_MAX_DAYS']:
+        return jsonify({'error': f"审批天数应为 1-{config['BOOKING_APPROVAL_MAX_DAYS']} 天"}), 400
+
+    try:
+        result = resolve_pending(start_date, end_date, current_user.id, policy)
+    except BookingRejected as e:
+        return jsonify({'error': e.message}), 503
+    _issue_vouchers(load_voucher_details(result.approved).values())
+    return jsonify({
+        'success': True,
+        'message': f'已批准 {len(result.approved)} 条申请，拒绝 {len(result.rejected)} 条',
+        'approved': result.approved,
+        'rejected': [{'id': booking_id, 'reason': reason} for booking_id, reason in result.rejected.items()]
+    })
 
 
 @classroom_bp.route('/records')
@@ -193,49 +244,59 @@ def booking_records():
     return render_template('student/booking_records.html', bookings=bookings)
 
 
+def _issue_vouchers(details):
+    """生成凭证文件，二维码内容为核验地址"""
+    config = current_app.config
+    return issue_vouchers(details, config['SECRET_KEY'], config['UPLOAD_FOLDER'],
+                          lambda token: url_for('classroom.check_in', token=token, _external=True))
+
+
 @classroom_bp.route('/download-voucher/<int:booking_id>')
 @login_required
 def download_voucher(booking_id):
-    """下载借用凭证"""
+    """下载借用凭证（批准时已生成，直接从磁盘返回，支持 ETag 条件请求）"""
     if not current_user.is_student():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
 
-    booking = ClassroomBooking.query.get_or_404(booking_id)
+    details = load_voucher_details([booking_id]).get(booking_id)
+    if details is None:
+        abort(404)
 
-    if booking.student_id != current_user.id:
+    if details.student_id != current_user.id:
         flash('无权访问此记录', 'danger')
         return redirect(url_for('classroom.booking_records'))
 
-    if booking.status != 'approved':
+    if details.status != 'approved':
         flash('只有已批准的申请才能下载凭证', 'warning')
         return redirect(url_for('classroom.booking_records'))
 
-    # 生成简单的借用凭证（这里简化处理，实际可以生成PDF）
-    voucher_content = f"""
-    教室借用凭证
-    ====================
-
-    学生姓名：{booking.student.real_name}
-    教室编号：{booking.classroom.room_number}
-    教学楼：{booking.classroom.building}
-    借用日期：{booking.booking_date.strftime('%Y年%m月%d日')}
-    借用时间：{booking.start_time.strftime('%H:%M')} - {booking.end_time.strftime('%H:%M')}
-    借用事由：{booking.purpose}
-    参与人数：{booking.participants}
-
-    审批状态：已批准
-    凭证生成时间：{datetime.now().strftime('%Y年%m月%d日 %H:%M')}
-
-    请凭此凭证使用教室，使用时请遵守教室使用规定。
-    """
-
-    from io import BytesIO
-    buffer = BytesIO(voucher_content.encode('utf-8'))
-
+    # 批准前已生成或文件丢失时在此补发
+    path = _issue_vouchers([details])[booking_id]
+    stem, suffix = os.path.splitext(os.path.basename(path))
+    claims = details.claims
     return send_file(
-        buffer,
+        os.path.join(current_app.config['UPLOAD_FOLDER'], path),
         as_attachment=True,
-        download_name=f'教室借用凭证_{booking.classroom.room_number}_{booking.booking_date.strftime("%Y%m%d")}.txt',
-        mimetype='text/plain'
-    )
\ No newline at end of file
+        download_name=f'教室借用凭证_{claims.room_number}_{claims.booking_date.strftime("%Y%m%d")}{suffix}',
+        mimetype='application/pdf' if suffix == '.pdf' else 'text/plain',
+        etag=stem,
+        conditional=True,
+        max_age=3600
+    )
+
+
+@classroom_bp.route('/check-in')
+def check_in():
+    """门卫扫码核验借用凭证（只校验签名和借用时段，不访问数据库，无需登录）"""
+    config = current_app.config
+    try:
+        claims = verify_voucher(request.args.get('token', ''), config['SECRET_KEY'])
+        check_window(claims, datetime.now(), config['VOUCHER_CHECKIN_GRACE_MINUTES'])
+    except InvalidVoucher as e:
+        response = {'error': e.message}
+        if e.claims:
+            response['voucher'] = e.claims.to_dict()
+        return jsonify(response), 400
+
+    return jsonify({'success': True, 'message': '凭证有效', 'voucher': claims.to_dict()})
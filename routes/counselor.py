@@ -1,10 +1,16 @@
 # routes/counselor.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file, Response, \
+    stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
-import json
+import tempfile
+from urllib.parse import quote
 from models import db, User, Class, Course, AcademicAlert, CounselingRecord, Exam
 from werkzeug.utils import secure_filename
+from services.transcripts import get_transcript, get_cumulative_transcripts
+from services.alerts import run_alert_engine, format_timings
+from services.alert_list import AlertFilters, ALERT_PAGE_SIZE, get_alert_page, count_alerts
+from services.alert_export import stream_csv, write_xlsx
 
 counselor_bp = Blueprint('counselor', __name__, url_prefix='/counselor')
 
@@ -27,8 +33,8 @@ def dashboard():
     classes = Class.query.filter_by(counselor_id=current_user.id).all()
 
     # 统计预警信息
-    total_alerts = AcademicAlert.query.filter_by(counselor_id=current_user.id).count()
-    active_alerts = AcademicAlert.query.filter_by(counselor_id=current_user.id, status='active').count()
+    total_alerts = count_alerts(AlertFilters(current_user.id))
+    active_alerts = count_alerts(AlertFilters(current_user.id, status='active'))
 
     return render_template('counselor/dashboard.html',
                            title='辅导员仪表板',
@@ -43,51 +49,67 @@ def dashboard():
 @counselor_bp.route('/academic-alerts')
 @login_required
 def academic_alerts():
-    """学业预警页面"""
+    """学业预警页面（游标分页，后续页面由 alerts_api 加载）"""
     if not current_user.is_counselor():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
 
     # 获取筛选条件
-    alert_level = request.args.get('alert_level', '')
-    class_id = request.args.get('class_id', '')
-    status = request.args.get('status', 'active')
+    filters = AlertFilters.from_args(current_user.id, request.args, default_status='active')
 
-    # 构建查询
-    query = AcademicAlert.query.filter_by(counselor_id=current_user.id)
-
-    if alert_level:
-        query = query.filter_by(alert_level=alert_level)
-
-    if class_id:
-        query = query.join(User).filter(User.class_id == class_id)
-
-    if status:
-        query = query.filter_by(status=status)
-
-    alerts = query.order_by(AcademicAlert.created_at.desc()).all()
+    try:
+        page = get_alert_page(filters, request.args.get('cursor'))
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('counselor.academic_alerts', **filters.to_args()))
 
-    # 预处理数据，解析JSON字符串
-    for alert in alerts:
-        try:
-            # 如果failed_courses是JSON字符串，解析它
-            if alert.failed_courses and alert.failed_courses.startswith('['):
-                import json
-                alert.parsed_courses = json.loads(alert.failed_courses)
-            else:
-                alert.parsed_courses = [alert.failed_courses] if alert.failed_courses else []
-        except:
-            alert.parsed_courses = [alert.failed_courses] if alert.failed_courses else []
+    # 学生累计成绩单（一次查询）
+    transcripts = get_cumulative_transcripts({alert.student_id for alert in page.alerts})
 
     # 获取辅导员负责的班级
     classes = Class.query.filter_by(counselor_id=current_user.id).all()
 
     return render_template('counselor/academic_alert.html',
-                           alerts=alerts,
+                           alerts=page.alerts,
+                           next_cursor=page.next_cursor,
+                           total=count_alerts(filters),
+                           transcripts=transcripts,
                            classes=classes,
-                           alert_level=alert_level,
-                           class_id=class_id,
-                           status=status)
+                           filter_args=filters.to_args(),
+                           alert_level=filters.alert_level,
+                           class_id=filters.class_id,
+                           course_name=filters.course_name,
+                           status=filters.status)
+
+
+@counselor_bp.route('/api/alerts')
+@login_required
+def alerts_api():
+    """预警列表分页接口（无限滚动）：?cursor=上一页的 next_cursor&limit=条数，筛选参数同预警页面"""
+    if not current_user.is_counselor():
+        return jsonify({'error': '无权访问'}), 403
+
+    filters = AlertFilters.from_args(current_user.id, request.args, default_status='active')
+    try:
+        page = get_alert_page(filters, request.args.get('cursor'),
+                              request.args.get('limit', ALERT_PAGE_SIZE, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    transcripts = get_cumulative_transcripts({alert.student_id for alert in page.alerts})
+    items = []
+    for alert in page.alerts:
+        transcript = transcripts.get(alert.student_id)
+        items.append(dict(alert.to_dict(),
+                          gpa=round(transcript.gpa, 2) if transcript and transcript.gpa is not None else None,
+                          earned_credits=transcript.earned_credits if transcript else None))
+
+    return jsonify({
+        'success': True,
+        'alerts': items,
+        'next_cursor': page.next_cursor,
+        'total': count_alerts(filters)
+    })
 
 
 @counselor_bp.route('/alert-detail/<int:alert_id>')
@@ -105,15 +127,15 @@ def alert_detail(alert_id):
         flash('无权访问此记录', 'danger')
         return redirect(url_for('counselor.academic_alerts'))
 
-    # 预处理挂科科目数据
-    alert.parsed_courses = alert.get_failed_courses_list()
-
     # 获取辅导记录
     counseling_records = CounselingRecord.query.filter_by(alert_id=alert_id) \
         .order_by(CounselingRecord.counseling_time.desc()).all()
 
+    transcript, _ = get_transcript(alert.student_id)
+
     return render_template('counselor/alert_detail.html',
                            alert=alert,
+                           transcript=transcript,
                            counseling_records=counseling_records)
 
 
@@ -197,104 +219,59 @@ def export_alerts():
         return redirect(url_for('auth.login'))
 
     # 获取筛选条件
-    alert_level = request.args.get('alert_level', '')
-    class_id = request.args.get('class_id', '')
+    filters = AlertFilters.from_args(current_user.id, request.args)
+    filename = f'学业预警名单_{datetime.now().strftime("%Y%m%d")}'
 
-    # 构建查询
-    query = AcademicAlert.query.filter_by(counselor_id=current_user.id)
-
-    if alert_level:
-        query = query.filter_by(alert_level=alert_level)
-
-    if class_id:
-        query = query.join(User).filter(User.class_id == class_id)
-
-    alerts = query.order_by(AcademicAlert.alert_level, AcademicAlert.created_at).all()
-
-    # 生成Excel格式内容（简化版，实际可以使用openpyxl等库）
-    excel_content = "学号,姓名,班级,预警等级,挂科数量,挂科科目,预警原因,学期\n"
-
-    for alert in alerts:
-        student = alert.student
-        class_name = student.class_info.class_name if student and student.class_info else ''
+    if request.args.get('format') == 'xlsx':
+        try:
+            output = write_xlsx(filters, '学业预警名单', tempfile.TemporaryFile())
 
-        excel_content += f'{student.username},{student.real_name},{class_name},'
-        excel_content += f'{alert.alert_level},{alert.total_failed},'
-        excel_content += f'"{alert.failed_courses}","{alert.reason}",{alert.semester}\n'
+            return send_file(
+                output,
+                as_attachment=True,
+                download_name=f'{filename}.xlsx',
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
 
-    from io import BytesIO
-    buffer = BytesIO(excel_content.encode('utf-8'))
+        except ImportError:
+            flash('请安装 openpyxl 库以支持Excel导出，或选择导出CSV', 'warning')
+            return redirect(url_for('counselor.academic_alerts', **filters.to_args()))
+        except Exception as e:
+            flash(f'导出失败: {str(e)}', 'danger')
+            return redirect(url_for('counselor.academic_alerts', **filters.to_args()))
 
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=f'学业预警名单_{datetime.now().strftime("%Y%m%d")}.csv',
-        mimetype='text/csv'
-    )
+    # 默认带 BOM 便于 Excel 打开，?bom=0 导出不带 BOM 的 UTF-8
+    bom = request.args.get('bom', '1') != '0'
+    response = Response(stream_with_context(stream_csv(filters, bom=bom)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename + '.csv')}"
+    return response
 
 
 @counselor_bp.route('/generate-alerts')
 @login_required
 def generate_alerts():
-    """生成学业预警（测试用）"""
+    """按成绩自动生成学业预警（默认只处理上次生成后成绩有变化的学生，?full=1 全量生成）"""
     if not current_user.is_counselor():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
 
     # 获取辅导员负责的班级
-    classes = Class.query.filter_by(counselor_id=current_user.id).all()
-
-    if not classes:
+    if not Class.query.filter_by(counselor_id=current_user.id).first():
         flash('您目前没有负责的班级', 'warning')
         return redirect(url_for('counselor.dashboard'))
 
-    # 模拟生成预警数据（实际应该根据成绩数据自动生成）
-    sample_alerts = [
-        {
-            'student_username': 'stu001',
-            'alert_level': '一级',
-            'failed_courses': '["高等数学", "数据结构", "Python程序设计"]',
-            'total_failed': 3,
-            'reason': '连续两学期挂科≥2门',
-            'semester': '2023-2024-1'
-        },
-        {
-            'student_username': 'stu002',
-            'alert_level': '二级',
-            'failed_courses': '["高等数学", "数据结构"]',
-            'total_failed': 2,
-            'reason': '挂科2门',
-            'semester': '2023-2024-1'
-        }
-    ]
-
-    created_count = 0
-    for alert_data in sample_alerts:
-        student = User.query.filter_by(username=alert_data['student_username']).first()
-        if student and student.class_info and student.class_info.counselor_id == current_user.id:
-            # 检查是否已存在相同预警
-            existing_alert = AcademicAlert.query.filter_by(
-                student_id=student.id,
-                semester=alert_data['semester']
-            ).first()
-
-            if not existing_alert:
-                alert = AcademicAlert(
-                    student_id=student.id,
-                    counselor_id=current_user.id,
-                    alert_level=alert_data['alert_level'],
-                    failed_courses=alert_data['failed_courses'],
-                    total_failed=alert_data['total_failed'],
-                    reason=alert_data['reason'],
-                    semester=alert_data['semester']
-                )
-                db.session.add(alert)
-                created_count += 1
-
-    if created_count > 0:
-        db.session.commit()
-        flash(f'成功生成 {created_count} 条学业预警', 'success')
+    try:
+        run = run_alert_engine(current_user.id, incremental=request.args.get('full') != '1')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'生成预警失败: {str(e)}', 'danger')
+        return redirect(url_for('counselor.academic_alerts'))
+
+    scope = '增量' if run.incremental else '全量'
+    if run.alerts_created or run.alerts_updated or run.alerts_resolved:
+        flash(f'{scope}扫描 {run.students_scanned} 名学生，新增 {run.alerts_created} 条、'
+              f'更新 {run.alerts_updated} 条、解除 {run.alerts_resolved} 条学业预警（{format_timings(run)}）', 'success')
     else:
-        flash('没有新的预警需要生成', 'info')
+        flash(f'{scope}扫描 {run.students_scanned} 名学生，没有新的预警需要生成', 'info')
 
     return redirect(url_for('counselor.academic_alerts'))
\ No newline at end of file
@@ -1,24 +1,47 @@
 # routes/schedule.py
-from flask import Blueprint, jsonify
+from datetime import date
+from flask import Blueprint, jsonify, request, make_response
 from flask_login import login_required, current_user
-from models import db, Schedule  # 直接从 models 导入
+from services.timetable import get_timetable, iso_week_of
 
 schedule_bp = Blueprint('schedule', __name__)
 
 
-@schedule_bp.route('/api/schedule/week/<int:week_offset>')
+@schedule_bp.route('/api/schedule/week/<int(signed=True):week_offset>')
 @login_required
 def api_schedule_by_week(week_offset):
-    """API: 按周获取课表数据"""
+    """API: 按周获取课表数据（week_offset 为相对本周的偏移）"""
     if not current_user.is_student():
         return jsonify({'error': '无权访问'}), 403
 
-    schedules = Schedule.query.filter_by(class_id=current_user.class_id).all()
+    iso_year, iso_week = iso_week_of(week_offset)
+    return timetable_response(current_user.class_id, iso_year, iso_week)
 
-    schedule_data = {}
-    for schedule in schedules:
-        day_data = schedule_data.get(schedule.day_of_week, [])
-        day_data.append(schedule.to_dict())
-        schedule_data[schedule.day_of_week] = day_data
 
-    return jsonify(schedule_data)
\ No newline at end of file
+@schedule_bp.route('/api/schedule/<int:iso_year>/W<int:iso_week>')
+@login_required
+def api_schedule_by_iso_week(iso_year, iso_week):
+    """API: 按 ISO 年份和周次获取课表数据"""
+    if not current_user.is_student():
+        return jsonify({'error': '无权访问'}), 403
+
+    try:
+        date.fromisocalendar(iso_year, iso_week, 1)
+    except ValueError:
+        return jsonify({'error': '周次无效'}), 400
+
+    return timetable_response(current_user.class_id, iso_year, iso_week)
+
+
+def timetable_response(class_id, iso_year, iso_week):
+    """返回课表；客户端携带的 ETag 未变化时直接返回 304"""
+    timetable = get_timetable(class_id, iso_year, iso_week)
+
+    if request.if_none_match.contains(timetable['etag']):
+        response = make_response('', 304)
+    else:
+        response = jsonify(timetable['data'])
+
+    response.set_etag(timetable['etag'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
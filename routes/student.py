@@ -1,12 +1,18 @@
 # routes/student.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 import os
 from models import db, Schedule, Exam, LeaveApplication, User, Class, Course, SelectedCourse, Grade, Classroom, \
     ClassroomBooking,Announcement
 from werkzeug.utils import secure_filename
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from services.serializers import loader_options
+from services.conflict import course_conflicts, annotate_conflicts
+from services import selection
+from services.registration_queue import get_registration_queue, RateLimited, QueueFull
+from services.transcripts import get_transcript
+from services.bookings import submit_booking
 
 student_bp = Blueprint('student', __name__, url_prefix='/student')
 
@@ -25,62 +31,33 @@ def dashboard():
         'username': current_user.username
     }
 
-    # 获取各种统计信息
+    # 一次查询获取全部统计信息
     try:
-        selected_courses_count = SelectedCourse.query.filter_by(student_id=current_user.id).count()
-    except:
-        selected_courses_count = 0
+        counters = get_dashboard_counters(current_user)
+    except Exception as e:
+        print(f"获取学生统计数据失败: {e}")
+        counters = dict.fromkeys(DASHBOARD_COUNTER_NAMES, 0)
 
-    try:
-        # 待审批请假数量
-        pending_leaves_count = LeaveApplication.query.filter_by(
-            student_id=current_user.id,
-            status='pending'
-        ).count()
-    except:
-        pending_leaves_count = 0
+    return render_template('student/dashboard.html',
+                           title='学生仪表板',
+                           user=user_info,
+                           now=datetime.now(),
+                           **counters)
 
-    try:
-        # 活跃的教室借用数量
-        active_bookings_count = ClassroomBooking.query.filter_by(
-            student_id=current_user.id
-        ).filter(
-            ClassroomBooking.status.in_(['pending', 'approved'])
-        ).count()
-    except:
-        active_bookings_count = 0
 
-    try:
-        # 近期考试数量（未来7天内）
-        upcoming_exams_count = Exam.query.filter_by(
-            class_id=current_user.class_id
-        ).filter(
-            Exam.exam_time >= datetime.now(),
-            Exam.exam_time <= datetime.now() + timedelta(days=7)
-        ).count()
-    except:
-        upcoming_exams_count = 0
+@student_bp.route('/api/dashboard-counters')
+@login_required
+def api_dashboard_counters():
+    """API: 仪表板统计数字（供页面异步刷新）"""
+    if not current_user.is_student():
+        return jsonify({'error': '无权访问'}), 403
 
-    try:
-        # 未读公告数量（最近7天）
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        unread_announcements_count = Announcement.query.join(
-            SelectedCourse, Announcement.course_id == SelectedCourse.course_id
-        ).filter(
-            SelectedCourse.student_id == current_user.id,
-            Announcement.created_at >= seven_days_ago
-        ).count()
-    except:
-        unread_announcements_count = 0
+    counters = get_dashboard_counters(current_user)
+    counters['generated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    return render_template('student/dashboard.html',
-                           title='学生仪表板',
-                           user=user_info,
-                           selected_courses_count=selected_courses_count,
-                           pending_leaves_count=pending_leaves_count,
-                           active_bookings_count=active_bookings_count,
-                           upcoming_exams_count=upcoming_exams_count,
-                           now=datetime.now())
+    response = jsonify(counters)
+    response.headers['Cache-Control'] = 'private, max-age=30'
+    return response
 
 
 @student_bp.route('/schedule')
@@ -99,8 +76,10 @@ def schedule():
     start_of_week = current_date - timedelta(days=current_date.weekday())
     end_of_week = start_of_week + timedelta(days=6)
 
-    # 查询学生课表
-    schedules = Schedule.query.filter_by(class_id=current_user.class_id).all()
+    # 查询学生课表（预加载课程和教师）
+    schedules = Schedule.query.filter_by(class_id=current_user.class_id).options(
+        *loader_options(Schedule)
+    ).all()
 
     # 按星期几分组
     schedule_by_day = {}
@@ -353,48 +332,19 @@ def classroom_booking():
             booking_date = datetime.strptime(booking_date_str, '%Y-%m-%d').date()
             start_time = datetime.strptime(start_time_str, '%H:%M').time()
             end_time = datetime.strptime(end_time_str, '%H:%M').time()
+            classroom_id = int(classroom_id)
         except ValueError:
             flash('日期或时间格式错误', 'danger')
             return redirect(url_for('student.classroom_booking'))
 
-        if start_time >= end_time:
-            flash('结束时间必须晚于开始时间', 'danger')
-            return redirect(url_for('student.classroom_booking'))
-
-        # 检查教室是否可用
-        classroom = Classroom.query.get_or_404(classroom_id)
-
-        # 检查时间冲突
-        existing_booking = ClassroomBooking.query.filter_by(
-            classroom_id=classroom_id,
-            booking_date=booking_date
-        ).filter(
-            or_(
-                and_(ClassroomBooking.start_time <= start_time, ClassroomBooking.end_time > start_time),
-                and_(ClassroomBooking.start_time < end_time, ClassroomBooking.end_time >= end_time),
-                and_(ClassroomBooking.start_time >= start_time, ClassroomBooking.end_time <= end_time)
-            )
-        ).first()
-
-        if existing_booking:
-            flash('该时间段教室已被占用，请选择其他时间', 'warning')
+        # 冲突检查与写入由借用引擎在同一把锁和事务内完成
+        ok, message = submit_booking(current_user.id, classroom_id, booking_date, start_time, end_time,
+                                     purpose, participants)
+        if not ok:
+            flash(message, 'warning')
             return redirect(url_for('student.classroom_booking'))
 
-        # 创建借用申请
-        booking = ClassroomBooking(
-            student_id=current_user.id,
-            classroom_id=classroom_id,
-            booking_date=booking_date,
-            start_time=start_time,
-            end_time=end_time,
-            purpose=purpose,
-            participants=participants
-        )
-
-        db.session.add(booking)
-        db.session.commit()
-
-        flash('教室借用申请提交成功，等待审批', 'success')
+        flash(message, 'success')
         return redirect(url_for('student.booking_records'))
 
     # 获取可用教室列表
@@ -449,47 +399,17 @@ def select_course(course_id):
     if not current_user.is_student():
         return jsonify({'success': False, 'message': '无权操作'})
 
-    try:
-        course = Course.query.get_or_404(course_id)
-        print(f"调试: 选课请求 - 学生 {current_user.id} 尝试选择课程 {course_id} ({course.course_name})")
-
-        # 检查是否已选该课程
-        existing = SelectedCourse.query.filter_by(
-            student_id=current_user.id,
-            course_id=course_id
-        ).first()
-
-        if existing:
-            print(f"调试: 选课失败 - 已选择该课程")
-            return jsonify({'success': False, 'message': '已选择该课程'})
-
-        # 检查选课冲突
-        conflict = check_course_conflict(current_user.id, course_id)
-        if conflict:
-            print(f"调试: 选课失败 - 课程时间冲突")
-            return jsonify({'success': False, 'message': '课程时间冲突'})
-
-        # 检查学分限制
-        if not check_credit_limit(current_user.id, course.credit):
-            print(f"调试: 选课失败 - 超过学分限制")
-            return jsonify({'success': False, 'message': '超过学分限制'})
-
-        # 创建选课记录
-        selected_course = SelectedCourse(
-            student_id=current_user.id,
-            course_id=course_id,
-            selected_at=datetime.now()
-        )
-
-        db.session.add(selected_course)
-        db.session.commit()
+    Course.query.get_or_404(course_id)
 
-        print(f"调试: 选课成功 - 学生 {current_user.id} 成功选择课程 {course_id}")
+    if current_app.config.get('REGISTRATION_QUEUE_ENABLED'):
+        return enqueue_registration('select', course_id)
 
-        return jsonify({'success': True, 'message': '选课成功'})
+    try:
+        success, message = selection.select_course(current_user.id, course_id)
+        print(f"调试: 选课请求 - 学生 {current_user.id} 课程 {course_id}: {message}")
+        return jsonify({'success': success, 'message': message})
 
     except Exception as e:
-        db.session.rollback()
         print(f"调试: 选课异常 - {str(e)}")
         return jsonify({'success': False, 'message': f'选课失败: {str(e)}'})
 
@@ -501,18 +421,45 @@ def drop_course(course_id):
     if not current_user.is_student():
         return jsonify({'success': False, 'message': '无权操作'})
 
-    selected_course = SelectedCourse.query.filter_by(
-        student_id=current_user.id,
-        course_id=course_id
-    ).first()
+    if current_app.config.get('REGISTRATION_QUEUE_ENABLED'):
+        return enqueue_registration('drop', course_id)
+
+    try:
+        success, message = selection.drop_course(current_user.id, course_id)
+        return jsonify({'success': success, 'message': message})
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'退课失败: {str(e)}'})
+
 
-    if not selected_course:
-        return jsonify({'success': False, 'message': '未找到选课记录'})
+def enqueue_registration(operation, course_id):
+    """排队模式：登记选课/退课请求，返回凭证供客户端轮询"""
+    registration_queue = get_registration_queue(current_app._get_current_object())
+    try:
+        ticket = registration_queue.submit(current_user.id, operation, course_id)
+    except RateLimited:
+        return jsonify({'success': False, 'message': '操作过于频繁，请稍后再试'}), 429
+    except QueueFull:
+        return jsonify({'success': False, 'message': '当前选课人数过多，请稍后再试'}), 503
+
+    data = ticket.to_dict()
+    data['queued'] = True
+    data['status_url'] = url_for('student.registration_ticket', ticket_id=ticket.id)
+    return jsonify(data), 202
+
+
+@student_bp.route('/registration/ticket/<ticket_id>')
+@login_required
+def registration_ticket(ticket_id):
+    """查询排队凭证的处理状态"""
+    if not current_user.is_student():
+        return jsonify({'error': '无权访问'}), 403
 
-    db.session.delete(selected_course)
-    db.session.commit()
+    ticket = get_registration_queue(current_app._get_current_object()).get(ticket_id)
+    if ticket is None or ticket.user_id != current_user.id:
+        return jsonify({'error': '凭证不存在或已过期'}), 404
 
-    return jsonify({'success': True, 'message': '退课成功'})
+    return jsonify(ticket.to_dict())
 
 
 @student_bp.route('/grades')
@@ -523,24 +470,22 @@ def grades():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
 
-    # 获取学生成绩
+    # 获取学生成绩（课程和教师在同一条查询中加载）
     try:
-        grades_list = Grade.query.filter_by(student_id=current_user.id).all()
+        grades_list = Grade.query.options(
+            joinedload(Grade.course), joinedload(Grade.teacher)
+        ).filter_by(student_id=current_user.id).all()
     except Exception as e:
         print(f"成绩查询失败: {e}")
         grades_list = []
 
-    # 计算统计信息
-    total_credits = sum(grade.course.credit for grade in grades_list if grade.course)
-    total_gpa = sum(grade.grade_point or 0 for grade in grades_list)
-    course_count = len(grades_list)
-    average_gpa = total_gpa / course_count if course_count > 0 else 0
+    # 统计信息取自成绩单（随成绩写入维护）
+    cumulative, terms = get_transcript(current_user.id)
 
     return render_template('student/grades.html',
                            grades=grades_list,
-                           total_credits=total_credits,
-                           average_gpa=round(average_gpa, 2),
-                           course_count=course_count)
+                           transcript=cumulative,
+                           terms=terms)
 
 
 @student_bp.route('/my-courses')
@@ -564,8 +509,51 @@ def my_courses():
                            selected_courses=selected_courses)
 
 
+DASHBOARD_COUNTER_NAMES = (
+    'selected_courses_count',
+    'pending_leaves_count',
+    'active_bookings_count',
+    'upcoming_exams_count',
+    'unread_announcements_count',
+)
+
+
+def get_dashboard_counters(student):
+    """获取学生仪表板统计数字（各项计数作为标量子查询，一次往返完成）"""
+    now = datetime.now()
+
+    def count_of(column, *conditions):
+        return db.select(db.func.count(column)).where(*conditions).scalar_subquery()
+
+    statement = db.select(
+        # 已选课程数量
+        count_of(SelectedCourse.id, SelectedCourse.student_id == student.id),
+        # 待审批请假数量
+        count_of(LeaveApplication.id,
+                 LeaveApplication.student_id == student.id,
+                 LeaveApplication.status == 'pending'),
+        # 活跃的教室借用数量
+        count_of(ClassroomBooking.id,
+                 ClassroomBooking.student_id == student.id,
+                 ClassroomBooking.status.in_(['pending', 'approved'])),
+        # 近期考试数量（未来7天内）
+        count_of(Exam.id,
+                 Exam.class_id == student.class_id,
+                 Exam.exam_time >= now,
+                 Exam.exam_time <= now + timedelta(days=7)),
+        # 未读公告数量（最近7天）
+        count_of(Announcement.id,
+                 Announcement.course_id == SelectedCourse.course_id,
+                 SelectedCourse.student_id == student.id,
+                 Announcement.created_at >= now - timedelta(days=7)),
+    )
+
+    row = db.session.execute(statement).one()
+    return dict(zip(DASHBOARD_COUNTER_NAMES, row))
+
+
 def get_available_courses(student_id):
-    """获取学生可选课程列表"""
+    """获取学生可选课程列表（排除已选课程，并标记与已选课程时间冲突的课程）"""
     try:
         # 获取已选课程ID
         selected_course_ids = [sc.course_id for sc in
@@ -588,6 +576,9 @@ def get_available_courses(student_id):
             db.joinedload(Course.schedules)
         ).all()
 
+        # 一次性标记时间冲突，供页面置灰
+        annotate_conflicts(student_id, available_courses)
+
         print(f"调试: 找到 {len(available_courses)} 门可选课程")
         for course in available_courses:
             print(f"调试: 可选课程 - {course.course_name} (ID: {course.id}, 教师: {course.teacher.real_name if course.teacher else '无'})")
@@ -600,38 +591,14 @@ def get_available_courses(student_id):
 
 def check_course_conflict(student_id, course_id):
     """检查课程时间冲突"""
-    # 获取新课程的安排
-    new_course_schedules = Schedule.query.filter_by(course_id=course_id).all()
-
-    # 获取已选课程的安排
-    selected_courses = SelectedCourse.query.filter_by(student_id=student_id).all()
-    selected_course_ids = [sc.course_id for sc in selected_courses]
-
-    existing_schedules = Schedule.query.filter(
-        Schedule.course_id.in_(selected_course_ids)
-    ).all()
-
-    # 检查时间冲突
-    for new_schedule in new_course_schedules:
-        for existing_schedule in existing_schedules:
-            if (new_schedule.day_of_week == existing_schedule.day_of_week and
-                    time_overlap(new_schedule.start_time, new_schedule.end_time,
-                                 existing_schedule.start_time, existing_schedule.end_time)):
-                return True
-    return False
+    return course_conflicts(student_id, course_id)
 
 
 def check_credit_limit(student_id, new_credit):
-    """检查学分限制"""
-    selected_courses = SelectedCourse.query.filter_by(student_id=student_id).all()
-    total_credits = sum(course.course.credit for course in selected_courses)
-
-    return (total_credits + new_credit) <= 30  # 假设学分上限为30
-
+    """检查学分限制（读取冗余的已选学分合计）"""
+    total_credits = db.session.query(User.selected_credits).filter_by(id=student_id).scalar() or 0
 
-def time_overlap(start1, end1, start2, end2):
-    """检查时间是否重叠"""
-    return max(start1, start2) < min(end1, end2)
+    return (total_credits + new_credit) <= selection.CREDIT_LIMIT
 
 
 def allowed_file(filename):
@@ -651,7 +618,7 @@ def debug_courses():
     # 获取实际选课数据
     selected_courses = SelectedCourse.query.filter_by(
         student_id=current_user.id
-    ).all()
+    ).options(*loader_options(SelectedCourse)).all()
 
     # 获取可选课程数据
     available_courses = get_available_courses(current_user.id)
@@ -734,16 +701,9 @@ def debug_select_course(course_id):
 
     # 5. 尝试选课
     try:
-        selected_course = SelectedCourse(
-            student_id=current_user.id,
-            course_id=course_id,
-            selected_at=datetime.now()
-        )
-
-        db.session.add(selected_course)
-        db.session.commit()
+        success, message = selection.select_course(current_user.id, course_id)
 
-        debug_info['step'] = '选课成功'
+        debug_info['step'] = message
         return jsonify(debug_info)
 
     except Exception as e:
@@ -1,9 +1,18 @@
 # routes/teacher.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, send_file, Response, \
+    stream_with_context, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta,date
 import os
+import tempfile
+from urllib.parse import quote
 from models import db, Course, Announcement, CourseMaterial, User, Class,Grade,SelectedCourse
+from services.grades import upsert_grades, regrade_course, DEFAULT_EXAM_TYPE
+from services.grade_export import stream_csv, write_xlsx
+from services.grade_import import get_grade_importer, ImportFormatError
+from services.grade_stats import get_course_stats, get_course_grade_summaries
+from services.transcripts import refresh_course_transcripts
+from services.grading import SCALES, get_scale, scale_for
 
 from werkzeug.utils import secure_filename
 
@@ -300,17 +309,8 @@ def grade_manage():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
 
-    # 获取教师所教的课程
-    courses = Course.query.filter_by(teacher_id=current_user.id).all()
-
-    # 为每个课程添加统计信息
-    for course in courses:
-        # 获取选课学生数量
-        course.enrollment_count = SelectedCourse.query.filter_by(course_id=course.id).count()
-
-        # 检查是否有保存的成绩
-        grades = Grade.query.filter_by(course_id=course.id).all()
-        course.grades_saved = len(grades) > 0
+    # 教师所教课程及其选课人数、成绩录入情况（一次查询）
+    courses = get_course_grade_summaries(current_user.id)
 
     return render_template('teacher/grade_manage.html', courses=courses)
 
@@ -340,7 +340,9 @@ def course_grades(course_id):
     return render_template('teacher/course_grades.html',
                            course=course,
                            students=selected_students,
-                           grade_dict=grade_dict)
+                           grade_dict=grade_dict,
+                           scale=scale_for(course),
+                           scales=SCALES.values())
 
 
 @teacher_bp.route('/grades/update/<int:course_id>', methods=['POST'])
@@ -360,57 +362,29 @@ def update_grades(course_id):
         data = request.get_json()
         student_id = data.get('student_id')
         score = data.get('score')
-        exam_type = data.get('exam_type', '期末')
+        exam_type = data.get('exam_type') or DEFAULT_EXAM_TYPE
         exam_date = data.get('exam_date')
         comments = data.get('comments', '')
 
         if not student_id or score is None:
             return jsonify({'success': False, 'message': '缺少必要参数'})
 
-        # 验证学生是否选了这门课
-        selected_course = SelectedCourse.query.filter_by(
-            student_id=student_id, course_id=course_id
-        ).first()
-
-        if not selected_course:
-            return jsonify({'success': False, 'message': '学生未选此课程'})
-
-        # 查找或创建成绩记录
-        grade = Grade.query.filter_by(
-            student_id=student_id, course_id=course_id
-        ).first()
-
-        if not grade:
-            grade = Grade(
-                student_id=student_id,
-                course_id=course_id,
-                teacher_id=current_user.id,
-                academic_year='2024-2025',  # 可根据需要动态获取
-                semester='秋季'
-            )
-
-        # 更新成绩信息
-        grade.score = float(score) if score else None
-        if grade.score is not None:
-            grade.grade_point = grade.calculate_grade_point()
-            grade.grade_level = grade.calculate_grade_level()
-
-        grade.exam_type = exam_type
-        grade.comments = comments
-
-        if exam_date:
-            grade.exam_date = datetime.strptime(exam_date, '%Y-%m-%d').date()
-
-        if not grade.id:
-            db.session.add(grade)
-
-        db.session.commit()
+        result = upsert_grades(
+            course_id, current_user.id,
+            [{'student_id': student_id, 'score': score, 'exam_date': exam_date, 'comments': comments}],
+            exam_type=exam_type,
+            defaults={'academic_year': '2024-2025', 'semester': '秋季'},  # 可根据需要动态获取
+            scale=scale_for(course)
+        )
+        if result.errors:
+            return jsonify({'success': False, 'message': result.errors[0][1]})
 
+        grade = result.grades[int(student_id)]
         return jsonify({
             'success': True,
             'message': '成绩更新成功',
-            'grade_point': grade.grade_point,
-            'grade_level': grade.grade_level
+            'grade_point': grade['grade_point'],
+            'grade_level': grade['grade_level']
         })
 
     except Exception as e:
@@ -433,47 +407,18 @@ def batch_update_grades(course_id):
     try:
         data = request.get_json()
         grades_data = data.get('grades', [])
-        exam_type = data.get('exam_type', '期末')
+        exam_type = data.get('exam_type') or DEFAULT_EXAM_TYPE
         exam_date = data.get('exam_date')
 
-        success_count = 0
-        error_count = 0
-
-        for grade_data in grades_data:
-            student_id = grade_data.get('student_id')
-            score = grade_data.get('score')
-
-            if student_id and score is not None:
-                # 查找或创建成绩记录
-                grade = Grade.query.filter_by(
-                    student_id=student_id, course_id=course_id
-                ).first()
-
-                if not grade:
-                    grade = Grade(
-                        student_id=student_id,
-                        course_id=course_id,
-                        teacher_id=current_user.id,
-                        academic_year='2024-2025',
-                        semester='秋季'
-                    )
-
-                grade.score = float(score)
-                grade.grade_point = grade.calculate_grade_point()
-                grade.grade_level = grade.calculate_grade_level()
-                grade.exam_type = exam_type
-
-                if exam_date:
-                    grade.exam_date = datetime.strptime(exam_date, '%Y-%m-%d').date()
-
-                if not grade.id:
-                    db.session.add(grade)
-
-                success_count += 1
-            else:
-                error_count += 1
-
-        db.session.commit()
+        result = upsert_grades(
+            course_id, current_user.id, grades_data,
+            exam_type=exam_type,
+            exam_date=datetime.strptime(exam_date, '%Y-%m-%d').date() if exam_date else None,
+            defaults={'academic_year': '2024-2025', 'semester': '秋季'},
+            scale=scale_for(course)
+        )
+        success_count = result.success_count
+        error_count = result.error_count
 
         return jsonify({
             'success': True,
@@ -488,7 +433,7 @@ def batch_update_grades(course_id):
 @teacher_bp.route('/grades/export/<int:course_id>')
 @login_required
 def export_grades(course_id):
-    """导出成绩为Excel"""
+    """导出成绩为Excel（?format=csv 导出CSV）"""
     if not current_user.is_teacher():
         flash('无权访问此页面', 'danger')
         return redirect(url_for('auth.login'))
@@ -499,60 +444,25 @@ def export_grades(course_id):
         flash('无权管理此课程', 'danger')
         return redirect(url_for('teacher.grade_manage'))
 
+    filename = f'{course.course_name}_成绩表_{datetime.now().strftime("%Y%m%d")}'
+
+    if request.args.get('format') == 'csv':
+        response = Response(stream_with_context(stream_csv([course_id])), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename + '.csv')}"
+        return response
+
     try:
-        import pandas as pd
-        from io import BytesIO
-
-        # 获取课程成绩数据
-        grades = Grade.query.filter_by(course_id=course_id).all()
-
-        # 创建DataFrame
-        data = []
-        for grade in grades:
-            data.append({
-                '学号': grade.student.username,
-                '姓名': grade.student.real_name,
-                '班级': grade.student.class_info.class_name if grade.student.class_info else '',
-                '成绩': grade.score,
-                '绩点': grade.grade_point,
-                '等级': grade.grade_level,
-                '考试类型': grade.exam_type,
-                '考试日期': grade.exam_date.strftime('%Y-%m-%d') if grade.exam_date else '',
-                '评语': grade.comments or ''
-            })
-
-        df = pd.DataFrame(data)
-
-        # 创建Excel文件
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name=f'{course.course_name}成绩', index=False)
-
-            # 调整列宽
-            worksheet = writer.sheets[f'{course.course_name}成绩']
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-
-        output.seek(0)
+        output = write_xlsx([course_id], f'{course.course_name}成绩', tempfile.TemporaryFile())
 
         return send_file(
             output,
             as_attachment=True,
-            download_name=f'{course.course_name}_成绩表_{datetime.now().strftime("%Y%m%d")}.xlsx',
+            download_name=f'{filename}.xlsx',
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         )
 
     except ImportError:
-        flash('请安装 pandas 和 openpyxl 库以支持Excel导出', 'warning')
+        flash('请安装 openpyxl 库以支持Excel导出，或选择导出CSV', 'warning')
         return redirect(url_for('teacher.course_grades', course_id=course_id))
     except Exception as e:
         flash(f'导出失败: {str(e)}', 'danger')
@@ -562,101 +472,45 @@ def export_grades(course_id):
 @teacher_bp.route('/grades/import/<int:course_id>', methods=['POST'])
 @login_required
 def import_grades(course_id):
-    """从Excel导入成绩"""
+    """从Excel/CSV导入成绩：登记后台导入任务，返回任务进度查询地址"""
     if not current_user.is_teacher():
-        flash('无权访问此页面', 'danger')
-        return redirect(url_for('auth.login'))
+        return jsonify({'success': False, 'message': '无权操作'}), 403
 
     course = Course.query.get_or_404(course_id)
 
     if course.teacher_id != current_user.id:
-        flash('无权管理此课程', 'danger')
-        return redirect(url_for('teacher.grade_manage'))
+        return jsonify({'success': False, 'message': '无权管理此课程'}), 403
 
-    if 'file' not in request.files:
-        flash('请选择文件', 'danger')
-        return redirect(url_for('teacher.course_grades', course_id=course_id))
-
-    file = request.files['file']
-    if file.filename == '':
-        flash('请选择文件', 'danger')
-        return redirect(url_for('teacher.course_grades', course_id=course_id))
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'success': False, 'message': '请选择文件'}), 400
 
     try:
-        import pandas as pd
-
-        # 读取Excel文件
-        df = pd.read_excel(file)
-
-        # 验证必要的列
-        required_columns = ['学号', '成绩']
-        if not all(col in df.columns for col in required_columns):
-            flash('Excel文件必须包含"学号"和"成绩"列', 'danger')
-            return redirect(url_for('teacher.course_grades', course_id=course_id))
-
-        success_count = 0
-        error_count = 0
-
-        for _, row in df.iterrows():
-            try:
-                student_username = str(row['学号']).strip()
-                score = row['成绩']
-
-                if pd.isna(score) or pd.isna(student_username):
-                    error_count += 1
-                    continue
-
-                # 查找学生
-                student = User.query.filter_by(username=student_username).first()
-                if not student:
-                    error_count += 1
-                    continue
-
-                # 检查学生是否选了这门课
-                selected_course = SelectedCourse.query.filter_by(
-                    student_id=student.id, course_id=course_id
-                ).first()
-
-                if not selected_course:
-                    error_count += 1
-                    continue
-
-                # 更新或创建成绩记录
-                grade = Grade.query.filter_by(
-                    student_id=student.id, course_id=course_id
-                ).first()
-
-                if not grade:
-                    grade = Grade(
-                        student_id=student.id,
-                        course_id=course_id,
-                        teacher_id=current_user.id,
-                        academic_year='2024-2025',
-                        semester='秋季'
-                    )
-
-                grade.score = float(score)
-                grade.grade_point = grade.calculate_grade_point()
-                grade.grade_level = grade.calculate_grade_level()
-                grade.exam_type = '期末'  # 默认值
-
-                if not grade.id:
-                    db.session.add(grade)
-
-                success_count += 1
-
-            except Exception as e:
-                error_count += 1
-                continue
+        job = get_grade_importer(current_app._get_current_object()).submit(
+            course_id, current_user.id, request.files['file'],
+            defaults={'academic_year': '2024-2025', 'semester': '秋季'},
+            scale=scale_for(course)
+        )
+    except ImportFormatError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
 
-        db.session.commit()
-        flash(f'导入完成：成功 {success_count} 条，失败 {error_count} 条', 'success')
+    data = job.to_dict()
+    data['success'] = True
+    data['status_url'] = url_for('teacher.import_grades_status', course_id=course_id, job_id=job.id)
+    return jsonify(data), 202
 
-    except Exception as e:
-        db.session.rollback()
-        flash(f'导入失败: {str(e)}', 'danger')
 
-    return redirect(url_for('teacher.course_grades', course_id=course_id))
+@teacher_bp.route('/grades/import/<int:course_id>/<job_id>/status')
+@login_required
+def import_grades_status(course_id, job_id):
+    """查询成绩导入任务进度"""
+    if not current_user.is_teacher():
+        return jsonify({'error': '无权访问'}), 403
+
+    job = get_grade_importer(current_app._get_current_object()).get(job_id)
+    if job is None or job.teacher_id != current_user.id or job.course_id != course_id:
+        return jsonify({'error': '导入任务不存在或已过期'}), 404
+
+    return jsonify(job.to_dict())
 
 
 @teacher_bp.route('/grades/statistics/<int:course_id>')
@@ -671,33 +525,44 @@ def grade_statistics(course_id):
     if course.teacher_id != current_user.id:
         return jsonify({'error': '无权管理此课程'})
 
-    # 获取成绩数据
-    grades = Grade.query.filter_by(course_id=course_id).all()
+    # 读取增量维护的统计摘要
+    stats = get_course_stats(course_id)
 
-    if not grades:
+    if not stats.count:
         return jsonify({'error': '暂无成绩数据'})
 
-    scores = [grade.score for grade in grades if grade.score is not None]
-
-    statistics = {
-        'total_students': len(grades),
-        'average_score': round(sum(scores) / len(scores), 2),
-        'max_score': max(scores),
-        'min_score': min(scores),
-        'pass_count': len([s for s in scores if s >= 60]),
-        'fail_count': len([s for s in scores if s < 60]),
-        'score_distribution': {
-            '90-100': len([s for s in scores if s >= 90]),
-            '80-89': len([s for s in scores if 80 <= s < 90]),
-            '70-79': len([s for s in scores if 70 <= s < 80]),
-            '60-69': len([s for s in scores if 60 <= s < 70]),
-            '0-59': len([s for s in scores if s < 60])
-        }
-    }
+    statistics = stats.to_dict(scale_for(course))
 
     return jsonify(statistics)
 
 
+@teacher_bp.route('/grades/<int:course_id>/scale', methods=['POST'])
+@login_required
+def change_grading_scale(course_id):
+    """切换课程评分标准并重算已有成绩的绩点和等级"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': '无权操作'})
+
+    course = Course.query.get_or_404(course_id)
+
+    if course.teacher_id != current_user.id:
+        return jsonify({'success': False, 'message': '无权管理此课程'})
+
+    name = (request.get_json() or {}).get('scale')
+    if name not in SCALES:
+        return jsonify({'success': False, 'message': '未知的评分标准'})
+
+    try:
+        course.grading_scale = name
+        count = regrade_course(course_id, get_scale(name))
+        db.session.commit()
+        return jsonify({'success': True, 'message': f'已切换为{get_scale(name).label}，重算 {count} 条成绩'})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'切换失败: {str(e)}'})
+
+
 # 在 teacher.py 中添加一个新的路由用于选择课程发布公告
 
 @teacher_bp.route('/announcement/select-course')
@@ -727,46 +592,23 @@ def save_grades(course_id):
         # 获取提交的成绩数据
         grades_data = request.get_json()
 
-        # 保存成绩的逻辑（这里需要根据您的具体实现来写）
-        for grade_info in grades_data:
-            student_id = grade_info.get('student_id')
-            score = grade_info.get('score')
-
-            # 查找或创建成绩记录
-            grade = Grade.query.filter_by(
-                student_id=student_id,
-                course_id=course_id
-            ).first()
-
-            if grade:
-                # 更新现有成绩
-                grade.score = score
-                grade.grade_point = grade.calculate_grade_point()
-                grade.grade_level = grade.calculate_grade_level()
-                grade.updated_at = datetime.utcnow()
-            else:
-                # 创建新成绩记录
-                grade = Grade(
-                    student_id=student_id,
-                    course_id=course_id,
-                    teacher_id=current_user.id,
-                    score=score,
-                    grade_point=Grade.calculate_grade_point(score),
-                    grade_level=Grade.calculate_grade_level(score),
-                    exam_type='期末',
-                    exam_date=date.today(),
-                    academic_year='2024-2025',  # 根据实际情况设置
-                    semester='春季'  # 根据实际情况设置
-                )
-                db.session.add(grade)
+        result = upsert_grades(
+            course_id, current_user.id, grades_data,
+            defaults={'exam_date': date.today(), 'academic_year': '2024-2025', 'semester': '春季'},  # 根据实际情况设置
+            scale=scale_for(course)
+        )
 
         # 标记课程成绩已保存
         course.grades_saved = True
         db.session.commit()
 
+        message = '成绩保存成功'
+        if result.errors:
+            line, reason = result.errors[0]
+            message += f'（{result.error_count} 条未保存，如第 {line} 条: {reason}）'
         return jsonify({
             'success': True,
-            'message': '成绩保存成功'
+            'message': message
         })
 
     except Exception as e:
@@ -814,14 +656,14 @@ def submit_grades(course_id):
             return jsonify({'success': False, 'message': '无权限操作此课程'})
 
         # 检查成绩是否已保存
-        grades = Grade.query.filter_by(course_id=course_id).all()
-        if not grades:
+        stats = get_course_stats(course_id)
+        if not stats.count:
             return jsonify({'success': False, 'message': '请先保存成绩再提交'})
 
         # 创建成绩公告 - 使用正确的字段名
         announcement = Announcement(
             title=f"{course.course_name} ({course.course_code}) 成绩发布",
-            content=generate_grade_announcement_content(course, grades),
+            content=generate_grade_announcement_content(course, stats),
             teacher_id=current_user.id,  # 使用 teacher_id 而不是 author_id
             course_id=course_id,
             is_pinned=True,  # 成绩公告置顶
@@ -834,6 +676,9 @@ def submit_grades(course_id):
         course.grades_submitted = True
         course.grades_submitted_at = datetime.utcnow()
 
+        # 成绩正式发布，按成绩表校正该课程学生的成绩单
+        refresh_course_transcripts([course_id])
+
         db.session.commit()
 
         return jsonify({'success': True, 'message': '成绩提交成功'})
@@ -843,22 +688,14 @@ def submit_grades(course_id):
         return jsonify({'success': False, 'message': f'提交失败: {str(e)}'})
 
 
-def generate_grade_announcement_content(course, grades):
+def generate_grade_announcement_content(course, stats):
     """生成成绩公告内容 - 创建时生成完整静态HTML"""
-    # 统计成绩信息
-    total_students = len(grades)
-    scores = [g.score for g in grades if g.score is not None]
-
-    if scores:
-        passed_students = len([s for s in scores if s >= 60])
-        failed_students = total_students - passed_students
-        average_score = sum(scores) / len(scores)
-        pass_rate = (passed_students / total_students * 100) if total_students > 0 else 0
-    else:
-        passed_students = 0
-        failed_students = 0
-        average_score = 0
-        pass_rate = 0
+    # 统计成绩信息（来自课程成绩统计摘要）
+    total_students = stats.count
+    passed_students = stats.pass_count
+    failed_students = total_students - passed_students
+    average_score = stats.mean or 0
+    pass_rate = (passed_students / total_students * 100) if total_students > 0 else 0
 
     # 生成完整的静态HTML内容
     content = f"""
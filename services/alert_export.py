@@ -0,0 +1,44 @@
+# services/alert_export.py
+"""预警名单流式导出：一次联表查询分批读取（yield_per），按预警合并挂科课程后逐行写出 CSV/XLSX"""
+from itertools import groupby
+from models import db, User, Class, Course, AcademicAlert, alert_failed_courses
+from services.export import csv_chunks, write_xlsx_table
+
+ALERT_EXPORT_COLUMNS = ['学号', '姓名', '班级', '预警等级', '挂科数量', '挂科科目', '预警原因', '学期']
+EXPORT_BATCH_SIZE = 1000  # 每批读取/写出的行数
+
+
+def export_query(filters):
+    """预警导出查询：学生、班级和挂科课程在同一条 SQL 中联表，每门挂科课程一行，同一预警的行相邻"""
+    return db.session.query(
+        AcademicAlert.id, User.username, User.real_name, Class.class_name, AcademicAlert.alert_level,
+        AcademicAlert.total_failed, AcademicAlert.reason, AcademicAlert.semester, Course.course_name
+    ).join(User, User.id == AcademicAlert.student_id).outerjoin(
+        Class, Class.id == User.class_id
+    ).outerjoin(
+        alert_failed_courses, alert_failed_courses.c.alert_id == AcademicAlert.id
+    ).outerjoin(
+        Course, Course.id == alert_failed_courses.c.course_id
+    ).filter(*filters.conditions()).order_by(
+        AcademicAlert.alert_level, AcademicAlert.created_at, AcademicAlert.id, Course.course_code
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def iter_rows(filters):
+    """逐行生成导出数据（与 ALERT_EXPORT_COLUMNS 对应），同一预警的挂科课程以顿号连接"""
+    for _, rows in groupby(export_query(filters), key=lambda row: row.id):
+        rows = list(rows)
+        first = rows[0]
+        course_names = '、'.join(row.course_name for row in rows if row.course_name)
+        yield (first.username, first.real_name, first.class_name or '', first.alert_level, first.total_failed,
+               course_names, first.reason or '', first.semester)
+
+
+def stream_csv(filters, bom=True):
+    """按批生成 CSV 文本，bom 为真时带 UTF-8 BOM 供 Excel 直接打开"""
+    return csv_chunks(ALERT_EXPORT_COLUMNS, iter_rows(filters), bom=bom, batch_size=EXPORT_BATCH_SIZE)
+
+
+def write_xlsx(filters, title, fileobj):
+    """以 openpyxl 只写模式写出 XLSX（两遍流式扫描：先算列宽再写入）"""
+    return write_xlsx_table(ALERT_EXPORT_COLUMNS, lambda: iter_rows(filters), title, fileobj)
@@ -0,0 +1,120 @@
+# services/alert_list.py
+"""辅导员预警列表：按 (created_at, id) 倒序的游标分页，总数按筛选条件缓存
+
+- 每页只取 limit + 1 行判断是否还有下一页，翻页条件为 (created_at, id) < 游标，沿索引顺序读取；
+- 学生、班级和挂科课程随分页查询批量加载；
+- 总数为同一筛选条件上的 COUNT，预警变更提交后按辅导员失效。
+"""
+import base64
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, User, Course, AcademicAlert, alert_failed_courses
+from services.cache import TTLCache, column_values, invalidate_on_commit
+
+ALERT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 键为 AlertFilters
+alert_count_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+class AlertFilters(NamedTuple):
+    """预警列表筛选条件"""
+    counselor_id: int
+    alert_level: str = ''
+    class_id: str = ''
+    status: str = ''
+    course_name: str = ''
+
+    @classmethod
+    def from_args(cls, counselor_id, args, default_status=''):
+        return cls(
+            counselor_id=counselor_id,
+            alert_level=args.get('alert_level', ''),
+            class_id=args.get('class_id', ''),
+            status=args.get('status', default_status),
+            course_name=args.get('course', '').strip()
+        )
+
+    def conditions(self):
+        conditions = [AcademicAlert.counselor_id == self.counselor_id]
+        if self.alert_level:
+            conditions.append(AcademicAlert.alert_level == self.alert_level)
+        if self.status:
+            conditions.append(AcademicAlert.status == self.status)
+        if self.class_id:
+            conditions.append(AcademicAlert.student_id.in_(
+                db.session.query(User.id).filter(User.class_id == self.class_id)))
+        if self.course_name:
+            # 课程名经索引查出预警，不做字符串匹配
+            conditions.append(AcademicAlert.id.in_(
+                db.session.query(alert_failed_courses.c.alert_id).join(
+                    Course, Course.id == alert_failed_courses.c.course_id
+                ).filter(Course.course_name == self.course_name)))
+        return conditions
+
+    def to_args(self):
+        """用于生成链接的查询参数"""
+        return {'alert_level': self.alert_level, 'class_id': self.class_id, 'status': self.status,
+                'course': self.course_name}
+
+
+def alert_query(filters):
+    """按筛选条件查询预警，学生、班级和挂科课程一并加载"""
+    return AcademicAlert.query.options(
+        selectinload(AcademicAlert.courses),
+        joinedload(AcademicAlert.student).joinedload(User.class_info)
+    ).filter(*filters.conditions())
+
+
+def encode_cursor(alert):
+    raw = f'{alert.created_at.isoformat()}|{alert.id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        created_at, alert_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(alert_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('无效的分页游标') from e
+
+
+class AlertPage(NamedTuple):
+    alerts: list
+    next_cursor: str
+
+
+def get_alert_page(filters, cursor=None, limit=ALERT_PAGE_SIZE):
+    """取一页预警（新的在前），cursor 为上一页返回的 next_cursor"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = alert_query(filters)
+    if cursor:
+        created_at, alert_id = decode_cursor(cursor)
+        query = query.filter(tuple_(AcademicAlert.created_at, AcademicAlert.id) < tuple_(created_at, alert_id))
+    alerts = query.order_by(AcademicAlert.created_at.desc(), AcademicAlert.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(alerts[limit - 1]) if len(alerts) > limit else None
+    return AlertPage(alerts[:limit], next_cursor)
+
+
+def count_alerts(filters):
+    """符合筛选条件的预警总数（按筛选条件缓存）"""
+    return alert_count_cache.get_or_create(filters, lambda: db.session.query(
+        db.func.count(AcademicAlert.id)).filter(*filters.conditions()).scalar())
+
+
+def invalidate_alert_counts(counselor_ids=None):
+    """清除指定辅导员（默认全部）的预警总数缓存"""
+    if counselor_ids is None:
+        alert_count_cache.clear()
+        return
+    counselor_ids = set(counselor_ids)
+    alert_count_cache.invalidate(lambda filters: filters.counselor_id in counselor_ids)
+
+
+# 预警行经 ORM 变更提交后，失效新旧辅导员的总数缓存（批量写入由调用方显式失效）
+invalidate_on_commit(AcademicAlert, lambda alert: column_values(alert, 'counselor_id'), invalidate_alert_counts)
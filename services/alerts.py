@@ -0,0 +1,300 @@
+# services/alerts.py
+"""学业预警生成：按规则扫描学生各学期成绩单，批量新增/更新 AcademicAlert
+
+- 学期不及格门数、绩点取自学生成绩单（services/transcripts.py），挂科课程名一次联表查询取出；
+- 规则阈值取自配置（ALERT_*），同一学生同一学期只保留一条预警，已有预警原地更新；
+- 挂科课程写入 alert_failed_courses 关联表，按课程筛选和导出时走索引联表；
+- 扫描到的学生中不再触发的有效预警（如成绩更正后）标记为已处理；
+- 增量运行只扫描上次运行之后成绩单有变化的学生，每次运行记录各阶段耗时（AlertRun）。
+"""
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from models import db, User, Class, Course, Grade, StudentTranscript, AcademicAlert, AlertRun, \
+    alert_failed_courses
+from services.alert_list import invalidate_alert_counts
+from services.grade_stats import PASS_SCORE
+from services.transcripts import TRANSCRIPT_EXAM_TYPE, UNKNOWN_TERM
+
+ALERT_LEVELS = ['一级', '二级', '三级']  # 由重到轻
+TERM_NUMBERS = {'秋季': 1, '春季': 2, '夏季': 3}  # 学年内的学期序号
+
+
+def term_label(academic_year, semester):
+    """预警使用的学期标识，如 2023-2024 秋季 -> 2023-2024-1"""
+    number = TERM_NUMBERS.get(semester)
+    return f'{academic_year}-{number}' if number else f'{academic_year} {semester}'.strip()
+
+
+def _term_key(academic_year, semester):
+    return academic_year, TERM_NUMBERS.get(semester, len(TERM_NUMBERS) + 1), semester
+
+
+class AlertRules:
+    """预警规则阈值"""
+
+    def __init__(self, failed_levels=((4, '一级'), (3, '二级'), (2, '三级')), consecutive_terms=2,
+                 consecutive_min_failed=2, gpa_floor=1.0):
+        self.failed_levels = sorted(failed_levels, reverse=True)
+        self.consecutive_terms = consecutive_terms
+        self.consecutive_min_failed = consecutive_min_failed
+        self.gpa_floor = gpa_floor
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            failed_levels=config.get('ALERT_FAILED_LEVELS', ((4, '一级'), (3, '二级'), (2, '三级'))),
+            consecutive_terms=config.get('ALERT_CONSECUTIVE_TERMS', 2),
+            consecutive_min_failed=config.get('ALERT_CONSECUTIVE_MIN_FAILED', 2),
+            gpa_floor=config.get('ALERT_GPA_FLOOR', 1.0)
+        )
+
+    def evaluate(self, terms):
+        """terms 为按时间排列的 [(学期标识, 不及格门数, 学期绩点)]，返回 {学期标识: (预警等级, 原因)}"""
+        results = {}
+        streak = 0
+        for label, failed, gpa in terms:
+            streak = streak + 1 if failed >= self.consecutive_min_failed else 0
+            triggered = []
+            for threshold, level in self.failed_levels:
+                if failed >= threshold:
+                    triggered.append((level, f'本学期挂科{failed}门'))
+                    break
+            if streak >= self.consecutive_terms:
+                triggered.append(('一级', f'连续{streak}学期挂科≥{self.consecutive_min_failed}门'))
+            if gpa is not None and gpa < self.gpa_floor:
+                triggered.append(('三级', f'学期绩点{gpa:.2f}低于{self.gpa_floor}'))
+            if triggered:
+                level = min((level for level, _ in triggered), key=ALERT_LEVELS.index)
+                results[label] = (level, '；'.join(reason for _, reason in triggered))
+        return results
+
+
+class _Stages:
+    """记录各阶段耗时（毫秒）"""
+
+    def __init__(self):
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def done(self, name):
+        now = time.perf_counter()
+        self.timings[name] = round((now - self._last) * 1000, 1)
+        self._last = now
+
+
+def _last_run_started(counselor_id):
+    """上次完成的、覆盖该范围的运行的开始时间（全校运行覆盖所有辅导员）"""
+    query = db.session.query(AlertRun.started_at).filter(AlertRun.finished_at.isnot(None))
+    if counselor_id is None:
+        query = query.filter(AlertRun.counselor_id.is_(None))
+    else:
+        query = query.filter(db.or_(AlertRun.counselor_id == counselor_id, AlertRun.counselor_id.is_(None)))
+    return query.order_by(AlertRun.started_at.desc()).limit(1).scalar()
+
+
+def run_alert_engine(counselor_id=None, incremental=True, rules=None):
+    """生成学业预警，counselor_id 为空时处理全校学生；返回本次运行记录 AlertRun
+
+    incremental 为真且有上次运行记录时，只处理此后成绩单有变化的学生。rules 默认取应用配置。
+    """
+    rules = rules or AlertRules.from_config(current_app.config)
+    stages = _Stages()
+    since = _last_run_started(counselor_id) if incremental else None
+    run = AlertRun(counselor_id=counselor_id, incremental=since is not None, started_at=datetime.utcnow())
+
+    scope = [Class.counselor_id.isnot(None), User.role == 'student']
+    if counselor_id is not None:
+        scope.append(Class.counselor_id == counselor_id)
+    if since is not None:
+        changed = db.select(StudentTranscript.student_id).where(
+            StudentTranscript.academic_year == '', StudentTranscript.semester == '',
+            StudentTranscript.updated_at >= since
+        )
+        scope.append(User.id.in_(changed))
+
+    # 1. 各学生各学期的不及格门数和绩点（读取成绩单，一次查询）
+    terms = defaultdict(list)
+    counselors = {}
+    rows = db.session.query(
+        StudentTranscript.student_id, StudentTranscript.academic_year, StudentTranscript.semester,
+        StudentTranscript.failed_count, StudentTranscript.gpa, Class.counselor_id
+    ).join(User, User.id == StudentTranscript.student_id).join(Class, Class.id == User.class_id).filter(
+        StudentTranscript.academic_year != '', StudentTranscript.academic_year != UNKNOWN_TERM, *scope
+    )
+    for student_id, academic_year, semester, failed, gpa, student_counselor in rows:
+        terms[student_id].append((_term_key(academic_year, semester), term_label(academic_year, semester),
+                                  failed, gpa))
+        counselors[student_id] = student_counselor
+    stages.done('读取学期成绩单')
+
+    # 2. 规则判定
+    triggered = {}
+    for student_id, student_terms in terms.items():
+        student_terms.sort()
+        for label, (level, reason) in rules.evaluate([term[1:] for term in student_terms]).items():
+            triggered[(student_id, label)] = (level, reason)
+    stages.done('规则判定')
+
+    # 3. 范围内学生的已有预警及其挂科课程关联；不再触发的有效预警本次标记为已处理
+    existing, linked = {}, defaultdict(set)
+    for alert in db.session.query(
+        AcademicAlert.id, AcademicAlert.student_id, AcademicAlert.semester, AcademicAlert.counselor_id,
+        AcademicAlert.alert_level, AcademicAlert.total_failed, AcademicAlert.reason, AcademicAlert.status
+    ).join(User, User.id == AcademicAlert.student_id).join(Class, Class.id == User.class_id).filter(*scope):
+        existing[(alert.student_id, alert.semester)] = alert
+    if existing:
+        for alert_id, course_id in db.session.query(
+            alert_failed_courses.c.alert_id, alert_failed_courses.c.course_id
+        ).join(AcademicAlert, AcademicAlert.id == alert_failed_courses.c.alert_id).join(
+            User, User.id == AcademicAlert.student_id
+        ).join(Class, Class.id == User.class_id).filter(*scope):
+            linked[alert_id].add(course_id)
+    cleared = [key for key, alert in existing.items() if alert.status == 'active' and key not in triggered]
+    stages.done('读取已有预警')
+
+    # 4. 触发预警和待解除预警的学生学期的挂科课程（一次联表查询）
+    failed_courses = defaultdict(list)
+    wanted = set(triggered).union(cleared)
+    if wanted:
+        academic_year = db.func.coalesce(db.func.nullif(Grade.academic_year, ''), UNKNOWN_TERM)
+        semester = db.func.coalesce(Grade.semester, '')
+        rows = db.session.query(Grade.student_id, academic_year, semester, Course.id, Course.course_name).join(
+            Course, Course.id == Grade.course_id
+        ).join(User, User.id == Grade.student_id).join(Class, Class.id == User.class_id).filter(
+            Grade.exam_type == TRANSCRIPT_EXAM_TYPE, Grade.score < PASS_SCORE, *scope
+        ).order_by(Grade.student_id, Course.course_code)
+        for student_id, year, term, course_id, course_name in rows:
+            key = (student_id, term_label(year, term))
+            if key in wanted:
+                failed_courses[key].append((course_id, course_name))
+    stages.done('读取挂科课程')
+
+    # 5. 与已有预警及其挂科课程关联对比后批量插入/更新
+    now = datetime.utcnow()
+    inserts, updates, relink = [], [], {}
+    for (student_id, label), (level, reason) in triggered.items():
+        courses = failed_courses.get((student_id, label), [])
+        course_ids = {course_id for course_id, _ in courses}
+        values = {
+            'counselor_id': counselors[student_id],
+            'alert_level': level,
+            'total_failed': len(courses),
+            'reason': reason
+        }
+        alert = existing.get((student_id, label))
+        if alert is None:
+            inserts.append((dict(values, student_id=student_id, semester=label, status='active', created_at=now,
+                                 updated_at=now, failed_courses=_course_names_json(courses)), course_ids))
+        elif course_ids != linked.get(alert.id, set()) or \
+                any(getattr(alert, name) != value for name, value in values.items()):
+            update = dict(values, id=alert.id, updated_at=now, failed_courses=_course_names_json(courses))
+            if len(courses) > alert.total_failed:
+                update['status'] = 'active'  # 挂科增加时重新激活已处理的预警
+            updates.append(update)
+            if course_ids != linked.get(alert.id, set()):
+                relink[alert.id] = course_ids
+
+    # 成绩更正后不再触发的预警：标记为已处理，挂科门数和课程更新为当前情况
+    for key in cleared:
+        alert = existing[key]
+        courses = failed_courses.get(key, [])
+        updates.append({'id': alert.id, 'status': 'resolved', 'total_failed': len(courses),
+                        'failed_courses': _course_names_json(courses), 'updated_at': now})
+        course_ids = {course_id for course_id, _ in courses}
+        if course_ids != linked.get(alert.id, set()):
+            relink[alert.id] = course_ids
+
+    if inserts:
+        rows = [values for values, _ in inserts]
+        db.session.bulk_insert_mappings(AcademicAlert, rows, return_defaults=True)
+        relink.update((values['id'], course_ids) for values, course_ids in inserts)
+    if updates:
+        db.session.bulk_update_mappings(AcademicAlert, updates)
+    if relink:
+        _replace_links(relink)
+    stages.done('写入预警')
+
+    run.students_scanned = len(terms)
+    run.alerts_created = len(inserts)
+    run.alerts_updated = len(updates) - len(cleared)
+    run.alerts_resolved = len(cleared)
+    run.finished_at = datetime.utcnow()
+    run.timings = json.dumps(stages.timings, ensure_ascii=False)
+    db.session.add(run)
+    db.session.commit()
+    # 批量写入不触发 ORM 事件，显式失效预警总数缓存
+    invalidate_alert_counts(None if counselor_id is None else [counselor_id])
+    return run
+
+
+def _course_names_json(courses):
+    return json.dumps([name for _, name in courses], ensure_ascii=False)
+
+
+def _replace_links(links, chunk_size=500):
+    """替换预警的挂科课程关联，links 为 {alert_id: {course_id, ...}}"""
+    alert_ids = list(links)
+    for start in range(0, len(alert_ids), chunk_size):
+        db.session.execute(alert_failed_courses.delete().where(
+            alert_failed_courses.c.alert_id.in_(alert_ids[start:start + chunk_size])))
+    rows = [{'alert_id': alert_id, 'course_id': course_id}
+            for alert_id, course_ids in links.items() for course_id in course_ids]
+    if rows:
+        db.session.execute(alert_failed_courses.insert(), rows)
+
+
+def link_failed_courses():
+    """为尚无课程关联的预警按旧的 JSON 课程名建立关联（升级数据库和初始化数据时调用）
+
+    同名课程有多门时优先取该学生有成绩的那门。返回 (关联的预警数, 未匹配到课程的名称列表)。
+    """
+    linked_ids = db.select(alert_failed_courses.c.alert_id)
+    alerts = db.session.query(AcademicAlert.id, AcademicAlert.student_id, AcademicAlert.failed_courses).filter(
+        AcademicAlert.id.notin_(linked_ids)).all()
+    if not alerts:
+        return 0, []
+
+    names = {alert.id: _parse_course_names(alert.failed_courses) for alert in alerts}
+    courses_by_name = defaultdict(list)
+    for course_id, course_name in db.session.query(Course.id, Course.course_name).filter(
+            Course.course_name.in_({name for values in names.values() for name in values})):
+        courses_by_name[course_name].append(course_id)
+    graded = set(db.session.query(Grade.student_id, Grade.course_id).join(
+        AcademicAlert, AcademicAlert.student_id == Grade.student_id).filter(
+        AcademicAlert.id.in_(list(names))).distinct().all())
+
+    links, missing = {}, set()
+    for alert in alerts:
+        course_ids = set()
+        for name in names[alert.id]:
+            candidates = courses_by_name.get(name)
+            if not candidates:
+                missing.add(name)
+                continue
+            course_ids.add(next((course_id for course_id in candidates
+                                 if (alert.student_id, course_id) in graded), candidates[0]))
+        if course_ids:
+            links[alert.id] = course_ids
+    _replace_links(links)
+    db.session.commit()
+    invalidate_alert_counts()
+    return len(links), sorted(missing)
+
+
+def _parse_course_names(value):
+    """旧数据中的挂科课程：JSON 数组或单个课程名"""
+    if not value:
+        return []
+    try:
+        names = json.loads(value)
+    except ValueError:
+        return [value]
+    return [str(name) for name in names] if isinstance(names, list) else [str(names)]
+
+
+def format_timings(run):
+    """运行记录中各阶段耗时的可读文本"""
+    return '，'.join(f'{name} {ms:.0f} ms' for name, ms in json.loads(run.timings or '{}').items())
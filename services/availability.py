@@ -0,0 +1,370 @@
+# services/availability.py
+"""教室占用索引：每间教室每天一个 96 位整数，第 i 位表示第 i 个 15 分钟时段已被占用
+
+占用来自三处：待审批和已批准的借用、当天星期对应的课表、当天的考试（考场），统一以 (类型, ID) 标识。
+借用、排考和排课的冲突检测都是对同一索引的一次查找。
+
+- 查询某时段空闲教室：时段掩码与各教室当天的位图做按位与，教室按容量排序，容量下限用二分定位，不访问数据库；
+- 借用时间不必对齐 15 分钟：位图按外扩取整，只在首尾不完整的时段上才回到区间列表精确比较；
+- 按日期懒加载（借用、课表、考试各一次查询，多天合并加载），与其他进程内缓存一样按 TTL 过期重新加载；
+- 借用经 ORM 提交（批准、取消、改期）后，按变更增量更新已加载的日期；课表、考试变更提交后整体重新加载；
+  批量更新由调用方调用 invalidate；
+- 空闲时段一览：每间教室当天的占用区间排序后一趟扫描合并得到空闲区间，按 (教学楼, 日期) 缓存在当天的占用情况上，
+  借用变更时随位图一起失效。
+"""
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, time, timedelta
+from typing import NamedTuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import db, Classroom, ClassroomBooking, Schedule, Exam, exam_classrooms
+from services.cache import TTLCache, invalidate_on_commit
+import services.rooms  # noqa: F401  课表、考试写入时按地点关联教室
+
+SLOT_SECONDS = 15 * 60
+SLOTS_PER_DAY = 24 * 3600 // SLOT_SECONDS
+HOLDING_STATUSES = ('pending', 'approved')  # 占用教室的借用状态（待审批的申请也占住时段）
+EXAM_DEFAULT_MINUTES = 120  # 未填写时长的考试按此计算占用
+SCHEDULE_CHECK_WEEKS = 20  # 排课冲突检测向后检查的周数（约一个学期）
+OCCUPANT_NAMES = {'booking': '教室借用', 'schedule': '课程', 'exam': '考试'}
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def slot_mask(first, last):
+    """第 first 到 last - 1 个时段的掩码"""
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def touched_mask(start_time, end_time):
+    """[start_time, end_time) 涉及到的全部时段（外扩取整）"""
+    return slot_mask(_seconds(start_time) // SLOT_SECONDS, -(-_seconds(end_time) // SLOT_SECONDS))
+
+
+def covered_mask(start_time, end_time):
+    """被 [start_time, end_time) 完整覆盖的时段（内缩取整）"""
+    return slot_mask(-(-_seconds(start_time) // SLOT_SECONDS), _seconds(end_time) // SLOT_SECONDS)
+
+
+def free_windows(intervals, open_seconds, close_seconds):
+    """扫描按开始时间排序的占用区间（秒），合并重叠部分，返回 [open_seconds, close_seconds) 内的空闲区间"""
+    windows, cursor = [], open_seconds
+    for start, end in intervals:
+        if start > cursor:
+            windows.append((cursor, min(start, close_seconds)))
+        cursor = max(cursor, end)
+        if cursor >= close_seconds:
+            break
+    if cursor < close_seconds:
+        windows.append((cursor, close_seconds))
+    return windows
+
+
+def format_seconds(seconds):
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}'
+
+
+def exam_period(exam_time, duration):
+    """考试占用的 (日期, 开始, 结束)，跨过午夜的部分截止到当天结束"""
+    end = exam_time + timedelta(minutes=duration or EXAM_DEFAULT_MINUTES)
+    end_time = end.time() if end.date() == exam_time.date() else time.max
+    return exam_time.date(), exam_time.time(), end_time
+
+
+def describe_occupants(occupants):
+    """冲突占用的说明文字，如“课程、考试”"""
+    return '、'.join(dict.fromkeys(OCCUPANT_NAMES[kind] for kind, _ in occupants))
+
+
+class RoomInfo(NamedTuple):
+    id: int
+    room_number: str
+    building: str
+    capacity: int
+    equipment: str
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class DayAvailability:
+    """某一天各教室的占用位图和占用区间，占用以 (类型, ID) 标识"""
+
+    def __init__(self, occupants=()):
+        self.masks = {}
+        self.intervals = {}  # classroom_id -> [(start_time, end_time, (类型, ID))]，按开始时间排序
+        self.rooms_of = {}  # (类型, ID) -> {classroom_id}
+        self.grids = {}  # (教学楼, 开始秒, 结束秒) -> {教室ID: 空闲区间}，占用变化时清空
+        for key, classroom_id, start_time, end_time in occupants:
+            self.intervals.setdefault(classroom_id, []).append((start_time, end_time, key))
+            self.rooms_of.setdefault(key, set()).add(classroom_id)
+        for classroom_id, intervals in self.intervals.items():
+            intervals.sort()
+            self._update_mask(classroom_id)
+
+    def _update_mask(self, classroom_id):
+        self.grids.clear()
+        mask = 0
+        for start_time, end_time, _ in self.intervals.get(classroom_id, ()):
+            mask |= touched_mask(start_time, end_time)
+        if mask:
+            self.masks[classroom_id] = mask
+        else:
+            self.masks.pop(classroom_id, None)
+            self.intervals.pop(classroom_id, None)
+
+    def remove(self, key):
+        for classroom_id in self.rooms_of.pop(key, ()):
+            self.intervals[classroom_id] = [interval for interval in self.intervals[classroom_id]
+                                            if interval[2] != key]
+            self._update_mask(classroom_id)
+
+    def add(self, classroom_id, key, start_time, end_time):
+        # 复制后插入再替换，不加锁的读取方始终看到完整的有序列表
+        intervals = list(self.intervals.get(classroom_id, ()))
+        insort(intervals, (start_time, end_time, key))
+        self.intervals[classroom_id] = intervals
+        self.rooms_of.setdefault(key, set()).add(classroom_id)
+        self._update_mask(classroom_id)
+
+    def occupants(self, classroom_id, start_time, end_time, ignore=()):
+        """与 [start_time, end_time) 重叠的占用，ignore 中的 (类型, ID) 不计（修改已有安排时排除自身）"""
+        if not self.masks.get(classroom_id, 0) & touched_mask(start_time, end_time):
+            return []
+        intervals = self.intervals.get(classroom_id, ())
+        # 有序列表中只需检查开始时间早于 end_time 的区间
+        return [key for booked_start, booked_end, key in intervals[:bisect_left(intervals, (end_time,))]
+                if booked_end > start_time and key not in ignore]
+
+    def is_free(self, classroom_id, start_time, end_time, query_mask, full_mask):
+        busy = self.masks.get(classroom_id, 0) & query_mask
+        if not busy:
+            return True
+        if busy & full_mask:
+            return False
+        # 只在首尾不完整的时段上有交集，按区间精确判断
+        return not any(booked_start < end_time and booked_end > start_time
+                       for booked_start, booked_end, _ in self.intervals.get(classroom_id, ()))
+
+    def free_windows(self, classroom_id, open_seconds, close_seconds):
+        """教室当天的空闲区间（秒）"""
+        return free_windows([(_seconds(start_time), _seconds(end_time))
+                             for start_time, end_time, _ in self.intervals.get(classroom_id, ())],
+                            open_seconds, close_seconds)
+
+
+class FreeGrid(NamedTuple):
+    """空闲时段一览：rooms 为符合条件的教室，days 为 [(日期, {教室ID: [(开始秒, 结束秒)]})]"""
+    rooms: list
+    days: list
+
+
+class AvailabilityIndex:
+    """教室空闲索引（进程内，线程安全）"""
+
+    def __init__(self, ttl=300, max_days=400):
+        self._days = TTLCache(maxsize=max_days, ttl=ttl)
+        self._rooms = TTLCache(maxsize=1, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def rooms(self):
+        """可借用教室，按容量从小到大排列，返回 (容量列表, RoomInfo 列表)"""
+        return self._rooms.get_or_create('rooms', self._load_rooms)
+
+    @staticmethod
+    def _load_rooms():
+        rows = db.session.query(
+            Classroom.id, Classroom.room_number, Classroom.building, Classroom.capacity, Classroom.equipment
+        ).filter(Classroom.status == 'available').order_by(Classroom.capacity, Classroom.id).all()
+        rooms = [RoomInfo(*row) for row in rows]
+        return [room.capacity for room in rooms], rooms
+
+    def days(self, dates):
+        """多天的占用情况，返回 {日期: DayAvailability}（未加载的日期合并加载，借用、课表、考试各一次查询）"""
+        found = {booking_date: self._days.get(booking_date) for booking_date in dates}
+        missing = [booking_date for booking_date, day in found.items() if day is None]
+        if missing:
+            for booking_date, occupants in self._load_occupants(missing).items():
+                found[booking_date] = DayAvailability(occupants)
+                self._days.set(booking_date, found[booking_date])
+        return found
+
+    @staticmethod
+    def _load_occupants(dates):
+        occupants = {booking_date: [] for booking_date in dates}
+
+        for booking_id, classroom_id, booking_date, start_time, end_time in db.session.query(
+            ClassroomBooking.id, ClassroomBooking.classroom_id, ClassroomBooking.booking_date,
+            ClassroomBooking.start_time, ClassroomBooking.end_time
+        ).filter(ClassroomBooking.booking_date.in_(dates), ClassroomBooking.status.in_(HOLDING_STATUSES)):
+            occupants[booking_date].append((('booking', booking_id), classroom_id, start_time, end_time))
+
+        # 课表每周重复，按星期分配到各日期
+        by_weekday = {}
+        for booking_date in dates:
+            by_weekday.setdefault(booking_date.isoweekday(), []).append(booking_date)
+        for schedule_id, classroom_id, day_of_week, start_time, end_time in db.session.query(
+            Schedule.id, Schedule.classroom_id, Schedule.day_of_week, Schedule.start_time, Schedule.end_time
+        ).filter(Schedule.classroom_id.isnot(None), Schedule.day_of_week.in_(list(by_weekday))):
+            for booking_date in by_weekday[day_of_week]:
+                occupants[booking_date].append((('schedule', schedule_id), classroom_id, start_time, end_time))
+
+        for exam_id, classroom_id, exam_time, duration in db.session.query(
+            Exam.id, exam_classrooms.c.classroom_id, Exam.exam_time, Exam.duration
+        ).join(exam_classrooms, exam_classrooms.c.exam_id == Exam.id).filter(db.or_(*[
+            db.and_(Exam.exam_time >= datetime.combine(booking_date, time.min),
+                    Exam.exam_time < datetime.combine(booking_date + timedelta(days=1), time.min))
+            for booking_date in dates
+        ])):
+            exam_date, start_time, end_time = exam_period(exam_time, duration)
+            occupants[exam_date].append((('exam', exam_id), classroom_id, start_time, end_time))
+        return occupants
+
+    def day(self, booking_date):
+        """某天的占用情况（未加载时一次查询加载）"""
+        return self.days([booking_date])[booking_date]
+
+    def free_classrooms(self, booking_date, start_time, end_time, min_capacity=0):
+        """某天 [start_time, end_time) 空闲且容量不小于 min_capacity 的教室，小教室在前"""
+        capacities, rooms = self.rooms()
+        day = self.day(booking_date)
+        query_mask, full_mask = touched_mask(start_time, end_time), covered_mask(start_time, end_time)
+        masks = day.masks
+        return [room for room in rooms[bisect_left(capacities, min_capacity or 0):]
+                if not masks.get(room.id, 0) & query_mask
+                or day.is_free(room.id, start_time, end_time, query_mask, full_mask)]
+
+    def is_free(self, classroom_id, booking_date, start_time, end_time):
+        """教室某天 [start_time, end_time) 是否没有课程、考试和借用"""
+        return self.day(booking_date).is_free(classroom_id, start_time, end_time,
+                                              touched_mask(start_time, end_time), covered_mask(start_time, end_time))
+
+    def conflicts(self, classroom_id, booking_date, start_time, end_time, ignore=()):
+        """教室某天与 [start_time, end_time) 重叠的占用 [(类型, ID)]"""
+        return self.day(booking_date).occupants(classroom_id, start_time, end_time, ignore)
+
+    def exam_conflicts(self, exam_time, duration, classroom_ids, exam_id=None):
+        """排考冲突：{教室ID: [(类型, ID)]}，只包含有冲突的教室"""
+        booking_date, start_time, end_time = exam_period(exam_time, duration)
+        day = self.day(booking_date)
+        ignore = {('exam', exam_id)}
+        result = {classroom_id: day.occupants(classroom_id, start_time, end_time, ignore)
+                  for classroom_id in classroom_ids}
+        return {classroom_id: occupants for classroom_id, occupants in result.items() if occupants}
+
+    def schedule_conflicts(self, classroom_id, day_of_week, start_time, end_time, schedule_id=None,
+                           weeks=SCHEDULE_CHECK_WEEKS, today=None):
+        """排课冲突：之后 weeks 周内该星期各日期的占用，返回 {日期: [(类型, ID)]}，只包含有冲突的日期"""
+        today = today or datetime.now().date()
+        first = today + timedelta(days=(day_of_week - today.isoweekday()) % 7)
+        dates = [first + timedelta(weeks=week) for week in range(weeks)]
+        ignore = {('schedule', schedule_id)}
+        result = {booking_date: day.occupants(classroom_id, start_time, end_time, ignore)
+                  for booking_date, day in self.days(dates).items()}
+        return {booking_date: occupants for booking_date, occupants in result.items() if occupants}
+
+    def free_grid(self, dates, opening_hours, building=None, min_capacity=0, min_duration=0):
+        """多天各教室的空闲区间（只保留不短于 min_duration 分钟的区间）"""
+        capacities, rooms = self.rooms()
+        rooms = [room for room in rooms[bisect_left(capacities, min_capacity or 0):]
+                 if not building or room.building == building]
+        buildings = sorted({room.building for room in rooms})
+        open_seconds, close_seconds = (_seconds(value) for value in opening_hours)
+        min_seconds = (min_duration or 0) * 60
+
+        result = []
+        for booking_date, day in self.days(dates).items():
+            windows = {}
+            for name in buildings:
+                key = (name, open_seconds, close_seconds)
+                grid = day.grids.get(key)
+                if grid is None:
+                    grid = day.grids[key] = {room.id: day.free_windows(room.id, open_seconds, close_seconds)
+                                             for room in self.rooms()[1] if room.building == name}
+                windows.update(grid)
+            result.append((booking_date, {
+                room.id: [window for window in windows.get(room.id, ()) if window[1] - window[0] >= min_seconds]
+                for room in rooms}))
+        return FreeGrid(rooms, result)
+
+    def apply(self, changes):
+        """按已提交的借用变更增量更新已加载的日期
+
+        changes 为 (booking_id, 教室, 日期, 开始, 结束, 是否占用)。借用可能改了教室或日期，
+        先从所有已加载的日期中移除，再按新的位置加入。
+        """
+        with self._lock:
+            days = self._days.values()
+            for booking_id, classroom_id, booking_date, start_time, end_time, active in changes:
+                key = ('booking', booking_id)
+                for day in days:
+                    day.remove(key)
+                day = self._days.get(booking_date) if active else None
+                if day is not None:
+                    day.add(classroom_id, key, start_time, end_time)
+
+    def invalidate(self, dates=None):
+        """丢弃指定日期（默认全部）的占用情况，下次查询时重新加载"""
+        if dates is None:
+            self._days.clear()
+        else:
+            dates = set(dates)
+            self._days.invalidate(lambda booking_date: booking_date in dates)
+
+    def invalidate_all(self, *args):
+        self.invalidate()
+
+    def invalidate_rooms(self, *args):
+        self._rooms.clear()
+        for day in self._days.values():
+            day.grids.clear()
+
+
+availability_index = AvailabilityIndex()
+
+
+# ORM 写入：flush 时记录借用的新位置和是否占用，提交后增量更新索引，回滚则丢弃
+
+def _collect_booking_change(target, deleted=False):
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault('availability_changes', []).append((
+        target.id, target.classroom_id, target.booking_date, target.start_time, target.end_time,
+        not deleted and target.status in HOLDING_STATUSES
+    ))
+
+
+@event.listens_for(ClassroomBooking, 'after_insert')
+@event.listens_for(ClassroomBooking, 'after_update')
+def _booking_written(mapper, connection, target):
+    _collect_booking_change(target)
+
+
+@event.listens_for(ClassroomBooking, 'after_delete')
+def _booking_deleted(mapper, connection, target):
+    _collect_booking_change(target, deleted=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_booking_changes(session):
+    changes = session.info.pop('availability_changes', None)
+    if changes:
+        availability_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_booking_changes(session):
+    session.info.pop('availability_changes', None)
+
+
+# 教室的容量、状态变化后重新加载教室列表
+invalidate_on_commit(Classroom, lambda room: {room.id}, availability_index.invalidate_rooms)
+
+
+# 课表、考试（含考场关联）变更提交后，所有已加载日期重新加载（排课、排考不频繁）
+invalidate_on_commit(Schedule, lambda schedule: {schedule.id}, availability_index.invalidate_all)
+invalidate_on_commit(Exam, lambda exam: {exam.id}, availability_index.invalidate_all)
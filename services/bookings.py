@@ -0,0 +1,347 @@
+# services/bookings.py
+"""教室借用引擎：冲突检查与写入在同一把 (教室, 日期) 锁和同一个写事务内完成，并发提交最多一个成功
+
+待审批和已批准的借用都占用时段（HOLDING_STATUSES），同一时段不会积累多个重叠的申请。
+
+- 先查进程内占用索引（课程、考试、借用），明显冲突的请求不进入写锁；
+- 同一 (教室, 日期) 的提交在进程内按分段锁串行，事务开始即获取数据库写锁
+  （SQLite 使用 BEGIN IMMEDIATE，其他数据库锁定教室行），锁内再按索引查一次借用表，
+  覆盖其他进程已提交、本进程索引尚未感知的借用；
+- 写锁等待超时（database is locked）时返回“系统繁忙，请稍后重试”，不会变成 500；
+- 提交后占用索引随 ORM 事件增量更新。
+
+重复借用（submit_series）按每周/每两周展开为各次日期，一次范围查询检查全部日期的借用冲突，
+无冲突的日期在同一事务内一次插入，返回逐次的结果。
+
+批量审批（resolve_pending）在一个写事务内处理日期范围内的全部待审批申请：按优先级排序后逐个
+贪心接受与课程、考试、已批准借用及本轮已接受申请都不重叠的申请，其余生成理由后拒绝。
+"""
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from models import db, Classroom, ClassroomBooking
+from services.availability import availability_index, describe_occupants, DayAvailability, HOLDING_STATUSES
+from services.transactions import begin_write, is_busy, BUSY_MESSAGE
+
+LOCK_STRIPES = 64  # 分段锁数量，(教室, 日期) 按哈希分配
+RECURRENCE_WEEKS = {'weekly': 1, 'biweekly': 2}  # 重复方式 -> 间隔周数
+
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def _stripe(classroom_id, booking_date):
+    return hash((int(classroom_id), booking_date)) % LOCK_STRIPES
+
+
+def room_day_lock(classroom_id, booking_date):
+    """(教室, 日期) 对应的进程内写锁"""
+    return _locks[_stripe(classroom_id, booking_date)]
+
+
+@contextmanager
+def room_days_lock(classroom_id, dates):
+    """同一教室多个日期的写锁，按固定顺序获取避免死锁"""
+    stripes = sorted({_stripe(classroom_id, booking_date) for booking_date in dates})
+    for stripe in stripes:
+        _locks[stripe].acquire()
+    try:
+        yield
+    finally:
+        for stripe in reversed(stripes):
+            _locks[stripe].release()
+
+
+def _classroom_rows(*classroom_ids):
+    """写事务中需要锁定的教室行"""
+    return db.session.query(Classroom.id).filter(Classroom.id.in_(classroom_ids)) if classroom_ids else None
+
+
+class BookingRejected(Exception):
+    """借用申请不满足条件（信息用于返回给学生）"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+@contextmanager
+def _busy_as_rejection():
+    """写锁等待超时转为“系统繁忙”的 BookingRejected，其他数据库错误照常抛出"""
+    try:
+        yield
+    except OperationalError as e:
+        if is_busy(e):
+            raise BookingRejected(BUSY_MESSAGE) from e
+        raise
+
+
+def _conflict_message(occupants):
+    return f'该时间段教室已有{describe_occupants(occupants)}安排，请选择其他时间'
+
+
+def _check_request(booking_date, start_time, end_time, participants):
+    if start_time >= end_time:
+        raise BookingRejected('结束时间必须晚于开始时间')
+    if booking_date < date.today():
+        raise BookingRejected('不能借用过去的日期')
+    if participants is None or participants < 1:
+        raise BookingRejected('参与人数至少为1人')
+
+
+def _check_classroom(classroom_id, participants):
+    classroom = db.session.get(Classroom, classroom_id)
+    if not classroom or classroom.status != 'available':
+        raise BookingRejected('所选教室不可用')
+    if participants > classroom.capacity:
+        raise BookingRejected(f'参与人数不能超过教室容量（{classroom.capacity}人）')
+
+
+def _holding_bookings(classroom_id, first_date, last_date, start_time, end_time):
+    """数据库中教室在 [first_date, last_date] 内与时段重叠的借用，返回 {日期: [(类型, ID)]}"""
+    taken = {}
+    for booking_id, booking_date in db.session.query(ClassroomBooking.id, ClassroomBooking.booking_date).filter(
+        ClassroomBooking.classroom_id == classroom_id,
+        ClassroomBooking.booking_date.between(first_date, last_date),
+        ClassroomBooking.status.in_(HOLDING_STATUSES),
+        ClassroomBooking.start_time < end_time,
+        ClassroomBooking.end_time > start_time
+    ):
+        taken.setdefault(booking_date, []).append(('booking', booking_id))
+    return taken
+
+
+def _apply_booking(student_id, classroom_id, booking_date, start_time, end_time, purpose, participants):
+    """在当前写事务内检查并写入借用申请（不提交）"""
+    _check_classroom(classroom_id, participants)
+
+    # 写锁内以数据库为准再查一次借用（其他进程可能刚提交），课程和考试以索引为准
+    taken = _holding_bookings(classroom_id, booking_date, booking_date, start_time, end_time)
+    if taken:
+        raise BookingRejected(_conflict_message(taken[booking_date]))
+
+    booking = ClassroomBooking(
+        student_id=student_id,
+        classroom_id=classroom_id,
+        booking_date=booking_date,
+        start_time=start_time,
+        end_time=end_time,
+        purpose=purpose,
+        participants=participants
+    )
+    db.session.add(booking)
+    db.session.flush()
+    return booking
+
+
+def submit_booking(student_id, classroom_id, booking_date, start_time, end_time, purpose, participants):
+    """提交教室借用申请，返回 (是否成功, 提示信息)"""
+    try:
+        _check_request(booking_date, start_time, end_time, participants)
+        occupants = availability_index.conflicts(classroom_id, booking_date, start_time, end_time)
+        if occupants:
+            raise BookingRejected(_conflict_message(occupants))
+
+        with room_day_lock(classroom_id, booking_date), _busy_as_rejection():
+            begin_write(_classroom_rows(classroom_id))
+            _apply_booking(student_id, classroom_id, booking_date, start_time, end_time, purpose, participants)
+            db.session.commit()
+        return True, '教室借用申请提交成功，等待审批'
+
+    except BookingRejected as e:
+        db.session.rollback()
+        return False, e.message
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def expand_recurrence(first_date, until, frequency):
+    """重复借用的各次日期：从 first_date 起按 frequency 每隔一周或两周一次，直到 until（含）"""
+    step = timedelta(weeks=RECURRENCE_WEEKS[frequency])
+    dates = []
+    booking_date = first_date
+    while booking_date <= until:
+        dates.append(booking_date)
+        booking_date += step
+    return dates
+
+
+class Occurrence(NamedTuple):
+    """重复借用中的一次：booking_id 为空表示因冲突未提交"""
+    booking_date: date
+    booking_id: int
+    message: str
+
+
+def submit_series(student_id, classroom_id, first_date, until, frequency, start_time, end_time, purpose,
+                  participants, max_occurrences):
+    """提交重复借用申请，无冲突的日期全部提交，返回 (是否有提交成功的日期, 提示信息, [Occurrence])"""
+    try:
+        _check_request(first_date, start_time, end_time, participants)
+        dates = expand_recurrence(first_date, until, frequency)
+        if not dates:
+            raise BookingRejected('重复截止日期不能早于首次借用日期')
+        if len(dates) > max_occurrences:
+            raise BookingRejected(f'重复借用最多 {max_occurrences} 次')
+
+        # 课程和考试按索引检查（多天合并加载），借用在写锁内以数据库为准一次范围查询
+        days = availability_index.days(dates)
+        with room_days_lock(classroom_id, dates), _busy_as_rejection():
+            begin_write(_classroom_rows(classroom_id))
+            _check_classroom(classroom_id, participants)
+            taken = _holding_bookings(classroom_id, dates[0], dates[-1], start_time, end_time)
+
+            conflicts, rows = {}, []
+            for booking_date in dates:
+                occupants = [key for key in days[booking_date].occupants(classroom_id, start_time, end_time)
+                             if key[0] != 'booking'] + taken.get(booking_date, [])
+                if occupants:
+                    conflicts[booking_date] = _conflict_message(occupants)
+                else:
+                    rows.append({'student_id': student_id, 'classroom_id': classroom_id, 'booking_date': booking_date,
+                                 'start_time': start_time, 'end_time': end_time, 'purpose': purpose,
+                                 'participants': participants})
+
+            # 各次借用一条 INSERT ... RETURNING 批量插入，按返回的日期对应ID
+            booking_ids = dict(db.session.execute(
+                insert(ClassroomBooking).returning(ClassroomBooking.booking_date, ClassroomBooking.id), rows
+            ).all()) if rows else {}
+            db.session.commit()
+
+    except BookingRejected as e:
+        db.session.rollback()
+        return False, e.message, []
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # 批量插入不触发 ORM 事件，在此加入占用索引
+    availability_index.apply([(booking_id, classroom_id, booking_date, start_time, end_time, True)
+                              for booking_date, booking_id in booking_ids.items()])
+
+    occurrences = [Occurrence(booking_date, booking_ids[booking_date], '已提交，等待审批')
+                   if booking_date in booking_ids else Occurrence(booking_date, None, conflicts[booking_date])
+                   for booking_date in dates]
+    if not booking_ids:
+        return False, '所有日期的该时间段均有安排，未提交任何申请', occurrences
+    message = f'已提交 {len(booking_ids)} 次借用申请，等待审批'
+    if conflicts:
+        message += f'，{len(conflicts)} 次因时间冲突未提交'
+    return True, message, occurrences
+
+
+# 批量审批
+
+APPROVAL_POLICIES = {
+    # 先提交先批准
+    'submitted': lambda request: (request.created_at, request.id),
+    # 参与人数占教室容量比例高的优先（同比例先提交先批准）
+    'utilization': lambda request: (-request.participants / request.capacity, request.created_at, request.id),
+}
+
+
+class PendingRequest(NamedTuple):
+    id: int
+    classroom_id: int
+    booking_date: date
+    start_time: time
+    end_time: time
+    participants: int
+    created_at: datetime
+    capacity: int
+    room_status: str
+
+
+class ApprovalResult(NamedTuple):
+    """批量审批结果：approved 为批准的申请ID，rejected 为 {申请ID: 拒绝理由}"""
+    approved: list
+    rejected: dict
+
+
+def _rejection(request, day, today):
+    """申请不能批准的理由，可以批准时返回 None"""
+    if request.booking_date < today:
+        return '借用日期已过'
+    if request.room_status != 'available':
+        return '教室当前不可借用'
+    if request.participants > request.capacity:
+        return f'参与人数超过教室容量（{request.capacity}人）'
+    occupants = day.occupants(request.classroom_id, request.start_time, request.end_time)
+    if occupants:
+        return f'该时间段教室已有{describe_occupants(occupants)}安排'
+    return None
+
+
+def resolve_pending(start_date, end_date, approver_id, policy='submitted'):
+    """批量审批 [start_date, end_date] 内的待审批借用：按 policy 排序后贪心批准互不冲突的申请，其余拒绝
+
+    写锁等待超时时抛出 BookingRejected（系统繁忙）。
+    """
+    priority = APPROVAL_POLICIES[policy]
+    today = date.today()
+    try:
+        with _busy_as_rejection():
+            return _resolve_pending(start_date, end_date, approver_id, priority, today)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _resolve_pending(start_date, end_date, approver_id, priority, today):
+    """在一个写事务内完成批量审批并提交"""
+    begin_write()
+    requests = [PendingRequest(*row) for row in db.session.query(
+        ClassroomBooking.id, ClassroomBooking.classroom_id, ClassroomBooking.booking_date,
+        ClassroomBooking.start_time, ClassroomBooking.end_time, ClassroomBooking.participants,
+        ClassroomBooking.created_at, Classroom.capacity, Classroom.status
+    ).join(Classroom, Classroom.id == ClassroomBooking.classroom_id).filter(
+        ClassroomBooking.booking_date.between(start_date, end_date),
+        ClassroomBooking.status == 'pending'
+    )]
+    if not requests:
+        db.session.rollback()
+        return ApprovalResult([], {})
+    begin_write(_classroom_rows(*{request.classroom_id for request in requests}))
+
+    # 固定占用：课程和考试取自占用索引，已批准的借用以数据库为准
+    dates = sorted({request.booking_date for request in requests})
+    fixed = {booking_date: [(key, classroom_id, start_time, end_time)
+                            for classroom_id, intervals in day.intervals.items()
+                            for start_time, end_time, key in intervals if key[0] != 'booking']
+             for booking_date, day in availability_index.days(dates).items()}
+    for booking_id, classroom_id, booking_date, start_time, end_time in db.session.query(
+        ClassroomBooking.id, ClassroomBooking.classroom_id, ClassroomBooking.booking_date,
+        ClassroomBooking.start_time, ClassroomBooking.end_time
+    ).filter(ClassroomBooking.booking_date.in_(dates), ClassroomBooking.status == 'approved'):
+        fixed[booking_date].append((('booking', booking_id), classroom_id, start_time, end_time))
+    days = {booking_date: DayAvailability(occupants) for booking_date, occupants in fixed.items()}
+
+    approved, rejected = [], {}
+    for request in sorted(requests, key=priority):
+        day = days[request.booking_date]
+        reason = _rejection(request, day, today)
+        if reason:
+            rejected[request.id] = reason
+        else:
+            day.add(request.classroom_id, ('booking', request.id), request.start_time, request.end_time)
+            approved.append(request.id)
+
+    now = datetime.utcnow()
+    db.session.bulk_update_mappings(ClassroomBooking, [
+        {'id': booking_id, 'status': 'approved', 'admin_id': approver_id, 'updated_at': now}
+        for booking_id in approved
+    ] + [
+        {'id': booking_id, 'status': 'rejected', 'admin_id': approver_id, 'reject_reason': reason,
+         'updated_at': now}
+        for booking_id, reason in rejected.items()
+    ])
+    db.session.commit()
+
+    # 批量更新不触发 ORM 事件，拒绝的申请在此从占用索引中释放
+    availability_index.apply([(request.id, request.classroom_id, request.booking_date,
+                               request.start_time, request.end_time, False)
+                              for request in requests if request.id in rejected])
+    return ApprovalResult(approved, rejected)
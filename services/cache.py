@@ -0,0 +1,97 @@
+# services/cache.py
+"""进程内缓存：带过期时间（TTL）和容量上限（LRU 淘汰），线程安全"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+
+class TTLCache:
+    """键值缓存，条目超过 ttl 秒过期，超过 maxsize 时淘汰最久未使用的条目"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_create(self, key, creator):
+        """命中则返回缓存值，否则调用 creator() 生成并缓存"""
+        value = self.get(key)
+        if value is None:
+            value = creator()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, predicate):
+        """删除所有满足 predicate(key) 的条目，返回删除数量"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def values(self):
+        """未过期条目的值（快照）"""
+        now = time.monotonic()
+        with self._lock:
+            return [value for expires_at, value in self._data.values() if expires_at >= now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def column_values(target, name):
+    """返回对象某列的当前值和本次修改前的旧值（用于更新时同时失效新旧两个键）"""
+    history = inspect(target).attrs[name].history
+    values = set(history.deleted or ())
+    values.add(getattr(target, name))
+    return values
+
+
+def invalidate_on_commit(model, keys_of, invalidate):
+    """model 的行在事务中被插入/更新/删除时，收集 keys_of(row) 返回的键，
+    事务提交后调用 invalidate(keys)；回滚则丢弃"""
+    bucket = f'invalidate:{model.__tablename__}:{id(invalidate)}'
+
+    def collect(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(bucket, set()).update(keys_of(target))
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, collect)
+
+    @event.listens_for(Session, 'after_commit')
+    def after_commit(session):
+        keys = session.info.pop(bucket, None)
+        if keys:
+            invalidate(keys)
+
+    @event.listens_for(Session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop(bucket, None)
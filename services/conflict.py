@@ -0,0 +1,71 @@
+# services/conflict.py
+"""选课时间冲突检测：为学生已选课程建立按星期划分的区间索引，单次查询 O(log n)"""
+from bisect import bisect_left
+from models import db, Schedule, SelectedCourse
+
+
+class WeeklyIntervalIndex:
+    """一周内的上课时间区间索引
+
+    每天的区间按开始时间排序，并记录前缀最大结束时间。查询 [start, end) 时，
+    二分找到所有开始时间早于 end 的区间，只要其中最大的结束时间晚于 start 即为冲突。
+    已选课程之间即使本身有重叠也能正确判断。
+    """
+
+    def __init__(self, intervals=()):
+        by_day = {}
+        for day_of_week, start_time, end_time, course_id in intervals:
+            by_day.setdefault(day_of_week, []).append((start_time, end_time, course_id))
+
+        self._days = {}
+        for day_of_week, day_intervals in by_day.items():
+            day_intervals.sort()
+            starts = [interval[0] for interval in day_intervals]
+            max_ends = []
+            for _, end_time, _ in day_intervals:
+                max_ends.append(max(max_ends[-1], end_time) if max_ends else end_time)
+            self._days[day_of_week] = (starts, max_ends)
+
+    @classmethod
+    def for_student(cls, student_id, exclude_course_id=None):
+        """一次查询加载学生全部已选课程的上课时间"""
+        query = db.session.query(
+            Schedule.day_of_week, Schedule.start_time, Schedule.end_time, Schedule.course_id
+        ).join(
+            SelectedCourse, SelectedCourse.course_id == Schedule.course_id
+        ).filter(SelectedCourse.student_id == student_id)
+
+        if exclude_course_id is not None:
+            query = query.filter(Schedule.course_id != exclude_course_id)
+
+        return cls(query.all())
+
+    def overlaps(self, day_of_week, start_time, end_time):
+        """判断某天的 [start_time, end_time) 是否与索引中的区间重叠"""
+        day = self._days.get(day_of_week)
+        if not day:
+            return False
+        starts, max_ends = day
+        idx = bisect_left(starts, end_time)
+        return idx > 0 and max_ends[idx - 1] > start_time
+
+    def conflicts_with(self, schedules):
+        """判断一组课表（Schedule 对象）是否与索引冲突"""
+        return any(self.overlaps(s.day_of_week, s.start_time, s.end_time) for s in schedules)
+
+
+def course_conflicts(student_id, course_id):
+    """检查学生选择某门课程是否与已选课程时间冲突"""
+    new_schedules = Schedule.query.filter_by(course_id=course_id).all()
+    if not new_schedules:
+        return False
+    index = WeeklyIntervalIndex.for_student(student_id, exclude_course_id=course_id)
+    return index.conflicts_with(new_schedules)
+
+
+def annotate_conflicts(student_id, courses):
+    """为课程列表逐一标记 has_conflict（课程需已预加载 schedules）"""
+    index = WeeklyIntervalIndex.for_student(student_id)
+    for course in courses:
+        course.has_conflict = index.conflicts_with(course.schedules)
+    return courses
@@ -0,0 +1,78 @@
+# services/export.py
+"""表格流式导出的公共部分：CSV 按批生成文本块，XLSX 以 openpyxl 只写模式逐行写出，内存占用不随行数增长"""
+import codecs
+import csv
+import io
+import unicodedata
+
+CSV_BATCH_SIZE = 1000  # 每个文本块包含的行数
+
+
+def display_width(value):
+    """单元格显示宽度（中文等全角字符按 2 计）"""
+    if value is None:
+        return 0
+    return sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in str(value))
+
+
+class ColumnWidths:
+    """逐行累计各列最大显示宽度"""
+
+    def __init__(self, header):
+        self.widths = [display_width(name) for name in header]
+
+    def update(self, row):
+        for i, value in enumerate(row):
+            width = display_width(value)
+            if width > self.widths[i]:
+                self.widths[i] = width
+
+
+def csv_chunks(header, rows, bom=True, batch_size=CSV_BATCH_SIZE):
+    """按批生成 CSV 文本（csv.writer 负责逗号、引号和换行的转义；bom 为真时 Excel 可直接识别 UTF-8）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if bom:
+        buffer.write(codecs.BOM_UTF8.decode('utf-8'))
+    writer.writerow(header)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def sheet_title(name):
+    """Excel 工作表名：去掉非法字符，最长 31 个字符"""
+    for ch in '[]:*?/\\':
+        name = name.replace(ch, '')
+    return name[:31] or 'Sheet1'
+
+
+def write_xlsx_table(header, rows, title, fileobj):
+    """以 openpyxl 只写模式写出 XLSX，rows 为每次调用返回一个新行迭代器的函数
+
+    只写模式要求列宽在写入数据前设置，因此先流式扫描一遍计算列宽，再流式写入，两遍都不缓存行数据。
+    """
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    widths = ColumnWidths(header)
+    for row in rows():
+        widths.update(row)
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_title(title))
+    for i, width in enumerate(widths.widths, start=1):
+        worksheet.column_dimensions[get_column_letter(i)].width = width + 2
+
+    worksheet.append(header)
+    for row in rows():
+        worksheet.append(row)
+
+    workbook.save(fileobj)
+    fileobj.seek(0)
+    return fileobj
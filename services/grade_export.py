@@ -0,0 +1,37 @@
+# services/grade_export.py
+"""成绩流式导出：一次联表查询分批读取（yield_per），逐行写出 CSV/XLSX，内存占用不随行数增长"""
+from models import db, User, Class, Grade
+from services.export import csv_chunks, write_xlsx_table
+
+EXPORT_COLUMNS = ['学号', '姓名', '班级', '成绩', '绩点', '等级', '考试类型', '考试日期', '评语']
+EXPORT_BATCH_SIZE = 1000  # 每批读取/写出的行数
+
+
+def export_query(course_ids):
+    """课程成绩导出查询：只取导出需要的列，学生和班级在同一条 SQL 中联表"""
+    return db.session.query(
+        User.username, User.real_name, Class.class_name, Grade.score, Grade.grade_point,
+        Grade.grade_level, Grade.exam_type, Grade.exam_date, Grade.comments
+    ).join(User, User.id == Grade.student_id).outerjoin(
+        Class, Class.id == User.class_id
+    ).filter(Grade.course_id.in_(course_ids)).order_by(
+        Grade.course_id, User.username, Grade.exam_type
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def iter_rows(course_ids):
+    """逐行生成导出数据（与 EXPORT_COLUMNS 对应）"""
+    for username, real_name, class_name, score, grade_point, grade_level, exam_type, exam_date, comments \
+            in export_query(course_ids):
+        yield (username, real_name, class_name or '', score, grade_point, grade_level, exam_type,
+               exam_date.strftime('%Y-%m-%d') if exam_date else '', comments or '')
+
+
+def stream_csv(course_ids):
+    """按批生成 CSV 文本（带 BOM，Excel 可直接打开）"""
+    return csv_chunks(EXPORT_COLUMNS, iter_rows(course_ids), batch_size=EXPORT_BATCH_SIZE)
+
+
+def write_xlsx(course_ids, title, fileobj):
+    """以 openpyxl 只写模式写出 XLSX（两遍流式扫描：先算列宽再写入）"""
+    return write_xlsx_table(EXPORT_COLUMNS, lambda: iter_rows(course_ids), title, fileobj)
@@ -0,0 +1,222 @@
+# services/grade_import.py
+"""成绩后台导入：上传文件先落盘，由后台线程逐块解析（CSV reader / openpyxl 只读模式）并分块批量写入
+
+每块独立提交，进度（已处理行数、失败行、吞吐量）通过导入任务对象查询，教师浏览器无需保持连接。
+"""
+import csv
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from models import db
+from services.cache import TTLCache
+from services.grades import upsert_grades
+
+IMPORT_CHUNK_SIZE = 500  # 每块解析/写入的行数
+IMPORT_EXTENSIONS = {'csv', 'xlsx'}
+MAX_ERROR_SAMPLES = 50  # 保留的失败行明细条数
+
+# 导入文件中可识别的列：表头 -> 成绩字段
+IMPORT_COLUMNS = {
+    '学号': 'username',
+    '成绩': 'score',
+    '考试类型': 'exam_type',
+    '考试日期': 'exam_date',
+    '评语': 'comments',
+}
+REQUIRED_COLUMNS = ['学号', '成绩']
+
+
+class ImportFormatError(Exception):
+    """导入文件格式不正确"""
+
+
+def _cell_text(value):
+    """单元格值规整：Excel 中数字学号读出为浮点数时去掉 .0"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.reader(f)
+
+
+def _iter_xlsx(path):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_upload_rows(path, extension):
+    """逐行读取上传文件，返回 (行号, 成绩字段字典) 的生成器，行号与表格中一致（表头为第 1 行）"""
+    rows = _iter_csv(path) if extension == 'csv' else _iter_xlsx(path)
+    header = next(rows, None)
+    if not header:
+        raise ImportFormatError('文件为空')
+
+    header = [_cell_text(name) for name in header]
+    if not all(name in header for name in REQUIRED_COLUMNS):
+        raise ImportFormatError('文件必须包含"学号"和"成绩"列')
+    positions = [(i, IMPORT_COLUMNS[name]) for i, name in enumerate(header) if name in IMPORT_COLUMNS]
+
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        row = {}
+        for i, field in positions:
+            value = values[i] if i < len(values) else None
+            if field not in ('score', 'exam_date'):
+                value = _cell_text(value)
+            # 可选列留空时不覆盖已有数据
+            if value is not None or field in ('username', 'score'):
+                row[field] = value
+        yield line, row
+
+
+def _chunks(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportJob:
+    """一次成绩导入任务的进度"""
+
+    def __init__(self, course_id, teacher_id, filename):
+        self.id = uuid.uuid4().hex
+        self.course_id = course_id
+        self.teacher_id = teacher_id
+        self.filename = filename
+        self.status = 'queued'  # queued/running/done/error
+        self.message = '等待导入'
+        self.rows_processed = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.errors = []  # [(行号, 原因)]，最多 MAX_ERROR_SAMPLES 条
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, lines, result):
+        """累计一块的写入结果，行号换算为文件中的行号"""
+        self.rows_processed += len(lines)
+        self.success_count += result.success_count
+        self.error_count += result.error_count
+        for index, reason in result.errors:
+            if len(self.errors) < MAX_ERROR_SAMPLES:
+                self.errors.append((lines[index - 1], reason))
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        elapsed = self.elapsed
+        return {
+            'job_id': self.id,
+            'course_id': self.course_id,
+            'filename': self.filename,
+            'status': self.status,
+            'message': self.message,
+            'rows_processed': self.rows_processed,
+            'success_count': self.success_count,
+            'error_count': self.error_count,
+            'errors': [{'row': line, 'reason': reason} for line, reason in self.errors],
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(self.rows_processed / elapsed, 1) if elapsed else 0
+        }
+
+
+class GradeImporter:
+    """后台导入线程池"""
+
+    def __init__(self, app, workers=2, chunk_size=IMPORT_CHUNK_SIZE):
+        self.app = app
+        self.chunk_size = chunk_size
+        self.jobs = TTLCache(maxsize=256, ttl=3600)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grade-import')
+
+    def submit(self, course_id, teacher_id, upload, defaults=None, scale=None):
+        """保存上传文件并登记导入任务，立即返回任务对象"""
+        extension = upload.filename.rsplit('.', 1)[-1].lower() if '.' in upload.filename else ''
+        if extension not in IMPORT_EXTENSIONS:
+            raise ImportFormatError('仅支持 .xlsx 和 .csv 文件')
+
+        fd, path = tempfile.mkstemp(prefix='grade_import_', suffix='.' + extension)
+        with os.fdopen(fd, 'wb') as f:
+            upload.save(f)
+
+        job = ImportJob(course_id, teacher_id, upload.filename)
+        self.jobs.set(job.id, job)
+        self._executor.submit(self._run, job, path, extension, defaults, scale)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _run(self, job, path, extension, defaults, scale):
+        with self.app.app_context():
+            job.status = 'running'
+            job.message = '正在导入'
+            job.started_at = time.time()
+            try:
+                self.process(job, iter_upload_rows(path, extension), defaults, scale)
+                job.status = 'done'
+                job.message = f'导入完成：成功 {job.success_count} 条，失败 {job.error_count} 条'
+            except ImportError:
+                job.status = 'error'
+                job.message = '请安装 openpyxl 库以支持Excel导入，或改用CSV文件'
+            except ImportFormatError as e:
+                job.status = 'error'
+                job.message = str(e)
+            except Exception as e:
+                db.session.rollback()
+                job.status = 'error'
+                job.message = f'导入失败: {str(e)}'
+            finally:
+                job.finished_at = time.time()
+                db.session.remove()
+                os.remove(path)
+
+    def process(self, job, rows, defaults=None, scale=None):
+        """逐块校验并写入，每块单独提交"""
+        for chunk in _chunks(rows, self.chunk_size):
+            lines = [line for line, _ in chunk]
+            result = upsert_grades(job.course_id, job.teacher_id, [row for _, row in chunk],
+                                   defaults=defaults, scale=scale)
+            job.record(lines, result)
+
+
+_create_lock = threading.Lock()
+
+
+def get_grade_importer(app):
+    """获取（必要时创建）应用的成绩导入实例"""
+    with _create_lock:
+        importer = app.extensions.get('grade_importer')
+        if importer is None:
+            importer = GradeImporter(
+                app,
+                workers=app.config.get('GRADE_IMPORT_WORKERS', 2),
+                chunk_size=app.config.get('GRADE_IMPORT_CHUNK_SIZE', IMPORT_CHUNK_SIZE)
+            )
+            app.extensions['grade_importer'] = importer
+        return importer
@@ -0,0 +1,353 @@
+# services/grade_stats.py
+"""课程成绩统计：每门课程一行摘要（人数、总分、平方和、最值、及格人数、0.1 分精度的直方图），
+随成绩写入在同一事务内增量维护，读取时不再扫描成绩表。
+
+- ORM 写入（Grade 对象增删改）由会话的 before_flush/after_flush 事件自动维护；
+- 批量写入（services/grades.py）显式调用 record_score_changes；
+- rebuild_stats 一次遍历重算（安装了 NumPy 时向量化计算）。
+"""
+import json
+import math
+from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+from typing import NamedTuple, Optional
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, Class, Course, Grade, CourseGradeStats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PASS_SCORE = 60
+SCORE_BUCKETS = [('90-100', 90, None), ('80-89', 80, 90), ('70-79', 70, 80), ('60-69', 60, 70), ('0-59', None, 60)]
+PERCENTILES = (10, 25, 75, 90)
+
+stats_table = CourseGradeStats.__table__
+
+
+def _tenths(score):
+    return int(round(score * 10))
+
+
+class GradeSummary:
+    """一门课程的成绩摘要：支持增减单个成绩，派生统计量只依赖直方图（最多 1001 档），与人数无关"""
+
+    def __init__(self, count=0, total=0.0, total_sq=0.0, min_score=None, max_score=None, pass_count=0,
+                 histogram=None):
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.min_score = min_score
+        self.max_score = max_score
+        self.pass_count = pass_count
+        self.histogram = histogram or {}  # {成绩×10: 人数}
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['count'], row['total'], row['total_sq'], row['min_score'], row['max_score'],
+                   row['pass_count'], {int(k): v for k, v in json.loads(row['histogram'] or '{}').items()})
+
+    @classmethod
+    def from_scores(cls, scores):
+        """由一组成绩一次计算摘要"""
+        if np is not None and len(scores):
+            values = np.asarray(scores, dtype=float)
+            keys, counts = np.unique(np.rint(values * 10).astype(int), return_counts=True)
+            return cls(int(values.size), float(values.sum()), float((values * values).sum()),
+                       float(values.min()), float(values.max()), int((values >= PASS_SCORE).sum()),
+                       dict(zip(keys.tolist(), counts.tolist())))
+        summary = cls()
+        for score in scores:
+            summary.add(score)
+        return summary
+
+    def add(self, score):
+        self.count += 1
+        self.total += score
+        self.total_sq += score * score
+        self.pass_count += score >= PASS_SCORE
+        key = _tenths(score)
+        self.histogram[key] = self.histogram.get(key, 0) + 1
+        self.min_score = score if self.min_score is None else min(self.min_score, score)
+        self.max_score = score if self.max_score is None else max(self.max_score, score)
+
+    def remove(self, score):
+        """移除一个成绩；摘要中没有该成绩时返回 False（说明摘要已不准确，需要重算）"""
+        key = _tenths(score)
+        if not self.histogram.get(key):
+            return False
+        self.histogram[key] -= 1
+        if not self.histogram[key]:
+            del self.histogram[key]
+        self.count -= 1
+        self.pass_count -= score >= PASS_SCORE
+        if not self.count:
+            self.total = self.total_sq = 0.0
+            self.min_score = self.max_score = None
+            return True
+        self.total -= score
+        self.total_sq -= score * score
+        # 移除的是最值时由直方图确定新的最值
+        if score <= self.min_score:
+            self.min_score = min(self.histogram) / 10
+        if score >= self.max_score:
+            self.max_score = max(self.histogram) / 10
+        return True
+
+    def as_values(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'total_sq': self.total_sq,
+            'min_score': self.min_score,
+            'max_score': self.max_score,
+            'pass_count': self.pass_count,
+            'histogram': json.dumps(self.histogram, sort_keys=True)
+        }
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def std_dev(self):
+        """总体标准差"""
+        if not self.count:
+            return None
+        return math.sqrt(max(self.total_sq / self.count - self.mean ** 2, 0.0))
+
+    def _value_at(self, rank):
+        """从低到高第 rank 个（从 1 开始）成绩"""
+        seen = 0
+        for key in sorted(self.histogram):
+            seen += self.histogram[key]
+            if seen >= rank:
+                return key / 10
+        return None
+
+    def percentile(self, pct):
+        """百分位数（最近秩法）"""
+        if not self.count:
+            return None
+        return self._value_at(max(1, math.ceil(pct / 100 * self.count)))
+
+    @property
+    def median(self):
+        if not self.count:
+            return None
+        if self.count % 2:
+            return self._value_at(self.count // 2 + 1)
+        return (self._value_at(self.count // 2) + self._value_at(self.count // 2 + 1)) / 2
+
+    def count_between(self, low=None, high=None):
+        """[low, high) 区间内的人数"""
+        return sum(count for key, count in self.histogram.items()
+                   if (low is None or key >= low * 10) and (high is None or key < high * 10))
+
+    def level_counts(self, scale):
+        """按评分标准统计各等级人数（从高到低）"""
+        counts = [0] * len(scale.levels)
+        for key, count in self.histogram.items():
+            counts[scale.band(key / 10)] += count
+        return list(reversed(list(zip(scale.levels, counts))))
+
+    def to_dict(self, scale):
+        pass_count = self.pass_count if scale.pass_score == PASS_SCORE else self.count_between(scale.pass_score)
+        return {
+            'total_students': self.count,
+            'average_score': round(self.mean, 2),
+            'max_score': self.max_score,
+            'min_score': self.min_score,
+            'median_score': round(self.median, 2),
+            'std_dev': round(self.std_dev, 2),
+            'percentiles': {f'p{pct}': self.percentile(pct) for pct in PERCENTILES},
+            'pass_count': pass_count,
+            'fail_count': self.count - pass_count,
+            'score_distribution': {name: self.count_between(low, high) for name, low, high in SCORE_BUCKETS},
+            'grading_scale': scale.label,
+            'level_distribution': self.level_counts(scale)
+        }
+
+
+def _course_scores(connection, course_ids):
+    """按课程分组读取成绩，返回 {course_id: [score, ...]}"""
+    rows = connection.execute(
+        db.select(Grade.course_id, Grade.score).where(
+            Grade.course_id.in_(course_ids), Grade.score.isnot(None)
+        ).order_by(Grade.course_id)
+    ).all()
+    return {course_id: [score for _, score in group] for course_id, group in groupby(rows, key=lambda r: r[0])}
+
+
+def _save(connection, course_id, summary, exists):
+    values = dict(summary.as_values(), updated_at=datetime.utcnow())
+    if exists:
+        connection.execute(stats_table.update().where(stats_table.c.course_id == course_id).values(**values))
+    else:
+        connection.execute(stats_table.insert().values(course_id=course_id, **values))
+
+
+def apply_changes(connection, changes):
+    """在当前事务内把成绩增减应用到统计摘要
+
+    changes 为 {course_id: (移除的成绩列表, 新增的成绩列表, 是否需要重算)}；
+    摘要不存在或与增减不符时按成绩表重算该课程。
+    """
+    rebuild = []
+    for course_id, (removed, added, stale) in changes.items():
+        row = connection.execute(
+            db.select(stats_table).where(stats_table.c.course_id == course_id).with_for_update()
+        ).mappings().first()
+        if row is None or stale:
+            rebuild.append((course_id, row is not None))
+            continue
+        summary = GradeSummary.from_row(row)
+        if not all(summary.remove(score) for score in removed):
+            rebuild.append((course_id, True))
+            continue
+        for score in added:
+            summary.add(score)
+        _save(connection, course_id, summary, exists=True)
+
+    if rebuild:
+        scores = _course_scores(connection, [course_id for course_id, _ in rebuild])
+        for course_id, exists in rebuild:
+            _save(connection, course_id, GradeSummary.from_scores(scores.get(course_id, [])), exists)
+
+
+def record_score_changes(course_id, removed=(), added=()):
+    """批量写入成绩后调用：把成绩增减记入统计摘要（与写入同一事务）"""
+    if removed or added:
+        apply_changes(db.session.connection(), {course_id: (list(removed), list(added), False)})
+
+
+def rebuild_stats(course_ids=None):
+    """按成绩表重算课程统计摘要（默认全部课程）"""
+    query = db.session.query(Grade.course_id, Grade.score).filter(Grade.score.isnot(None))
+    delete = db.delete(CourseGradeStats)
+    if course_ids is not None:
+        query = query.filter(Grade.course_id.in_(course_ids))
+        delete = delete.where(CourseGradeStats.course_id.in_(course_ids))
+
+    now = datetime.utcnow()
+    rows = []
+    for course_id, group in groupby(query.order_by(Grade.course_id).all(), key=lambda r: r[0]):
+        summary = GradeSummary.from_scores([score for _, score in group])
+        rows.append(dict(summary.as_values(), course_id=course_id, updated_at=now))
+
+    db.session.execute(delete)
+    if rows:
+        db.session.execute(stats_table.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def get_course_stats(course_id):
+    """读取课程成绩统计摘要（摘要尚未生成时按成绩表临时计算）"""
+    row = db.session.execute(
+        db.select(stats_table).where(stats_table.c.course_id == course_id)
+    ).mappings().first()
+    if row is not None:
+        return GradeSummary.from_row(row)
+    scores = [score for (score,) in db.session.query(Grade.score).filter(
+        Grade.course_id == course_id, Grade.score.isnot(None)).all()]
+    return GradeSummary.from_scores(scores)
+
+
+class CourseGradeSummary(NamedTuple):
+    """教师成绩管理页的课程概要"""
+    course: Course
+    class_name: Optional[str]
+    enrollment_count: int
+    graded_count: int
+    average_score: Optional[float]
+
+    @property
+    def grades_saved(self):
+        return self.graded_count > 0
+
+
+def get_course_grade_summaries(teacher_id):
+    """一次查询取出教师全部课程的选课人数、已录成绩数、平均分和提交状态"""
+    rows = db.session.query(
+        Course, Class.class_name, CourseGradeStats.count, CourseGradeStats.total
+    ).outerjoin(Class, Class.id == Course.class_id).outerjoin(
+        CourseGradeStats, CourseGradeStats.course_id == Course.id
+    ).filter(Course.teacher_id == teacher_id).order_by(Course.id).all()
+
+    return [CourseGradeSummary(
+        course=course,
+        class_name=class_name,
+        enrollment_count=course.enrolled_count or 0,
+        graded_count=count or 0,
+        average_score=round(total / count, 2) if count else None
+    ) for course, class_name, count, total in rows]
+
+
+# ORM 写入：flush 前记录旧值（此时数据库中仍是旧数据），flush 后在同一事务内更新摘要
+
+def _old_value(grade, name):
+    """属性修改前的值；旧值未加载时返回 (False, None)"""
+    history = inspect(grade).attrs[name].history
+    if history.deleted:
+        return True, history.deleted[0]
+    if history.unchanged:
+        return True, history.unchanged[0]
+    return not history.added, getattr(grade, name)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_grade_changes(session, flush_context, instances):
+    pending = session.info.setdefault('grade_stats_pending', {'removed': [], 'added': [], 'stale': set()})
+
+    for grade in session.deleted:
+        if isinstance(grade, Grade) and grade.score is not None:
+            pending['removed'].append((grade.course_id, grade.score))
+
+    for grade in session.dirty:
+        if not isinstance(grade, Grade) or not session.is_modified(grade):
+            continue
+        state = inspect(grade)
+        if not (state.attrs.score.history.has_changes() or state.attrs.course_id.history.has_changes()):
+            continue
+        known_score, old_score = _old_value(grade, 'score')
+        known_course, old_course = _old_value(grade, 'course_id')
+        if not (known_score and known_course):
+            pending['stale'].add(grade.course_id)
+            if known_course:
+                pending['stale'].add(old_course)
+            continue
+        if old_score is not None:
+            pending['removed'].append((old_course, old_score))
+        pending['added'].append(grade)
+
+    for grade in session.new:
+        if isinstance(grade, Grade):
+            pending['added'].append(grade)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_grade_changes(session, flush_context):
+    pending = session.info.pop('grade_stats_pending', None)
+    if not pending or not (pending['removed'] or pending['added'] or pending['stale']):
+        return
+
+    changes = defaultdict(lambda: ([], [], False))
+    for course_id, score in pending['removed']:
+        changes[course_id][0].append(score)
+    for grade in pending['added']:
+        if grade.score is not None:
+            changes[grade.course_id][1].append(grade.score)
+    for course_id in pending['stale']:
+        removed, added, _ = changes[course_id]
+        changes[course_id] = (removed, added, True)
+
+    apply_changes(session.connection(), dict(changes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_grade_changes(session):
+    session.info.pop('grade_stats_pending', None)
@@ -0,0 +1,178 @@
+# services/grades.py
+"""成绩批量写入：用户名、选课关系和已有成绩各一次集合查询解析，再批量插入/更新
+
+唯一约束 (student_id, course_id) 保证同一学生同一课程只有一条成绩，考试类型是成绩的普通字段；
+并发写入撞上约束时整批回滚并重试一次（重试时已有成绩会被识别为更新）。
+"""
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Course, Grade, SelectedCourse
+from services.grading import get_scale
+from services.grade_stats import record_score_changes
+from services.transcripts import refresh_transcripts, refresh_course_transcripts
+
+DEFAULT_EXAM_TYPE = '期末'
+
+
+class UpsertResult:
+    """批量写入结果"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []  # (行号, 原因)
+        self.grades = {}  # student_id -> 写入的字段
+
+    @property
+    def success_count(self):
+        return self.inserted + self.updated
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+
+def _parse_score(value):
+    if value is None or value == '':
+        raise ValueError('缺少成绩')
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'成绩格式错误: {value}')
+    if score != score or not 0 <= score <= 100:  # NaN 或超出范围
+        raise ValueError(f'成绩超出范围: {value}')
+    return score
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def _resolve_students(rows):
+    """rows 中以 username 标识学生的，一次查询换成 student_id"""
+    usernames = {str(row['username']).strip() for row in rows if row.get('username') is not None}
+    if not usernames:
+        return {}
+    return dict(db.session.query(User.username, User.id).filter(
+        User.username.in_(usernames), User.role == 'student'
+    ).all())
+
+
+def _prepare(course_id, rows, exam_type, exam_date, scale, result):
+    """校验并规整输入行，返回 {student_id: 字段}（同一学生后出现的覆盖先出现的）"""
+    student_ids = _resolve_students(rows)
+    enrolled = {student_id for (student_id,) in db.session.query(SelectedCourse.student_id).filter_by(
+        course_id=course_id).all()}
+
+    prepared = {}
+    for line, row in enumerate(rows, start=1):
+        try:
+            if row.get('student_id') is not None:
+                student_id = int(row['student_id'])
+            elif row.get('username') is not None:
+                student_id = student_ids.get(str(row['username']).strip())
+                if student_id is None:
+                    raise ValueError(f"学生不存在: {row['username']}")
+            else:
+                raise ValueError('缺少学生')
+            if student_id not in enrolled:
+                raise ValueError('学生未选此课程')
+
+            fields = {
+                'score': _parse_score(row.get('score')),
+                'exam_type': row.get('exam_type') or exam_type or DEFAULT_EXAM_TYPE,
+            }
+            row_exam_date = _parse_date(row.get('exam_date')) or exam_date
+            if row_exam_date:
+                fields['exam_date'] = row_exam_date
+            if 'comments' in row:
+                fields['comments'] = row['comments'] or ''
+        except (TypeError, ValueError) as e:
+            result.errors.append((line, str(e)))
+            continue
+        prepared[student_id] = fields
+
+    points, levels = scale.grade([fields['score'] for fields in prepared.values()])
+    for fields, point, level in zip(prepared.values(), points, levels):
+        fields['grade_point'] = point
+        fields['grade_level'] = level
+    return prepared
+
+
+def _write(course_id, teacher_id, prepared, defaults, result):
+    """按已有成绩拆分为批量更新和批量插入"""
+    student_ids = set(prepared)
+    existing = {}
+    if student_ids:
+        existing = {student_id: (grade_id, score) for grade_id, student_id, score in db.session.query(
+            Grade.id, Grade.student_id, Grade.score
+        ).filter(Grade.course_id == course_id, Grade.student_id.in_(student_ids)).all()}
+
+    now = datetime.utcnow()
+    inserts, updates, replaced_scores = [], [], []
+    for student_id, fields in prepared.items():
+        grade_id, old_score = existing.get(student_id, (None, None))
+        if grade_id:
+            updates.append(dict(fields, id=grade_id, updated_at=now))
+            if old_score is not None:
+                replaced_scores.append(old_score)
+        else:
+            inserts.append(dict(defaults, **fields, student_id=student_id, course_id=course_id,
+                                teacher_id=teacher_id))
+
+    if updates:
+        db.session.bulk_update_mappings(Grade, updates)
+    if inserts:
+        db.session.bulk_insert_mappings(Grade, inserts)
+    # 批量写入不触发 ORM 事件，显式维护课程成绩统计和学生成绩单
+    record_score_changes(course_id, replaced_scores, [fields['score'] for fields in prepared.values()])
+    refresh_transcripts(student_ids)
+    result.updated = len(updates)
+    result.inserted = len(inserts)
+    result.grades = prepared
+
+
+def upsert_grades(course_id, teacher_id, rows, exam_type=DEFAULT_EXAM_TYPE, exam_date=None, defaults=None,
+                  scale=None):
+    """批量新增或更新某课程的成绩
+
+    rows 为字典列表，用 student_id 或 username 标识学生，含 score，可选 exam_type、exam_date、comments。
+    defaults 为新建成绩时的附加字段（如 academic_year、semester）。scale 为评分标准，默认取课程设置。
+    校验失败的行记入 result.errors，不影响其他行。
+    """
+    if scale is None:
+        scale = get_scale(db.session.query(Course.grading_scale).filter_by(id=course_id).scalar())
+    result = UpsertResult()
+    prepared = _prepare(course_id, rows, exam_type, exam_date, scale, result)
+    defaults = defaults or {}
+
+    for attempt in range(2):
+        try:
+            _write(course_id, teacher_id, prepared, defaults, result)
+            db.session.commit()
+            return result
+        except IntegrityError:
+            # 并发插入了相同 (学生, 课程) 的成绩，重新读取已有成绩后重试
+            db.session.rollback()
+            if attempt:
+                raise
+
+
+def regrade_course(course_id, scale):
+    """按新的评分标准重新计算课程全部成绩的绩点和等级，返回更新条数"""
+    rows = db.session.query(Grade.id, Grade.score).filter(
+        Grade.course_id == course_id, Grade.score.isnot(None)
+    ).all()
+    points, levels = scale.grade([score for _, score in rows])
+    db.session.bulk_update_mappings(Grade, [
+        {'id': grade_id, 'grade_point': point, 'grade_level': level}
+        for (grade_id, _), point, level in zip(rows, points, levels)
+    ])
+    refresh_course_transcripts([course_id])
+    return len(rows)
@@ -0,0 +1,113 @@
+# services/grading.py
+"""评分标准：百分制成绩到绩点/等级的分段映射表
+
+单个成绩用 bisect 查表，一组成绩安装了 NumPy 时用 searchsorted 一次映射，否则逐个 bisect。
+每门课程通过 Course.grading_scale 选择评分标准。
+"""
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_SCALE = 'standard'
+
+
+class GradingScale:
+    """分段评分标准
+
+    breakpoints 为各档的最低分（升序）；points/levels 比 breakpoints 多一项，
+    第 0 项对应低于最低档的成绩。绩点为 None 表示该档不计入绩点。
+    """
+
+    def __init__(self, name, label, breakpoints, points, levels, pass_score=60):
+        if len(points) != len(breakpoints) + 1 or len(levels) != len(breakpoints) + 1:
+            raise ValueError('绩点和等级的数量应比分段点多一个')
+        if list(breakpoints) != sorted(breakpoints):
+            raise ValueError('分段点必须升序排列')
+        self.name = name
+        self.label = label
+        self.breakpoints = list(breakpoints)
+        self.points = list(points)
+        self.levels = list(levels)
+        self.pass_score = pass_score
+        if np is not None:
+            self._np_breakpoints = np.asarray(self.breakpoints, dtype=float)
+            self._np_points = np.asarray(self.points, dtype=object)
+            self._np_levels = np.asarray(self.levels, dtype=object)
+
+    def band(self, score):
+        """成绩所在的档（下标）"""
+        return bisect_right(self.breakpoints, score)
+
+    def grade_point(self, score):
+        return self.points[self.band(score)]
+
+    def grade_level(self, score):
+        return self.levels[self.band(score)]
+
+    def bands(self, scores):
+        """一组成绩所在的档"""
+        if np is not None:
+            return np.searchsorted(self._np_breakpoints, np.asarray(scores, dtype=float), side='right')
+        return [bisect_right(self.breakpoints, score) for score in scores]
+
+    def grade(self, scores):
+        """一次映射一组成绩，返回 (绩点列表, 等级列表)"""
+        if len(scores) == 0:
+            return [], []
+        bands = self.bands(scores)
+        if np is not None:
+            return self._np_points[bands].tolist(), self._np_levels[bands].tolist()
+        return [self.points[b] for b in bands], [self.levels[b] for b in bands]
+
+    def level_counts(self, scores):
+        """各等级人数，返回按等级从高到低排列的 [(等级, 人数), ...]"""
+        counts = [0] * len(self.levels)
+        if len(scores):
+            bands = self.bands(scores)
+            if np is not None:
+                counts = np.bincount(bands, minlength=len(self.levels)).tolist()
+            else:
+                for band in bands:
+                    counts[band] += 1
+        return list(reversed(list(zip(self.levels, counts))))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'label': self.label,
+            'breakpoints': self.breakpoints,
+            'points': self.points,
+            'levels': self.levels
+        }
+
+
+SCALES = {}
+
+
+def register_scale(scale):
+    """注册评分标准（可在应用启动时添加自定义标准）"""
+    SCALES[scale.name] = scale
+    return scale
+
+
+register_scale(GradingScale('standard', '四分制', [60, 70, 80, 90],
+                            [0.0, 1.0, 2.0, 3.0, 4.0], ['F', 'D', 'C', 'B', 'A']))
+register_scale(GradingScale('five_point', '五分制', [60, 70, 80, 90],
+                            [0.0, 2.0, 3.0, 4.0, 5.0], ['F', 'D', 'C', 'B', 'A']))
+register_scale(GradingScale('gpa_4_3', '4.3分制', [60, 64, 68, 72, 75, 78, 82, 85, 90, 95],
+                            [0.0, 1.0, 1.5, 2.0, 2.3, 2.7, 3.0, 3.3, 3.7, 4.0, 4.3],
+                            ['F', 'D', 'C-', 'C', 'C+', 'B-', 'B', 'B+', 'A-', 'A', 'A+']))
+register_scale(GradingScale('pass_fail', '合格制', [60], [None, None], ['F', 'P']))
+
+
+def get_scale(name=None):
+    """按名称获取评分标准，未知名称使用默认标准"""
+    return SCALES.get(name or DEFAULT_SCALE, SCALES[DEFAULT_SCALE])
+
+
+def scale_for(course):
+    """课程使用的评分标准"""
+    return get_scale(getattr(course, 'grading_scale', None))
@@ -0,0 +1,223 @@
+# services/registration_queue.py
+"""选课高峰排队模式：请求先经按用户的令牌桶限流进入有界队列，由单个写线程批量入库
+
+开启 REGISTRATION_QUEUE_ENABLED 后，选课/退课接口只登记排队凭证（ticket）并立即返回，
+客户端轮询凭证状态获取最终结果。单写线程避免了 SQLite 上多个请求线程争抢写锁。
+
+队列、凭证和写线程都在进程内，排队模式只能以单进程（多线程）方式部署：多进程时轮询请求
+可能落到没有该凭证的进程。应用启动时独占一个按数据库区分的锁文件，已被其他进程持有时拒绝启动。
+"""
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from models import db
+from services import selection
+from services.cache import TTLCache
+
+
+class RateLimited(Exception):
+    """请求过于频繁（令牌桶已空）"""
+
+
+class QueueFull(Exception):
+    """排队人数已满"""
+
+
+class TokenBucket:
+    """按键（用户）的令牌桶：每秒补充 rate 个令牌，最多积累 burst 个
+
+    已补满的桶与新建的桶等价，每过一个补满周期（burst / rate 秒）清理一次，桶的数量只与近期活跃用户数有关。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + burst / rate
+
+    def _sweep(self, now):
+        full = [key for key, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        self._next_sweep = now + self.burst / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            return True
+
+
+class Ticket:
+    """排队凭证"""
+
+    def __init__(self, user_id, operation, course_id):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.operation = operation
+        self.course_id = course_id
+        self.status = 'queued'  # queued/done/error
+        self.success = None
+        self.message = '排队中'
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    def finish(self, success, message, status='done'):
+        self.success = success
+        self.message = message
+        self.status = status
+        self.finished_at = time.monotonic()
+
+    def to_dict(self):
+        data = {
+            'ticket_id': self.id,
+            'operation': self.operation,
+            'course_id': self.course_id,
+            'status': self.status,
+            'success': self.success,
+            'message': self.message
+        }
+        if self.finished_at is not None:
+            data['latency_ms'] = round((self.finished_at - self.created_at) * 1000, 1)
+        return data
+
+
+class RegistrationQueue:
+    """有界请求队列 + 单写线程"""
+
+    def __init__(self, app, maxsize=5000, batch_size=50, batch_wait=0.02, rate=1.0, burst=3):
+        self.app = app
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.limiter = TokenBucket(rate, burst)
+        self.tickets = TTLCache(maxsize=maxsize * 4, ttl=600)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, user_id, operation, course_id):
+        """登记选课/退课请求，返回排队凭证"""
+        if operation not in selection.OPERATIONS:
+            raise ValueError(f'未知操作: {operation}')
+        if not self.limiter.allow(user_id):
+            raise RateLimited()
+
+        self.start()
+        ticket = Ticket(user_id, operation, course_id)
+        try:
+            self._queue.put_nowait(ticket)
+        except queue.Full:
+            raise QueueFull()
+        self.tickets.set(ticket.id, ticket)
+        return ticket
+
+    def get(self, ticket_id):
+        return self.tickets.get(ticket_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """首次提交时启动写线程"""
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='registration-writer', daemon=True)
+                self._worker.start()
+
+    def _next_batch(self):
+        """阻塞取到第一个请求后，在 batch_wait 内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self._next_batch()
+                self.process(batch)
+
+    def process(self, batch):
+        """一个事务写入一批请求；整批失败时逐个重试，确保每个凭证都有结果"""
+        operations = [(ticket.operation, ticket.user_id, ticket.course_id) for ticket in batch]
+        try:
+            results = selection.apply_batch(operations)
+        except Exception:
+            results = []
+            for operation, user_id, course_id in operations:
+                try:
+                    results.append(selection.run_operation(operation, user_id, course_id))
+                except Exception as e:
+                    results.append(None)
+                    print(f"选课排队处理失败: {e}")
+        finally:
+            db.session.remove()
+
+        for ticket, result in zip(batch, results):
+            if result is None:
+                ticket.finish(False, '处理失败，请重试', status='error')
+            else:
+                ticket.finish(*result)
+
+
+_create_lock = threading.Lock()
+
+
+def claim_single_process(database_uri):
+    """独占该数据库的排队锁文件（进程退出时自动释放），已被其他进程持有时抛出 RuntimeError"""
+    name = hashlib.sha1(database_uri.encode('utf-8')).hexdigest()[:16]
+    lock_file = open(os.path.join(tempfile.gettempdir(), f'registration_queue_{name}.lock'), 'a')
+    try:
+        try:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:  # Windows
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError('选课排队模式只能在单个进程中运行，已有其他进程开启了排队模式'
+                           '（请以单进程多线程方式部署，或关闭 REGISTRATION_QUEUE_ENABLED）')
+    return lock_file
+
+
+def get_registration_queue(app):
+    """获取（必要时创建）应用的选课排队实例，首次创建时确认没有其他进程开启排队模式"""
+    with _create_lock:
+        registration_queue = app.extensions.get('registration_queue')
+        if registration_queue is not None:
+            return registration_queue
+        process_lock = claim_single_process(app.config['SQLALCHEMY_DATABASE_URI'])
+        registration_queue = RegistrationQueue(
+            app,
+            maxsize=app.config.get('REGISTRATION_QUEUE_SIZE', 5000),
+            batch_size=app.config.get('REGISTRATION_BATCH_SIZE', 50),
+            rate=app.config.get('REGISTRATION_RATE', 1.0),
+            burst=app.config.get('REGISTRATION_BURST', 3)
+        )
+        registration_queue.process_lock = process_lock  # 随实例保留，锁在进程存活期间一直持有
+        app.extensions['registration_queue'] = registration_queue
+        return registration_queue
@@ -0,0 +1,99 @@
+# services/rooms.py
+"""课表、考试与教室的关联：按地点文本（如“教学楼A101”“教学楼A101-A105”）解析出教室
+
+- 地点末尾的教室编号与 Classroom.room_number 匹配，“A101-A105”展开为编号区间内已登记的教室；
+- link_locations 回填已有课表和考试的教室；
+- ORM 新建或修改地点时自动解析（未显式指定教室的情况下）。
+"""
+import re
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, Classroom, Schedule, Exam, exam_classrooms
+
+ROOM_PATTERN = re.compile(r'([A-Za-z]*)(\d+)$')
+RANGE_PATTERN = re.compile(r'([A-Za-z]*)(\d+)\s*[-~～至]\s*([A-Za-z]*)(\d+)$')
+MAX_RANGE = 50  # 区间最多展开的教室数
+
+
+def room_numbers(location):
+    """地点文本中的教室编号（区间展开），无法识别时返回空列表"""
+    location = (location or '').strip()
+    match = RANGE_PATTERN.search(location)
+    if match:
+        prefix, first, end_prefix, last = match.groups()
+        if (end_prefix or prefix).upper() == prefix.upper() and 0 <= int(last) - int(first) < MAX_RANGE:
+            return [f'{prefix}{number:0{len(first)}d}' for number in range(int(first), int(last) + 1)]
+    match = ROOM_PATTERN.search(location)
+    return [match.group(0)] if match else []
+
+
+def match_classrooms(location, rooms):
+    """地点对应的教室ID列表，rooms 为 {教室编号（大写）: 教室ID}"""
+    return [rooms[number.upper()] for number in room_numbers(location) if number.upper() in rooms]
+
+
+def _room_lookup():
+    return {room_number.upper(): classroom_id
+            for classroom_id, room_number in db.session.query(Classroom.id, Classroom.room_number)}
+
+
+def link_locations():
+    """按地点文本回填课表的 classroom_id 和考试的考场关联，返回 (关联数, 无法识别的地点)"""
+    rooms = _room_lookup()
+    linked, missing = 0, set()
+
+    updates = []
+    for schedule_id, location in db.session.query(Schedule.id, Schedule.location).filter(
+            Schedule.classroom_id.is_(None), Schedule.location.isnot(None)):
+        classroom_ids = match_classrooms(location, rooms)
+        if len(classroom_ids) == 1:
+            updates.append({'id': schedule_id, 'classroom_id': classroom_ids[0]})
+        else:
+            missing.add(location)
+    if updates:
+        db.session.bulk_update_mappings(Schedule, updates)
+        linked += len(updates)
+
+    linked_exams = db.session.query(exam_classrooms.c.exam_id)
+    links = []
+    for exam_id, location in db.session.query(Exam.id, Exam.location).filter(~Exam.id.in_(linked_exams)):
+        classroom_ids = match_classrooms(location, rooms)
+        if not classroom_ids:
+            missing.add(location)
+        links.extend({'exam_id': exam_id, 'classroom_id': classroom_id} for classroom_id in classroom_ids)
+    if links:
+        db.session.execute(exam_classrooms.insert(), links)
+        linked += len(links)
+
+    db.session.commit()
+    return linked, sorted(missing)
+
+
+# ORM 写入：地点变化且未显式指定教室时，flush 前按地点解析教室
+
+@event.listens_for(Session, 'before_flush')
+def _resolve_locations(session, flush_context, instances):
+    pending = []
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Schedule):
+            state = inspect(obj)
+            if state.attrs.location.history.has_changes() and not state.attrs.classroom_id.history.has_changes() \
+                    and not state.attrs.classroom.history.has_changes():
+                pending.append(obj)
+        elif isinstance(obj, Exam):
+            state = inspect(obj)
+            if state.attrs.location.history.has_changes() and not state.attrs.classrooms.history.has_changes():
+                pending.append(obj)
+    if not pending:
+        return
+
+    with session.no_autoflush:
+        numbers = {number.upper() for obj in pending for number in room_numbers(obj.location)}
+        rooms = {room.room_number.upper(): room for room in session.query(Classroom).filter(
+            db.func.upper(Classroom.room_number).in_(numbers))} if numbers else {}
+        for obj in pending:
+            matched = [rooms[number.upper()] for number in room_numbers(obj.location) if number.upper() in rooms]
+            if isinstance(obj, Schedule):
+                obj.classroom = matched[0] if len(matched) == 1 else None
+            else:
+                obj.classrooms = matched
@@ -0,0 +1,197 @@
+# services/selection.py
+"""选课/退课引擎：重复、冲突、学分和容量检查与写入在同一个事务内完成，并发安全
+
+事务开始即获取写锁：SQLite 使用 BEGIN IMMEDIATE，其他数据库对学生行 SELECT ... FOR UPDATE。
+同一学生的选课请求因此串行执行，学分合计（User.selected_credits）和课程已选人数
+（Course.enrolled_count）通过带条件的 UPDATE 原子增减，不会超过上限。
+锁在超时时间内拿不到时返回“系统繁忙，请稍后重试”。
+"""
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, User, Course, SelectedCourse
+from services.conflict import course_conflicts
+from services.transactions import begin_write, is_busy, BUSY_MESSAGE
+
+CREDIT_LIMIT = 30  # 学分上限
+
+
+def _student_row(student_id):
+    """写事务中需要锁定的学生行（同一学生的请求串行执行）"""
+    return db.session.query(User.id).filter_by(id=student_id)
+
+
+def _execute(statement):
+    """执行 UPDATE/DELETE 并返回受影响的行数"""
+    result = db.session.execute(statement, execution_options={'synchronize_session': False})
+    return result.rowcount
+
+
+class SelectionRejected(Exception):
+    """选课/退课不满足条件（信息用于返回给学生）"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def _apply_select(student_id, course_id):
+    """在当前事务内执行选课的检查与写入（不提交）"""
+    course = db.session.get(Course, course_id)
+    if not course:
+        raise SelectionRejected('课程不存在')
+
+    if SelectedCourse.query.filter_by(student_id=student_id, course_id=course_id).first():
+        raise SelectionRejected('已选择该课程')
+
+    if course_conflicts(student_id, course_id):
+        raise SelectionRejected('课程时间冲突')
+
+    # 学分：合计加上本课程学分不超过上限时才增加
+    credit = course.credit or 0
+    if not _execute(db.update(User).where(
+            User.id == student_id,
+            User.selected_credits + credit <= CREDIT_LIMIT
+    ).values(selected_credits=User.selected_credits + credit)):
+        raise SelectionRejected('超过学分限制')
+
+    # 容量：未满时才增加已选人数
+    if not _execute(db.update(Course).where(
+            Course.id == course_id,
+            db.or_(Course.capacity.is_(None), Course.enrolled_count < Course.capacity)
+    ).values(enrolled_count=Course.enrolled_count + 1)):
+        raise SelectionRejected('课程人数已满')
+
+    db.session.add(SelectedCourse(
+        student_id=student_id,
+        course_id=course_id,
+        selected_at=datetime.now()
+    ))
+    db.session.flush()
+    return '选课成功'
+
+
+def _apply_drop(student_id, course_id):
+    """在当前事务内执行退课的写入（不提交）"""
+    course = db.session.get(Course, course_id)
+    deleted = _execute(db.delete(SelectedCourse).where(
+        SelectedCourse.student_id == student_id,
+        SelectedCourse.course_id == course_id
+    ))
+    if not deleted or not course:
+        raise SelectionRejected('未找到选课记录')
+
+    _execute(db.update(User).where(User.id == student_id).values(
+        selected_credits=User.selected_credits - (course.credit or 0)
+    ))
+    _execute(db.update(Course).where(Course.id == course_id, Course.enrolled_count > 0).values(
+        enrolled_count=Course.enrolled_count - 1
+    ))
+    return '退课成功'
+
+
+OPERATIONS = {
+    'select': _apply_select,
+    'drop': _apply_drop,
+}
+
+
+def run_operation(operation, student_id, course_id):
+    """单个操作独立成一个事务，返回 (是否成功, 提示信息)"""
+    try:
+        begin_write(_student_row(student_id))
+        message = OPERATIONS[operation](student_id, course_id)
+        db.session.commit()
+        return True, message
+
+    except SelectionRejected as e:
+        db.session.rollback()
+        return False, e.message
+    except IntegrityError:
+        # 唯一约束兜底：并发重复选课
+        db.session.rollback()
+        return False, '已选择该课程'
+    except OperationalError as e:
+        # 写锁等待超时：告知学生稍后重试，而不是返回 500
+        db.session.rollback()
+        if is_busy(e):
+            return False, BUSY_MESSAGE
+        raise
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def select_course(student_id, course_id):
+    """学生选课，返回 (是否成功, 提示信息)"""
+    return run_operation('select', student_id, course_id)
+
+
+def drop_course(student_id, course_id):
+    """学生退课，返回 (是否成功, 提示信息)"""
+    return run_operation('drop', student_id, course_id)
+
+
+def apply_batch(operations):
+    """在一个事务内依次执行一批 (操作, 学生ID, 课程ID)，每个操作用保存点隔离，
+    单个失败只回滚自身。返回与输入顺序一致的 (是否成功, 提示信息) 列表"""
+    results = []
+    try:
+        for operation, student_id, course_id in operations:
+            begin_write(_student_row(student_id))
+            try:
+                with db.session.begin_nested():
+                    message = OPERATIONS[operation](student_id, course_id)
+                results.append((True, message))
+            except SelectionRejected as e:
+                results.append((False, e.message))
+            except IntegrityError:
+                results.append((False, '已选择该课程'))
+        db.session.commit()
+        return results
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def rebuild_counters():
+    """按选课记录重新计算所有学生的已选学分和所有课程的已选人数"""
+    credits = db.select(db.func.coalesce(db.func.sum(Course.credit), 0)).select_from(SelectedCourse).join(
+        Course, Course.id == SelectedCourse.course_id
+    ).where(SelectedCourse.student_id == User.id).scalar_subquery()
+    enrolled = db.select(db.func.count(SelectedCourse.id)).where(
+        SelectedCourse.course_id == Course.id
+    ).scalar_subquery()
+
+    _execute(db.update(User).values(selected_credits=credits))
+    _execute(db.update(Course).values(enrolled_count=enrolled))
+    db.session.commit()
+
+
+def check_invariants():
+    """校验冗余计数与选课记录一致，返回不一致的描述列表"""
+    problems = []
+
+    credit_rows = db.session.query(
+        User.id, User.selected_credits, db.func.coalesce(db.func.sum(Course.credit), 0)
+    ).outerjoin(SelectedCourse, SelectedCourse.student_id == User.id).outerjoin(
+        Course, Course.id == SelectedCourse.course_id
+    ).filter(User.role == 'student').group_by(User.id, User.selected_credits).all()
+    for student_id, stored, actual in credit_rows:
+        if stored != actual:
+            problems.append(f'学生 {student_id} 学分合计 {stored} != 实际 {actual}')
+        if actual > CREDIT_LIMIT:
+            problems.append(f'学生 {student_id} 已选 {actual} 学分，超过上限 {CREDIT_LIMIT}')
+
+    course_rows = db.session.query(
+        Course.id, Course.enrolled_count, Course.capacity, db.func.count(SelectedCourse.id)
+    ).outerjoin(SelectedCourse, SelectedCourse.course_id == Course.id).group_by(
+        Course.id, Course.enrolled_count, Course.capacity
+    ).all()
+    for course_id, stored, capacity, actual in course_rows:
+        if stored != actual:
+            problems.append(f'课程 {course_id} 已选人数 {stored} != 实际 {actual}')
+        if capacity is not None and actual > capacity:
+            problems.append(f'课程 {course_id} 已选 {actual} 人，超过容量 {capacity}')
+
+    return problems
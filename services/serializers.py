@@ -0,0 +1,60 @@
+# services/serializers.py
+"""批量序列化：在固定次数的查询内预加载 to_dict() 用到的全部关联，避免逐行懒加载（N+1）"""
+from sqlalchemy.orm import Query, selectinload
+from models import Schedule, Exam, LeaveApplication, ClassroomBooking, Announcement, CourseMaterial, \
+    SelectedCourse, Grade, AcademicAlert, CounselingRecord, Course, User
+
+# 单次 IN 查询的主键数量上限（与 selectinload 的批大小一致）
+PRELOAD_CHUNK_SIZE = 500
+
+# 各模型 to_dict() 访问的关联路径
+SERIALIZER_LOADS = {
+    Schedule: lambda: [selectinload(Schedule.course), selectinload(Schedule.teacher)],
+    Exam: lambda: [selectinload(Exam.course)],
+    LeaveApplication: lambda: [selectinload(LeaveApplication.student)],
+    ClassroomBooking: lambda: [selectinload(ClassroomBooking.student), selectinload(ClassroomBooking.classroom)],
+    Announcement: lambda: [selectinload(Announcement.course), selectinload(Announcement.teacher)],
+    CourseMaterial: lambda: [selectinload(CourseMaterial.course)],
+    SelectedCourse: lambda: [selectinload(SelectedCourse.student),
+                             selectinload(SelectedCourse.course).selectinload(Course.teacher)],
+    Grade: lambda: [selectinload(Grade.course), selectinload(Grade.teacher)],
+    AcademicAlert: lambda: [selectinload(AcademicAlert.student).selectinload(User.class_info),
+                            selectinload(AcademicAlert.courses)],
+    CounselingRecord: lambda: [selectinload(CounselingRecord.alert).selectinload(AcademicAlert.student)],
+}
+
+
+def loader_options(model):
+    """返回模型序列化所需的预加载选项"""
+    loads = SERIALIZER_LOADS.get(model)
+    return loads() if loads else []
+
+
+def with_serializer_loads(query):
+    """为查询附加序列化所需的预加载选项"""
+    return query.options(*loader_options(query.column_descriptions[0]['entity']))
+
+
+def preload(rows):
+    """为已加载的 ORM 对象批量预加载关联（每层关联一次 IN 查询）"""
+    if not rows:
+        return rows
+
+    model = type(rows[0])
+    options = loader_options(model)
+    if options:
+        ids = [row.id for row in rows]
+        # 对象已在会话的标识映射中，重新查询只会填充尚未加载的关联
+        for i in range(0, len(ids), PRELOAD_CHUNK_SIZE):
+            chunk = ids[i:i + PRELOAD_CHUNK_SIZE]
+            model.query.filter(model.id.in_(chunk)).options(*options).all()
+    return rows
+
+
+def serialize(rows_or_query):
+    """批量调用 to_dict()，参数可以是查询对象或 ORM 对象列表"""
+    if isinstance(rows_or_query, Query):
+        rows = with_serializer_loads(rows_or_query).all()
+    else:
+        rows = preload(list(rows_or_query))
+    return [row.to_dict() for row in rows]
@@ -0,0 +1,87 @@
+# services/timetable.py
+"""周课表服务：按 (班级, ISO周) 预先分组并缓存，课表变更提交后自动失效
+
+课表中还显示课程名称、代码和教师姓名，这些列修改提交后清空全部缓存课表（改名不频繁）。
+"""
+import hashlib
+import json
+from datetime import date, timedelta
+from sqlalchemy import inspect
+from models import Schedule, Course, User
+from services.cache import TTLCache, column_values, invalidate_on_commit
+from services.serializers import serialize
+
+WEEKDAY_NAMES = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+# 键为 (class_id, iso_year, iso_week)
+timetable_cache = TTLCache(maxsize=2048, ttl=600)
+
+
+def iso_week_of(week_offset=0, today=None):
+    """相对本周偏移 week_offset 周后的 ISO 年份和周次"""
+    target = (today or date.today()) + timedelta(weeks=week_offset)
+    iso_year, iso_week, _ = target.isocalendar()
+    return iso_year, iso_week
+
+
+def build_timetable(class_id, iso_year, iso_week):
+    """查询班级课表并按星期分组，附带每天的日期和内容指纹（ETag）"""
+    start_of_week = date.fromisocalendar(iso_year, iso_week, 1)
+    schedules = serialize(Schedule.query.filter_by(class_id=class_id).order_by(
+        Schedule.day_of_week, Schedule.start_time))
+
+    days = {}
+    for day_of_week in range(1, 8):
+        days[day_of_week] = {
+            'date': (start_of_week + timedelta(days=day_of_week - 1)).strftime('%Y-%m-%d'),
+            'weekday': WEEKDAY_NAMES[day_of_week - 1],
+            'schedules': []
+        }
+    for schedule in schedules:
+        days[schedule['day_of_week']]['schedules'].append(schedule)
+
+    data = {
+        'class_id': class_id,
+        'iso_year': iso_year,
+        'iso_week': iso_week,
+        'start_of_week': start_of_week.strftime('%Y-%m-%d'),
+        'end_of_week': (start_of_week + timedelta(days=6)).strftime('%Y-%m-%d'),
+        'days': days
+    }
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return {
+        'data': data,
+        'etag': hashlib.md5(payload.encode('utf-8')).hexdigest()
+    }
+
+
+def get_timetable(class_id, iso_year, iso_week):
+    """获取周课表（优先读缓存），返回 {'data': ..., 'etag': ...}"""
+    key = (class_id, iso_year, iso_week)
+    return timetable_cache.get_or_create(key, lambda: build_timetable(*key))
+
+
+def invalidate_classes(class_ids):
+    """清除指定班级所有周的缓存课表"""
+    class_ids = set(class_ids)
+    return timetable_cache.invalidate(lambda key: key[0] in class_ids)
+
+
+def invalidate_all(*args):
+    """清除全部缓存课表"""
+    timetable_cache.clear()
+
+
+def changed_columns(*names):
+    """返回 keys_of：对象的 names 列有修改时返回 {对象ID}，否则为空"""
+    def keys_of(target):
+        attrs = inspect(target).attrs
+        return {target.id} if any(attrs[name].history.has_changes() for name in names) else set()
+    return keys_of
+
+
+# Schedule 行变更提交后，失效新旧班级的课表缓存
+invalidate_on_commit(Schedule, lambda schedule: column_values(schedule, 'class_id'), invalidate_classes)
+# 课表中显示的课程名称、代码和教师姓名修改提交后，失效全部课表缓存
+invalidate_on_commit(Course, changed_columns('course_name', 'course_code'), invalidate_all)
+invalidate_on_commit(User, changed_columns('real_name'), invalidate_all)
@@ -0,0 +1,29 @@
+# services/transactions.py
+"""写事务的公共部分：事务开始即获取写锁，锁等待超时统一识别为“系统繁忙”
+
+SQLite 使用 BEGIN IMMEDIATE 获取数据库写锁，其他数据库对 lock_query 选中的行 SELECT ... FOR UPDATE。
+锁在超时时间内没有拿到时驱动抛出 OperationalError（SQLite 为 database is locked），
+调用方用 is_busy 识别后向用户返回 BUSY_MESSAGE，而不是 500。
+"""
+from sqlalchemy.exc import OperationalError
+from models import db
+
+BUSY_MESSAGE = '系统繁忙，请稍后重试'
+
+
+def begin_write(lock_query=None):
+    """开启写事务并获取写锁，lock_query 为非 SQLite 数据库上需要锁定的行的查询"""
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+    elif lock_query is not None:
+        lock_query.with_for_update().all()
+
+
+def is_busy(error):
+    """是否为锁等待超时或死锁（SQLite database is locked/busy，其他数据库的锁超时、死锁）"""
+    if not isinstance(error, OperationalError):
+        return False
+    message = str(error.orig).lower()
+    return 'lock' in message or 'busy' in message
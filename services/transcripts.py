@@ -0,0 +1,156 @@
+# services/transcripts.py
+"""学生成绩单：每名学生每学期一行，另有一行累计（学分加权绩点、已获学分、不及格门数）
+
+计入成绩单的是各课程的期末成绩。成绩或课程学分变化时，在同一事务内用一条分组 INSERT ... SELECT
+重算受影响学生的成绩单（与全量重建共用同一条 SQL），读取时只需按学生取一行。
+
+- ORM 写入（Grade 增删改、Course.credit 修改）由会话的 before_flush/after_flush 事件自动维护；
+- 批量写入（services/grades.py）显式调用 refresh_transcripts；
+- rebuild_transcripts 一条集合 SQL 重建全部学生的成绩单。
+"""
+from datetime import datetime
+from sqlalchemy import event, inspect, literal, union_all
+from sqlalchemy.orm import Session
+from models import db, Course, Grade, StudentTranscript
+from services.grade_stats import PASS_SCORE
+
+TRANSCRIPT_EXAM_TYPE = '期末'  # 计入成绩单的考试类型
+UNKNOWN_TERM = '未分学期'  # 未填写学年的成绩归入此学期，避免与累计行混淆
+GRADE_FIELDS = ('student_id', 'course_id', 'score', 'grade_point', 'exam_type', 'academic_year', 'semester')
+
+transcript_table = StudentTranscript.__table__
+
+
+def _transcript_select(now, student_ids=None, cumulative=False):
+    """按学生（及学期）分组汇总期末成绩的查询"""
+    credit = db.func.coalesce(Course.credit, 0)
+    weighted = Grade.grade_point.isnot(None)
+    passed = Grade.score >= PASS_SCORE
+    gpa_credits = db.func.sum(db.case((weighted, credit), else_=0))
+    quality_points = db.func.sum(db.case((weighted, credit * Grade.grade_point), else_=0))
+
+    if cumulative:
+        academic_year, semester = literal(''), literal('')
+    else:
+        academic_year = db.func.coalesce(db.func.nullif(Grade.academic_year, ''), UNKNOWN_TERM)
+        semester = db.func.coalesce(Grade.semester, '')
+
+    query = db.select(
+        Grade.student_id,
+        academic_year,
+        semester,
+        db.func.count(Grade.id),
+        db.func.sum(credit),
+        gpa_credits,
+        quality_points,
+        db.case((gpa_credits > 0, quality_points * 1.0 / gpa_credits), else_=None),
+        db.func.sum(db.case((passed, credit), else_=0)),
+        db.func.sum(db.case((passed, 0), else_=1)),
+        literal(now, db.DateTime)
+    ).join(Course, Course.id == Grade.course_id).where(
+        Grade.exam_type == TRANSCRIPT_EXAM_TYPE, Grade.score.isnot(None)
+    )
+    if student_ids is not None:
+        query = query.where(Grade.student_id.in_(student_ids))
+    if cumulative:
+        return query.group_by(Grade.student_id)
+    return query.group_by(Grade.student_id, academic_year, semester)
+
+
+def _insert_transcripts(connection, student_ids=None):
+    columns = ['student_id', 'academic_year', 'semester', 'course_count', 'total_credits', 'gpa_credits',
+               'quality_points', 'gpa', 'earned_credits', 'failed_count', 'updated_at']
+    now = datetime.utcnow()
+    source = union_all(_transcript_select(now, student_ids), _transcript_select(now, student_ids, cumulative=True))
+    return connection.execute(transcript_table.insert().from_select(columns, source)).rowcount
+
+
+def refresh_transcripts(student_ids, connection=None):
+    """在当前事务内重算指定学生的成绩单"""
+    student_ids = list({student_id for student_id in student_ids if student_id is not None})
+    if not student_ids:
+        return 0
+    connection = connection or db.session.connection()
+    connection.execute(transcript_table.delete().where(transcript_table.c.student_id.in_(student_ids)))
+    return _insert_transcripts(connection, student_ids)
+
+
+def refresh_course_transcripts(course_ids, connection=None):
+    """课程成绩整体变化（改评分标准、改学分、提交成绩）后重算该课程学生的成绩单"""
+    connection = connection or db.session.connection()
+    student_ids = connection.execute(
+        db.select(Grade.student_id).where(Grade.course_id.in_(list(course_ids))).distinct()
+    ).scalars().all()
+    return refresh_transcripts(student_ids, connection)
+
+
+def rebuild_transcripts():
+    """按成绩表重建全部学生的成绩单"""
+    connection = db.session.connection()
+    connection.execute(transcript_table.delete())
+    count = _insert_transcripts(connection)
+    db.session.commit()
+    return count
+
+
+def get_transcript(student_id):
+    """学生成绩单：返回 (累计行, 按学期排列的各学期行)，尚无成绩时累计行为 None"""
+    rows = StudentTranscript.query.filter_by(student_id=student_id).order_by(
+        StudentTranscript.academic_year, StudentTranscript.semester
+    ).all()
+    cumulative = next((row for row in rows if row.is_cumulative), None)
+    return cumulative, [row for row in rows if not row.is_cumulative]
+
+
+def get_cumulative_transcripts(student_ids):
+    """一次查询取出一组学生的累计成绩单，返回 {student_id: StudentTranscript}"""
+    if not student_ids:
+        return {}
+    rows = StudentTranscript.query.filter(
+        StudentTranscript.student_id.in_(list(student_ids)),
+        StudentTranscript.academic_year == '', StudentTranscript.semester == ''
+    ).all()
+    return {row.student_id: row for row in rows}
+
+
+# ORM 写入：flush 前记录受影响的学生和课程，flush 后在同一事务内重算
+
+@event.listens_for(Session, 'before_flush')
+def _collect_transcript_changes(session, flush_context, instances):
+    pending = session.info.setdefault('transcript_pending', {'students': set(), 'courses': set(), 'new': []})
+
+    # 新成绩可能通过关系赋值学生，student_id 要到 flush 后才确定
+    pending['new'].extend(obj for obj in session.new if isinstance(obj, Grade))
+    for obj in session.deleted:
+        if isinstance(obj, Grade):
+            pending['students'].add(obj.student_id)
+
+    for obj in session.dirty:
+        if isinstance(obj, Grade) and session.is_modified(obj):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in GRADE_FIELDS):
+                pending['students'].add(obj.student_id)
+                pending['students'].update(state.attrs.student_id.history.deleted)
+        elif isinstance(obj, Course) and obj.id is not None and \
+                inspect(obj).attrs.credit.history.has_changes():
+            pending['courses'].add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_transcript_changes(session, flush_context):
+    pending = session.info.pop('transcript_pending', None)
+    if not pending:
+        return
+    pending['students'].update(grade.student_id for grade in pending['new'])
+    if not (pending['students'] or pending['courses']):
+        return
+    connection = session.connection()
+    if pending['courses']:
+        refresh_course_transcripts(pending['courses'], connection)
+    if pending['students']:
+        refresh_transcripts(pending['students'], connection)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_transcript_changes(session):
+    session.info.pop('transcript_pending', None)
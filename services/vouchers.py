@@ -0,0 +1,236 @@
+# services/vouchers.py
+"""教室借用凭证：批准时签发，凭证内容是一个签名令牌，门卫扫码核验时不需要访问数据库
+
+- 令牌为 base64url(借用ID|教室ID|日期|开始|结束|教室编号) + "." + base64url(HMAC-SHA256)，密钥为 SECRET_KEY；
+- 凭证文件以令牌摘要命名存放在 uploads/qrcodes，同一令牌只生成一次，之后直接从磁盘返回；
+  安装了 reportlab 时生成带二维码的 PDF，否则生成文本凭证；安装了 qrcode 时另存二维码 PNG；
+- 无状态核验只能证明凭证由本系统签发且在借用时段内，批准后被取消的借用无法在核验时发现。
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple
+from models import db, User, Classroom, ClassroomBooking
+
+VOUCHER_DIR = 'qrcodes'  # UPLOAD_FOLDER 下存放凭证文件的目录
+
+
+class VoucherClaims(NamedTuple):
+    """令牌中签名的借用信息"""
+    booking_id: int
+    classroom_id: int
+    booking_date: date
+    start_time: time
+    end_time: time
+    room_number: str
+
+    def to_dict(self):
+        return {
+            'booking_id': self.booking_id,
+            'classroom_id': self.classroom_id,
+            'room_number': self.room_number,
+            'booking_date': self.booking_date.isoformat(),
+            'start_time': self.start_time.strftime('%H:%M'),
+            'end_time': self.end_time.strftime('%H:%M')
+        }
+
+
+class VoucherDetails(NamedTuple):
+    """生成凭证文件所需的借用信息"""
+    claims: VoucherClaims
+    student_id: int
+    student_name: str
+    building: str
+    purpose: str
+    participants: int
+    status: str
+    qr_code_path: str
+
+
+class InvalidVoucher(Exception):
+    """凭证无效（claims 在签名有效但不在使用时段时给出）"""
+
+    def __init__(self, message, claims=None):
+        super().__init__(message)
+        self.message = message
+        self.claims = claims
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signature(payload, secret):
+    return hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).digest()
+
+
+def sign_voucher(claims, secret):
+    """签发令牌"""
+    payload = '|'.join([
+        str(claims.booking_id), str(claims.classroom_id), claims.booking_date.strftime('%Y%m%d'),
+        claims.start_time.strftime('%H%M'), claims.end_time.strftime('%H%M'), claims.room_number
+    ]).encode('utf-8')
+    return f'{_b64encode(payload)}.{_b64encode(_signature(payload, secret))}'
+
+
+def verify_voucher(token, secret):
+    """校验令牌签名，返回 VoucherClaims"""
+    try:
+        encoded_payload, encoded_signature = token.split('.')
+        payload, signature = _b64decode(encoded_payload), _b64decode(encoded_signature)
+    except ValueError:
+        raise InvalidVoucher('凭证格式错误')
+    if not hmac.compare_digest(signature, _signature(payload, secret)):
+        raise InvalidVoucher('凭证签名无效')
+
+    booking_id, classroom_id, booking_date, start_time, end_time, room_number = \
+        payload.decode('utf-8').split('|', 5)
+    return VoucherClaims(int(booking_id), int(classroom_id), datetime.strptime(booking_date, '%Y%m%d').date(),
+                         datetime.strptime(start_time, '%H%M').time(), datetime.strptime(end_time, '%H%M').time(),
+                         room_number)
+
+
+def check_window(claims, now, grace_minutes):
+    """核验时间是否在借用时段内（前后各放宽 grace_minutes 分钟）"""
+    grace = timedelta(minutes=grace_minutes)
+    if now < datetime.combine(claims.booking_date, claims.start_time) - grace:
+        raise InvalidVoucher('未到借用时间', claims)
+    if now > datetime.combine(claims.booking_date, claims.end_time) + grace:
+        raise InvalidVoucher('借用时间已过', claims)
+
+
+def load_voucher_details(booking_ids):
+    """借用的凭证信息（一次联表查询），返回 {借用ID: VoucherDetails}"""
+    if not booking_ids:
+        return {}
+    rows = db.session.query(
+        ClassroomBooking.id, ClassroomBooking.classroom_id, ClassroomBooking.booking_date,
+        ClassroomBooking.start_time, ClassroomBooking.end_time, Classroom.room_number,
+        ClassroomBooking.student_id, User.real_name, Classroom.building, ClassroomBooking.purpose,
+        ClassroomBooking.participants, ClassroomBooking.status, ClassroomBooking.qr_code_path
+    ).join(Classroom, Classroom.id == ClassroomBooking.classroom_id) \
+        .join(User, User.id == ClassroomBooking.student_id) \
+        .filter(ClassroomBooking.id.in_(booking_ids))
+    return {row[0]: VoucherDetails(VoucherClaims(*row[:6]), *row[6:]) for row in rows}
+
+
+def _voucher_lines(details):
+    claims = details.claims
+    return [
+        f'学生姓名：{details.student_name}',
+        f'教室编号：{claims.room_number}',
+        f'教学楼：{details.building}',
+        f"借用日期：{claims.booking_date.strftime('%Y年%m月%d日')}",
+        f"借用时间：{claims.start_time.strftime('%H:%M')} - {claims.end_time.strftime('%H:%M')}",
+        f'借用事由：{details.purpose}',
+        f'参与人数：{details.participants}',
+        '审批状态：已批准',
+    ]
+
+
+def _write_text(path, details, qr_data):
+    lines = ['教室借用凭证', '=' * 20, ''] + _voucher_lines(details) + [
+        '', '核验地址（门卫扫码或打开此地址核验）：', qr_data, '',
+        '请凭此凭证使用教室，使用时请遵守教室使用规定。']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _write_pdf(path, details, qr_data):
+    from reportlab.graphics import renderPDF
+    from reportlab.graphics.barcode.qr import QrCodeWidget
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.lib.pagesizes import A5
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.pdfgen import canvas
+
+    pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
+    width, height = A5
+    pdf = canvas.Canvas(path, pagesize=A5)
+    pdf.setFont('STSong-Light', 18)
+    pdf.drawCentredString(width / 2, height - 25 * mm, '教室借用凭证')
+    pdf.setFont('STSong-Light', 11)
+    y = height - 40 * mm
+    for line in _voucher_lines(details):
+        pdf.drawString(20 * mm, y, line)
+        y -= 8 * mm
+
+    widget = QrCodeWidget(qr_data)
+    x1, y1, x2, y2 = widget.getBounds()
+    size = 50 * mm
+    drawing = Drawing(size, size, transform=[size / (x2 - x1), 0, 0, size / (y2 - y1), 0, 0])
+    drawing.add(widget)
+    renderPDF.draw(drawing, pdf, (width - size) / 2, 25 * mm)
+    pdf.setFont('STSong-Light', 9)
+    pdf.drawCentredString(width / 2, 18 * mm, '请凭此凭证使用教室，门卫扫码核验')
+    pdf.save()
+
+
+def _write_qr_png(path, qr_data):
+    import qrcode
+    qrcode.make(qr_data).save(path)
+
+
+def _write_once(path, writer, *args):
+    """先写临时文件再原子替换，并发生成同一凭证时不会读到半个文件"""
+    if os.path.exists(path):
+        return
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        writer(temp_path, *args)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def ensure_voucher(details, secret, upload_folder, checkin_url):
+    """生成凭证文件（已存在则直接使用），返回相对 upload_folder 的路径
+
+    checkin_url(token) 返回二维码中的核验地址。
+    """
+    token = sign_voucher(details.claims, secret)
+    stem = os.path.join(VOUCHER_DIR, hashlib.sha256(token.encode('ascii')).hexdigest()[:32])
+    base = os.path.join(upload_folder, stem)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+
+    # 已生成的文件（按令牌命名，借用的教室或时段变化后令牌随之变化）
+    for suffix in ('.pdf', '.txt'):
+        if os.path.exists(base + suffix):
+            return stem + suffix
+
+    qr_data = checkin_url(token)
+    try:
+        _write_once(base + '.png', _write_qr_png, qr_data)
+    except ImportError:
+        pass
+    try:
+        _write_once(base + '.pdf', _write_pdf, details, qr_data)
+        return stem + '.pdf'
+    except ImportError:
+        _write_once(base + '.txt', _write_text, details, qr_data)
+        return stem + '.txt'
+
+
+def issue_vouchers(details, secret, upload_folder, checkin_url):
+    """为已批准的借用生成凭证并记录到 qr_code_path，返回 {借用ID: 相对路径}"""
+    paths, updates = {}, []
+    for item in details:
+        if item.status != 'approved':
+            continue
+        path = paths[item.claims.booking_id] = ensure_voucher(item, secret, upload_folder, checkin_url)
+        if path != item.qr_code_path:
+            updates.append({'id': item.claims.booking_id, 'qr_code_path': path})
+    if updates:
+        db.session.bulk_update_mappings(ClassroomBooking, updates)
+        db.session.commit()
+    return paths
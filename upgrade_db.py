@@ -0,0 +1,342 @@
+# upgrade_db.py
+"""在已有数据库上执行结构升级（补建缺失的表、列和索引，回填冗余数据）。
+
+默认不删除任何数据：建成绩 (学生, 课程) 唯一索引前发现的重复成绩只列出，并跳过该索引，
+确认后加 --dedupe-grades 删除重复成绩（保留 updated_at 最新的一条）再建索引。
+
+用法：
+    python upgrade_db.py            # 升级数据库并输出查询计划报告
+    python upgrade_db.py --explain  # 只输出查询计划报告
+    python upgrade_db.py --rebuild  # 升级后按源数据重建全部冗余数据（计数、成绩统计、成绩单）
+    python upgrade_db.py --dedupe-grades  # 升级时删除重复成绩并建立成绩唯一索引
+"""
+import sys
+from datetime import datetime, date, timedelta
+from sqlalchemy import inspect
+from app import create_app
+from models import db, User, Course, Schedule, Exam, LeaveApplication, ClassroomBooking, Announcement, \
+    CourseMaterial, SelectedCourse, Grade, AcademicAlert, CounselingRecord, Classroom, alert_failed_courses, \
+    exam_classrooms
+
+
+def create_missing_tables():
+    """创建模型中新增、数据库中尚不存在的表（create_all 只会补建缺失的表）"""
+    existing = set(inspect(db.engine).get_table_names())
+    missing = [t.name for t in db.metadata.tables.values() if t.name not in existing]
+    db.create_all()
+    for name in missing:
+        print(f"创建表: {name}")
+    return missing
+
+
+def add_missing_columns():
+    """为已有表补加模型中新增的列（ALTER TABLE ... ADD COLUMN）"""
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.tables.values():
+        if table.name not in existing_tables:
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = (f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                   f"{column.type.compile(dialect=db.engine.dialect)}")
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            print(f"添加列: {table.name}.{column.name}")
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(ddl)
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def backfill_selection_counters():
+    from services.selection import rebuild_counters
+    rebuild_counters()
+
+
+def backfill_grade_stats():
+    from services.grade_stats import rebuild_stats
+    rebuild_stats()
+
+
+def backfill_transcripts():
+    from services.transcripts import rebuild_transcripts
+    rebuild_transcripts()
+
+
+def backfill_alert_courses():
+    from services.alerts import link_failed_courses
+    linked, missing = link_failed_courses()
+    print(f"关联预警挂科课程: {linked} 条")
+    if missing:
+        print(f"未找到对应课程的名称: {', '.join(missing)}")
+
+
+def backfill_room_links():
+    from services.rooms import link_locations
+    linked, missing = link_locations()
+    print(f"关联课表和考试的教室: {linked} 条")
+    if missing:
+        print(f"未找到对应教室的地点: {', '.join(missing)}")
+
+
+# 新增冗余列/表后需要执行的数据回填：(触发的列或表, 回填函数, 说明)
+BACKFILLS = [
+    ({'users.selected_credits', 'courses.enrolled_count'}, backfill_selection_counters, '选课学分与人数计数'),
+    ({'course_grade_stats'}, backfill_grade_stats, '课程成绩统计摘要'),
+    ({'student_transcripts'}, backfill_transcripts, '学生成绩单'),
+    ({'alert_failed_courses'}, backfill_alert_courses, '预警挂科课程关联'),
+    ({'schedules.classroom_id', 'exam_classrooms'}, backfill_room_links, '课表与考试的教室关联'),
+]
+
+
+def run_backfills(changes):
+    """对本次新增的列/表执行相应的数据回填"""
+    for triggers, backfill, description in BACKFILLS:
+        if triggers & set(changes):
+            print(f"回填数据: {description}")
+            backfill()
+
+
+def rebuild_derived_data():
+    """按源数据重建全部冗余数据（每项一条集合 SQL 或一次遍历）"""
+    for _, backfill, description in BACKFILLS:
+        print(f"重建数据: {description}")
+        backfill()
+
+
+def duplicate_grades():
+    """同一 (学生, 课程) 中除最新一条（按 updated_at，其次按 id）以外的成绩"""
+    rank = db.func.row_number().over(
+        partition_by=(Grade.student_id, Grade.course_id),
+        order_by=(Grade.updated_at.desc(), Grade.id.desc())
+    ).label('rank')
+    ranked = db.session.query(Grade.id, rank).subquery()
+    return Grade.query.join(ranked, ranked.c.id == Grade.id).filter(ranked.c.rank > 1).order_by(
+        Grade.student_id, Grade.course_id, Grade.id
+    ).all()
+
+
+def fill_exam_types():
+    """补全旧数据中为空的考试类型（已有表的 exam_type 列无法改为 NOT NULL，应用写入时总会给出考试类型）"""
+    from services.grades import DEFAULT_EXAM_TYPE
+    grades = Grade.__table__
+    filled = db.session.execute(grades.update().where(grades.c.exam_type.is_(None)).values(
+        exam_type=DEFAULT_EXAM_TYPE, updated_at=grades.c.updated_at  # 不改动 updated_at
+    )).rowcount
+    db.session.commit()
+    if filled:
+        print(f"补全考试类型: {filled} 条")
+
+
+def dedupe_grades():
+    """列出重复成绩；指定 --dedupe-grades 时删除并重算成绩统计和成绩单，返回能否建唯一索引
+
+    没有重复成绩后补全空的考试类型（先补全可能与旧的 (学生, 课程, 考试类型) 唯一索引冲突）。
+    """
+    duplicates = duplicate_grades()
+    if duplicates:
+        print(f"重复成绩 {len(duplicates)} 条（同一学生、课程保留 updated_at 最新的一条）:")
+        for grade in duplicates:
+            print(f"    id={grade.id} student_id={grade.student_id} course_id={grade.course_id} "
+                  f"exam_type={grade.exam_type} score={grade.score} updated_at={grade.updated_at}")
+        if '--dedupe-grades' not in sys.argv:
+            print("未删除，确认后使用 --dedupe-grades 删除以上成绩并建立唯一索引")
+            return False
+
+        from services.transcripts import refresh_transcripts
+        Grade.query.filter(Grade.id.in_([grade.id for grade in duplicates])).delete(synchronize_session=False)
+        refresh_transcripts({grade.student_id for grade in duplicates})
+        db.session.commit()
+        print(f"删除重复成绩: {len(duplicates)} 条")
+        backfill_grade_stats()
+    fill_exam_types()
+    return True
+
+
+# 建唯一索引前需要先清理的数据：索引名 -> (清理函数, 说明)，清理函数返回 False 时跳过该索引
+INDEX_PREPARES = {
+    'uq_grades_student_course': (dedupe_grades, '成绩去重'),
+}
+
+# 已被取代的旧索引：索引名 -> (表名, 取代它的索引名)，取代的索引建成后才删除
+OBSOLETE_INDEXES = {
+    'uq_grades_student_course_exam': ('grades', 'uq_grades_student_course'),
+}
+
+
+def create_missing_indexes():
+    """为已有表补建模型中声明的索引"""
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.tables.values():
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name in INDEX_PREPARES:
+                prepare, description = INDEX_PREPARES[index.name]
+                print(f"清理数据: {description}")
+                if not prepare():
+                    print(f"跳过索引: {index.name}")
+                    continue
+            print(f"创建索引: {index.name} ON {table.name} "
+                  f"({', '.join(col.name for col in index.columns)})")
+            index.create(bind=db.engine, checkfirst=True)
+            created.append(index.name)
+    return created
+
+
+def drop_obsolete_indexes():
+    """删除已被取代的旧索引"""
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    dropped = []
+    for name, (table_name, replaced_by) in OBSOLETE_INDEXES.items():
+        existing = {ix['name'] for ix in inspector.get_indexes(table_name)}
+        if name not in existing or replaced_by not in existing:
+            continue
+        print(f"删除索引: {name} ON {table_name}")
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP INDEX {preparer.quote(name)}")
+        dropped.append(name)
+    return dropped
+
+
+def upgrade_database():
+    """升级数据库结构"""
+    print("开始升级数据库结构...")
+    tables = create_missing_tables()
+    columns = add_missing_columns()
+    indexes = create_missing_indexes()
+    dropped = drop_obsolete_indexes()
+    run_backfills(tables + columns)
+    print(f"数据库升级完成：新建表 {len(tables)} 个，新增列 {len(columns)} 个，新建索引 {len(indexes)} 个，"
+          f"删除旧索引 {len(dropped)} 个")
+
+
+def hot_queries():
+    """各蓝图中的热点查询（参数取任意示例值，仅用于生成查询计划）"""
+    now = datetime.now()
+    today = date.today()
+    return [
+        ('student.dashboard 已选课程数',
+         SelectedCourse.query.filter_by(student_id=1)),
+        ('student.dashboard 待审批请假数',
+         LeaveApplication.query.filter_by(student_id=1, status='pending')),
+        ('student.dashboard 教室借用数',
+         ClassroomBooking.query.filter_by(student_id=1).filter(
+             ClassroomBooking.status.in_(['pending', 'approved']))),
+        ('student.dashboard 近期考试数',
+         Exam.query.filter_by(class_id=1).filter(
+             Exam.exam_time >= now, Exam.exam_time <= now + timedelta(days=7))),
+        ('student.dashboard 近期公告数',
+         Announcement.query.join(SelectedCourse, Announcement.course_id == SelectedCourse.course_id).filter(
+             SelectedCourse.student_id == 1, Announcement.created_at >= now - timedelta(days=7))),
+        ('student.schedule 班级课表',
+         Schedule.query.filter_by(class_id=1)),
+        ('student.check_course_conflict 课程时间',
+         Schedule.query.filter(Schedule.course_id.in_([1, 2, 3]))),
+        ('student.exam_schedule 考试安排',
+         Exam.query.filter_by(class_id=1).order_by(Exam.exam_time)),
+        ('student.booking_records 借用记录',
+         ClassroomBooking.query.filter_by(student_id=1).order_by(ClassroomBooking.created_at.desc())),
+        ('student.grades 学生成绩',
+         Grade.query.filter_by(student_id=1)),
+        ('student.course_announcements 课程公告',
+         Announcement.query.join(SelectedCourse, Announcement.course_id == SelectedCourse.course_id).filter(
+             SelectedCourse.student_id == 1).order_by(Announcement.created_at.desc())),
+        ('availability 按日期加载借用占用',
+         ClassroomBooking.query.filter(
+             ClassroomBooking.booking_date.in_([today]), ClassroomBooking.status.in_(['pending', 'approved']))),
+        ('bookings 写锁内按日期范围复查借用（单次/重复借用）',
+         ClassroomBooking.query.filter(
+             ClassroomBooking.classroom_id == 1,
+             ClassroomBooking.booking_date.between(today, today + timedelta(weeks=20)),
+             ClassroomBooking.status.in_(['pending', 'approved']), ClassroomBooking.start_time < datetime.now().time(),
+             ClassroomBooking.end_time > datetime.now().time())),
+        ('bookings.resolve_pending 按日期范围加载待审批借用',
+         ClassroomBooking.query.join(Classroom, Classroom.id == ClassroomBooking.classroom_id).filter(
+             ClassroomBooking.booking_date.between(today, today + timedelta(days=7)),
+             ClassroomBooking.status == 'pending')),
+        ('availability 按星期加载课表占用',
+         Schedule.query.filter(Schedule.classroom_id.isnot(None), Schedule.day_of_week.in_([1, 2]))),
+        ('availability 按日期加载考场占用',
+         db.session.query(Exam.id, exam_classrooms.c.classroom_id).join(
+             exam_classrooms, exam_classrooms.c.exam_id == Exam.id
+         ).filter(Exam.exam_time >= now, Exam.exam_time < now + timedelta(days=1))),
+        ('teacher.dashboard 课程数',
+         Course.query.filter_by(teacher_id=1)),
+        ('teacher.dashboard 最近公告',
+         Announcement.query.filter_by(teacher_id=1).order_by(Announcement.created_at.desc()).limit(5)),
+        ('teacher.dashboard 最近资料',
+         CourseMaterial.query.filter_by(teacher_id=1).order_by(CourseMaterial.created_at.desc()).limit(5)),
+        ('teacher.material_manage 课程资料',
+         CourseMaterial.query.filter_by(course_id=1)),
+        ('teacher.grade_manage 选课人数',
+         SelectedCourse.query.filter_by(course_id=1)),
+        ('teacher.course_grades 课程成绩',
+         Grade.query.filter_by(course_id=1)),
+        ('teacher.update_grades 单个成绩',
+         Grade.query.filter_by(student_id=1, course_id=1)),
+        ('counselor.dashboard 负责班级',
+         db.session.query(User.id).filter(User.class_id == 1)),
+        ('counselor.academic_alerts 预警列表（游标分页）',
+         AcademicAlert.query.filter_by(counselor_id=1, status='active').filter(
+             db.tuple_(AcademicAlert.created_at, AcademicAlert.id) < db.tuple_(now, 1000)
+         ).order_by(AcademicAlert.created_at.desc(), AcademicAlert.id.desc()).limit(51)),
+        ('counselor.generate_alerts 预警查重',
+         AcademicAlert.query.filter_by(student_id=1, semester='2023-2024-1')),
+        ('counselor.academic_alerts 按挂科课程筛选',
+         AcademicAlert.query.filter_by(counselor_id=1, status='active').filter(AcademicAlert.id.in_(
+             db.session.query(alert_failed_courses.c.alert_id).join(
+                 Course, Course.id == alert_failed_courses.c.course_id
+             ).filter(Course.course_name == '高等数学')))),
+        ('counselor.alert_detail 辅导记录',
+         CounselingRecord.query.filter_by(alert_id=1).order_by(CounselingRecord.counseling_time.desc())),
+    ]
+
+
+def explain_report():
+    """输出每个热点查询的 EXPLAIN QUERY PLAN，标记出全表扫描"""
+    if db.engine.dialect.name != 'sqlite':
+        print("查询计划报告仅支持 SQLite")
+        return True
+
+    all_indexed = True
+    print("=" * 70)
+    print("EXPLAIN QUERY PLAN 报告")
+    print("=" * 70)
+    for name, query in hot_queries():
+        compiled = query.statement.compile(dialect=db.engine.dialect,
+                                           compile_kwargs={'literal_binds': True})
+        rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}').fetchall()
+        details = [row[-1] for row in rows]
+        # "SCAN 表名" 且未使用索引即为全表扫描
+        full_scans = [d for d in details if d.startswith('SCAN') and 'INDEX' not in d]
+        status = '全表扫描' if full_scans else '使用索引'
+        all_indexed = all_indexed and not full_scans
+        print(f"[{status}] {name}")
+        for detail in details:
+            print(f"    {detail}")
+
+    print("=" * 70)
+    print("所有热点查询均使用索引" if all_indexed else "存在未使用索引的查询")
+    return all_indexed
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        if '--explain' not in sys.argv:
+            upgrade_database()
+            if '--rebuild' in sys.argv:
+                rebuild_derived_data()
+        ok = explain_report()
+    sys.exit(0 if ok else 1)